@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""
+Пропускная способность SocketAPIHandler.parse с разными JSON кодеками: разбор запроса, вызов, ответ в сокет.
+Сценарии:
+  ping   - короткий JSON-RPC запрос
+  large  - ping с большим вложенным params
+  legacy - legacy команда с dict в params, обработчик с parsed получает объект без json строки
+  batch  - JSON-RPC batch из 10 ping
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from lib import json_codec  # noqa
+from lib.api.misc import api_commands, json_parser  # noqa
+from lib.api.socket_api_handler import APIHandler, SocketAPIHandler  # noqa
+from lib.socket_wrapper import Connect  # noqa
+
+SCENARIOS = ('ping', 'large', 'legacy', 'batch')
+
+
+class _Cfg(dict):
+    def gt(self, sec, key, default=None):
+        return self.get(sec, {}).get(key, default)
+
+
+class _Owner:
+    @staticmethod
+    def has_subscribers(*_):
+        return False
+
+
+class _Sink:
+    def __init__(self):
+        self.size = 0
+
+    def send(self, data: bytes):
+        self.size += len(data)
+        return len(data)
+
+
+class _APIHandler(APIHandler):
+    @api_commands('bench.legacy', parsed=True)
+    def _api_bench_legacy(self, _, data: str):
+        # Как model.upload: строка params снова разбирается обработчиком
+        data = json_parser(data, keys=('filename', 'data'))
+        return len(data['data'])
+
+
+def _log(*_, **__):
+    pass
+
+
+def _requests(scenario: str, count: int) -> list:
+    params = {'filename': 'model.pmdl', 'data': 'x' * 256, 'tags': [{'id': x, 'value': 'тест'} for x in range(20)]}
+    if scenario == 'ping':
+        msg = [{'jsonrpc': '2.0', 'method': 'ping', 'params': ['1'], 'id': idx} for idx in range(count)]
+    elif scenario == 'large':
+        msg = [{'jsonrpc': '2.0', 'method': 'ping', 'params': [params], 'id': idx} for idx in range(count)]
+    elif scenario == 'legacy':
+        msg = [{'jsonrpc': '2.0', 'method': 'bench.legacy', 'params': params, 'id': idx} for idx in range(count)]
+    else:
+        msg = [[{'method': 'ping', 'params': [str(x)], 'id': x} for x in range(10)] for _ in range(count // 10)]
+    return [json.dumps(x, ensure_ascii=False) for x in msg]
+
+
+def run(codec: str, data: list) -> tuple:
+    json_codec.select(codec)
+    handler = SocketAPIHandler(_Cfg(), _log, _Owner(), 'Bench', _APIHandler)
+    sink = _Sink()
+    handler._conn = Connect(sink, ('127.0.0.1', 0), None, True)
+    start = time.perf_counter()
+    for line in data:
+        handler.parse(line)
+    return len(data) / (time.perf_counter() - start), sink.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SocketAPIHandler.parse throughput by JSON codec')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='Messages per run')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--codecs', default='', help='Comma separated (all installed)')
+    parser.add_argument('--scenarios', default='', help='Comma separated (all)')
+    args = parser.parse_args()
+
+    installed = [x for x in json_codec.CODECS if getattr(json_codec, x, None)]
+    codecs = [x.strip() for x in args.codecs.split(',') if x.strip()] or installed
+    selected = [x.strip() for x in args.scenarios.split(',') if x.strip()] or SCENARIOS
+    print('{:<8} {:<8} {:>12} {:>12}'.format('scenario', 'codec', 'msg/s', 'sent, KiB'))
+    for scenario in selected:
+        if scenario not in SCENARIOS:
+            print('{:<8} skip: unknown'.format(scenario))
+            continue
+        data = _requests(scenario, args.count)
+        for codec in codecs:
+            if codec not in installed:
+                print('{:<8} {:<8} skip: not installed'.format(scenario, codec))
+                continue
+            results = sorted(run(codec, data) for _ in range(args.runs))
+            # медиана
+            rate, size = results[len(results) // 2]
+            print('{:<8} {:<8} {:>12.0f} {:>12.1f}'.format(scenario, codec, rate, size / 1024))
+
+
+if __name__ == '__main__':
+    main()
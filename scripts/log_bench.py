@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""
+Нагрузка логгера от API: SocketAPIHandler разбирает поток ping запросов, каждый пишет DEBUG строки.
+Сценарии:
+  info       - лог в файл с уровнем info, DEBUG отсеивается до очереди
+  debug      - лог в файл с уровнем debug, пишется все
+  subscriber - как info, но на log подписан кто-то еще (удаленный лог, duplex), все идет и через шину
+Время:
+  parse - разбор запросов в потоке API, us на запрос
+  drain - пока логгер не разгреб очередь после последнего запроса, ms
+lines - сколько строк дошло до логгера
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import logger  # noqa
+from lib.api.socket_api_handler import SocketAPIHandler  # noqa
+from lib.publisher import PubSub  # noqa
+
+SCENARIOS = ('info', 'debug', 'subscriber')
+
+
+class _Cfg(dict):
+    def __init__(self, lvl: str, file: str):
+        super().__init__(log={'file_lvl': lvl, 'print_lvl': 'crit', 'method': 1, 'file': file, 'print_ms': True})
+
+    def gt(self, sec, key, default=None):
+        return self.get(sec, {}).get(key, default)
+
+
+class _Logger(logger.Logger):
+    def __init__(self, tmp_own):
+        self.lines = 0
+        super().__init__(tmp_own)
+
+    def _best_print(self, *args):
+        self.lines += 1
+        super()._best_print(*args)
+
+
+class _Owner:
+    def __init__(self, pub: PubSub):
+        self._pub = pub
+
+    def __getattr__(self, item):
+        # subscribe, unsubscribe, registration, has_subscribers, sub_call
+        return getattr(self._pub, item)
+
+
+def _requests(count: int, size: int) -> list:
+    return [json.dumps({'method': 'ping', 'params': ['x' * size], 'id': idx}) for idx in range(count)]
+
+
+def run(scenario: str, data: list, tmp: str) -> tuple:
+    pub = PubSub()
+    own = _Owner(pub)
+    log = _Logger(own)
+    cfg = _Cfg('debug' if scenario == 'debug' else 'info', os.path.join(tmp, '{}.log'.format(scenario)))
+    log.init(cfg, own)
+    received = []
+    if scenario == 'subscriber':
+        pub.subscribe(log.EVENT, lambda *args: received.append(args))
+        while not own.has_subscribers(log.EVENT):
+            time.sleep(0.01)
+    handler = SocketAPIHandler(cfg, log.add('API'), own, 'Bench')
+    handler.api.set('auth', True)
+    try:
+        start = time.perf_counter()
+        for line in data:
+            handler._parse(line)
+        parsed = time.perf_counter()
+        while log._queue.qsize() or pub._queue.qsize():
+            time.sleep(0.001)
+        drained = time.perf_counter()
+    finally:
+        log.join()
+        pub.join()
+    return (parsed - start) / len(data) * 1e6, (drained - parsed) * 1000, log.lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Logger load from API traffic')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='Requests per run')
+    parser.add_argument('--size', type=int, default=200, help='Request params size')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--scenarios', default='', help='Comma separated (all)')
+    args = parser.parse_args()
+
+    data = _requests(args.count, args.size)
+    selected = [x.strip() for x in args.scenarios.split(',') if x.strip()] or SCENARIOS
+    print('{:<12} {:>12} {:>12} {:>8}'.format('scenario', 'parse, us', 'drain, ms', 'lines'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for scenario in selected:
+            if scenario not in SCENARIOS:
+                print('{:<12} skip: unknown'.format(scenario))
+                continue
+            results = sorted(run(scenario, data, tmp) for _ in range(args.runs))
+            # медиана
+            parse, drain, lines = results[len(results) // 2]
+            print('{:<12} {:>12.2f} {:>12.1f} {:>8}'.format(scenario, parse, drain, lines))
+
+
+if __name__ == '__main__':
+    main()
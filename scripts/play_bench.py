@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+"""
+Задержка от запроса до первого звука для разных способов воспроизведения.
+Гоняет Player.say/play на файлах, кэше, стримах (mp3/opus/wav) через play_utils.CMD, BACKENDS и AudioSink.
+
+Метки времени:
+  spawn  - первый запущенный процесс
+  write  - первая запись в stdin процесса (стримы, синк)
+  output - первые байты дошли до вывода (только --device fake и синк)
+  done   - плеер закончил (fake пробник не держит темп, синк держит)
+
+--device fake (по умолчанию) - вывод (aplay, плееры) заменен на пробник, который отмечает первые байты.
+  Декодеры (mpg123, opusdec) настоящие.
+--device null - настоящие программы, ALSA null / пустой вывод.
+"""
+
+import argparse
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from lib import audio_sink, play_utils  # noqa
+from player import Player  # noqa
+from utils import RingBuffer  # noqa
+
+RESOURCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'resources')
+OUT_ENV = 'PLAY_BENCH_OUT'
+METRICS = ('spawn', 'write', 'output', 'done')
+PERCENTILES = (50, 90, 99)
+
+# Пробник вместо вывода: пишет время первого байта в файл из OUT_ENV и дочитывает поток
+PROBE = (
+    'probe() { f="$1"; [ "$f" = - ] && f=/dev/stdin; '
+    '[ "$(head -c 1 "$f" | wc -c)" -gt 0 ] && date +%s.%N >> "$' + OUT_ENV + '"; '
+    '[ "$f" = /dev/stdin ] && cat > /dev/null; return 0; }; '
+)
+# Аргументы для вывода в никуда
+NULL_ARGS = {
+    'aplay': ['-D', 'null'],
+    'mpg123': ['-o', 'dummy'],
+    'mpv': ['--ao=null'],
+    'mplayer': ['-ao', 'null'],
+    'vlc': ['--aout=dummy'],
+}
+# Что нужно сценарию кроме вывода
+NEED = {'.mp3': 'mpg123', '.opus': 'opusdec', '.wav': None}
+
+_events = []
+_events_lock = threading.Lock()
+
+
+def _event(name, ts=None):
+    with _events_lock:
+        _events.append((name, ts or time.time()))
+
+
+class _TimedStdin:
+    def __init__(self, fp, output: bool):
+        self._fp = fp
+        self._output = output
+
+    def write(self, data):
+        _event('write')
+        if self._output:
+            _event('output')
+        return self._fp.write(data)
+
+    def __getattr__(self, item):
+        return getattr(self._fp, item)
+
+
+class _TimedPopen(subprocess.Popen):
+    device = 'fake'
+
+    def __init__(self, args, *pargs, **kwargs):
+        output = args == audio_sink.SINK_CMD
+        super().__init__(self._rewrite(list(args)), *pargs, **kwargs)
+        _event('spawn')
+        if self.stdin is not None:
+            self.stdin = _TimedStdin(self.stdin, output)
+
+    @classmethod
+    def _rewrite(cls, args: list) -> list:
+        name = os.path.basename(args[0])
+        if name == 'mpg123' and '-s' in args:
+            # Декодер, не вывод
+            return args
+        if cls.device == 'null':
+            return args[:1] + NULL_ARGS.get(name, []) + args[1:]
+        if name == 'mpg123':
+            return ['sh', '-c', PROBE + 'mpg123 -q -s "$1" | probe -', 'probe', args[-1]]
+        if name in ('aplay', 'mpv', 'vlc', 'mplayer'):
+            return ['sh', '-c', PROBE + 'probe "$1"', 'probe', args[-1]]
+        return args
+
+
+class _Cfg:
+    def __init__(self, backend: str, pcm: bool):
+        # Кэш PCM только для своего сценария, иначе сигналы из ресурсов играют из памяти
+        self._pcm_size = 8 if pcm else 0
+        self._settings = {
+            'software_player': backend if backend in play_utils.BACKENDS else '',
+            'output_sink': backend == 'sink',
+            'no_background_play': False,
+            'alarmtts': False,
+            'quiet': False,
+        }
+        self.path = {name: os.path.join(RESOURCES, name + ext) for name, ext in (
+            ('ding', '.wav'), ('dong', '.wav'), ('bimp', '.mp3'), ('tts_error', '.mp3')
+        )}
+
+    def gts(self, key, default=None):
+        return self._settings.get(key, default)
+
+    def gt(self, sec, key, default=None):
+        return {'cache': {'pcm_size': self._pcm_size}}.get(sec, {}).get(key, default)
+
+
+class _Owner:
+    music_plays = False
+
+    def __init__(self):
+        self.target = None
+
+    def tts(self, msg, **_):
+        return self.target() if callable(self.target) else self.target
+
+    def say_callback(self, _):
+        pass
+
+    @staticmethod
+    def messenger(call, callback, *args, **kwargs):
+        result = call(*args, **kwargs)
+        if callback:
+            callback(result)
+
+
+def _feeder(path: str, chunk: int, delay: float) -> RingBuffer:
+    # Провайдер отдает файл кусками по chunk байт с паузой delay
+    buff = RingBuffer()
+
+    def feed():
+        with open(path, 'rb') as fp:
+            data = fp.read(chunk)
+            while data:
+                buff.write(data)
+                if delay:
+                    time.sleep(delay)
+                data = fp.read(chunk)
+        buff.close()
+    threading.Thread(target=feed, name='BenchFeeder').start()
+    return buff
+
+
+def _opus_file(tmp: str) -> str or None:
+    path = os.path.join(tmp, 'ding.opus')
+    if shutil.which('opusenc'):
+        cmd = ['opusenc', '--quiet', os.path.join(RESOURCES, 'ding.wav'), path]
+        if not subprocess.run(cmd, stderr=subprocess.DEVNULL).returncode:
+            return path
+    return None
+
+
+def _scenarios(tmp: str, chunk: int, delay: float) -> dict:
+    wav, mp3 = os.path.join(RESOURCES, 'ding.wav'), os.path.join(RESOURCES, 'tts_error.mp3')
+    cached = os.path.join(tmp, 'google_cached.mp3')
+    shutil.copyfile(mp3, cached)
+    # имя: (расширение, play или say, цель для own.tts)
+    result = {
+        'wav': ('.wav', 'play', wav),
+        'mp3': ('.mp3', 'play', mp3),
+        'pcm': ('.wav', 'pcm', wav),
+        'cached': ('.mp3', 'say', (cached, None, '.mp3')),
+        'stream-mp3': ('.mp3', 'say', lambda: (mp3, _feeder(mp3, chunk, delay), '.mp3')),
+        'stream-wav': ('.wav', 'say', lambda: (wav, _feeder(wav, chunk, delay), '.wav')),
+    }
+    opus = _opus_file(tmp)
+    if opus:
+        result['opus'] = ('.opus', 'play', opus)
+        result['stream-opus'] = ('.opus', 'say', lambda: (opus, _feeder(opus, chunk, delay), '.opus'))
+    return result
+
+
+def _missing(ext: str, backend: str, device: str) -> str or None:
+    need = [NEED[ext]] if backend in ('', 'sink') else []
+    if device == 'null' and (backend == 'sink' or backend == '' and ext != '.mp3'):
+        # В fake aplay заменен пробником
+        need.append('aplay')
+    for name in need:
+        if name and not shutil.which(name):
+            return name
+    return None
+
+
+def _collect(t0: float, out_file: str) -> dict:
+    with open(out_file, 'r+') as fp:
+        for line in fp:
+            try:
+                _event('output', float(line))
+            except ValueError:
+                pass
+        fp.truncate(0)
+    with _events_lock:
+        events = list(_events)
+        _events.clear()
+    result = {}
+    for name, ts in events:
+        if ts >= t0 and (name not in result or ts < result[name]):
+            result[name] = ts
+    return {name: (ts - t0) * 1000 for name, ts in result.items()}
+
+
+def _percentile(values: list, pct: int) -> float:
+    # nearest-rank
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def run(name: str, scenario: tuple, backend: str, args, log) -> dict or str:
+    ext, mode, target = scenario
+    missing = _missing(ext, backend, args.device)
+    if missing:
+        return 'skip: {} not found'.format(missing)
+    own = _Owner()
+    player = Player(_Cfg(backend, mode == 'pcm'), log, own)
+    player.start()
+    results = {metric: [] for metric in METRICS}
+    try:
+        if mode == 'pcm' and not player._pcm.load(target):
+            return 'skip: PCM decode failed'
+        for idx in range(args.warmup + args.count):
+            time.sleep(args.pause)
+            _collect(0, args.out)
+            t0 = time.time()
+            if mode == 'say':
+                own.target = target
+                player.say(name, lvl=2)
+            else:
+                player.play(target, lvl=2)
+            player._wait_popen(args.timeout)
+            done = time.time()
+            times = _collect(t0, args.out)
+            times['done'] = (done - t0) * 1000
+            if idx < args.warmup:
+                continue
+            for metric, value in times.items():
+                results[metric].append(value)
+    finally:
+        player.stop()
+    return results
+
+
+def _fmt(values: list) -> str:
+    if not values:
+        return '-'
+    return '/'.join('{:.1f}'.format(_percentile(values, pct)) for pct in PERCENTILES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Playback latency benchmark, ms p50/p90/p99')
+    parser.add_argument('--device', choices=('fake', 'null'), default='fake')
+    parser.add_argument('--backends', default='', help='Comma separated: default,sink,mpv,... (all available)')
+    parser.add_argument('--scenarios', default='', help='Comma separated (all)')
+    parser.add_argument('--chunks', default='4096', help='StreamPlayer chunk sizes, comma separated')
+    parser.add_argument('--delay', type=float, default=0, help='Pause between stream chunks, ms')
+    parser.add_argument('-n', '--count', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--pause', type=float, default=0.05, help='Pause between runs, sec')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    _TimedPopen.device = args.device
+    subprocess.Popen = _TimedPopen
+    backends = [x.strip() for x in args.backends.split(',') if x.strip()] or \
+        ['default', 'sink'] + [key for key in play_utils.BACKENDS if key]
+    chunks = [int(x) for x in args.chunks.split(',') if x.strip()]
+
+    def log(msg, lvl=0):
+        if args.verbose:
+            print('  [{}] {}'.format(lvl, msg() if callable(msg) else msg))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        args.out = os.path.join(tmp, 'probe.txt')
+        open(args.out, 'w').close()
+        os.environ[OUT_ENV] = args.out
+        print('{:<12} {:<8} {:>6} {:>4}  {}'.format(
+            'scenario', 'backend', 'chunk', 'n', '  '.join('{:>20}'.format(x) for x in METRICS)))
+        for chunk in chunks:
+            play_utils.StreamPlayer.CHUNK = chunk
+            scenarios = _scenarios(tmp, chunk, args.delay / 1000)
+            selected = [x.strip() for x in args.scenarios.split(',') if x.strip()] or list(scenarios)
+            for name in selected:
+                if name not in scenarios:
+                    print('{:<12} skip: unknown or unavailable'.format(name))
+                    continue
+                for backend in backends:
+                    result = run(name, scenarios[name], '' if backend == 'default' else backend, args, log)
+                    if isinstance(result, str):
+                        print('{:<12} {:<8} {}'.format(name, backend, result))
+                        continue
+                    print('{:<12} {:<8} {:>6} {:>4}  {}'.format(
+                        name, backend, chunk if name.startswith('stream') else '-', len(result['done']),
+                        '  '.join('{:>20}'.format(_fmt(result[x])) for x in METRICS)
+                    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,8 +17,11 @@ from lib.keys_utils import Keystore
 from lib.map_settings.wiki_parser import WikiParser
 from lib.models_storage import ModelsStorage
 from lib.proxy import proxies
+from lib.sessions import sessions
 from lib.state_helper import state_helper
 from lib.tools.config_updater import ConfigUpdater
+from lib.tts_cache import OpusTranscoder, TTSCache
+from lib.tts_share import ShareClient
 from owner import Owner
 
 DATA_FORMATS = {'json': '.json', 'yaml': '.yml'}
@@ -53,6 +56,9 @@ class ConfigHandler(utils.HashableDict):
         self.platform = platform.system().capitalize()
         self.detector = None
         self.models = ModelsStorage()
+        self.tts_cache = TTSCache()
+        self._transcoder = None
+        self.tts_share = ShareClient()
         self._save_me_later = False
         self._allow_addresses = []
         self.update(cfg)
@@ -238,6 +244,8 @@ class ConfigHandler(utils.HashableDict):
 
     def proxies_init(self):
         proxies.configure(self.get('proxy', {}))
+        # Открытые соединения идут мимо новых настроек
+        sessions.clear()
 
     def apm_configure(self):
         APMSettings().cfg(**self['noise_suppression'])
@@ -436,36 +444,26 @@ class ConfigHandler(utils.HashableDict):
         return False
 
     def tts_cache_check(self):
-        min_file_size = 1024
-        max_size = self['cache'].get('tts_size', 50) * 1024 * 1024
+        self.tts_share.url = self.gt('cache', 'share_url', '')
         cache_path = self.gt('cache', 'path')
         if not os.path.isdir(cache_path):
             msg = F('Директория c tts кэшем не найдена {}', cache_path)
             self.log(msg)
             self.own.say_info(msg)
+            self.tts_transcoder_stop()
             return
-        current_size = 0
-        files, wrong_files = [], []
-        # Формируем список из пути и размера файлов, заодно считаем общий размер.
-        # Файлы по 1 KiB считаем поврежденными и удалим в любом случае
-        for file in os.listdir(cache_path):
-            pfile = os.path.join(cache_path, file)
-            if os.path.isfile(pfile):
-                fsize = os.path.getsize(pfile)
-                if fsize > min_file_size:
-                    current_size += fsize
-                    files.append([pfile, fsize])
-                else:
-                    wrong_files.append(pfile)
-
-        # Удаляем поврежденные файлы
+        max_size = self['cache'].get('tts_size', 50) * 1024 * 1024
+        wtime = time.time()
+        wrong_files = self.tts_cache.load(cache_path)
+        self.tts_cache.max_size = max_size
+        self.log('TTS cache index: {} files in {}'.format(len(self.tts_cache), utils.pretty_time(time.time() - wtime)))
+
         if wrong_files:
-            for file in wrong_files:
-                os.remove(file)
-            wrong_files = [os.path.split(file)[1] for file in wrong_files]
             self.log(F('Удалены поврежденные файлы: {}', ', '.join(wrong_files)), logger.WARN)
+        self._tts_transcoder_check()
 
-        normal_size = not files or current_size < max_size or max_size < 0
+        current_size = self.tts_cache.size
+        normal_size = not len(self.tts_cache) or current_size < max_size or max_size < 0
         say = F('Размер tts кэша {}: {}', utils.pretty_size(current_size), F('Ок.') if normal_size else F('Удаляем...'))
         self.log(say, logger.INFO)
 
@@ -473,23 +471,27 @@ class ConfigHandler(utils.HashableDict):
             return
         self.own.say_info(say)
 
-        new_size = int(max_size * 0.7)
-        deleted_files = 0
-        # Сортируем файлы по дате последнего доступа
-        files.sort(key=lambda x: os.path.getatime(x[0]))
-        deleted = []
-        for file in files:
-            if current_size <= new_size:
-                break
-            current_size -= file[1]
-            os.remove(file[0])
-            deleted_files += 1
-            deleted.append(os.path.split(file[0])[1])
+        deleted = self.tts_cache.evict()
         self.log(F('Удалено: {}', ', '.join(deleted)))
-        msg = F('Удалено {} файлов. Новый размер TTS кэша {}', deleted_files, utils.pretty_size(current_size))
+        msg = F('Удалено {} файлов. Новый размер TTS кэша {}', len(deleted), utils.pretty_size(self.tts_cache.size))
         self.log(msg, logger.INFO)
         self.own.say_info(msg)
 
+    def _tts_transcoder_check(self):
+        if not (self.gt('cache', 'tts_opus') and self.gt('cache', 'tts_size', 50) > 0):
+            return self.tts_transcoder_stop()
+        if self._transcoder:
+            return
+        if not OpusTranscoder.available():
+            return self.log('Opus transcoder disabled: ffmpeg or opusenc not found', logger.WARN)
+        self._transcoder = OpusTranscoder(self.tts_cache, self.log)
+        self._transcoder.start()
+
+    def tts_transcoder_stop(self):
+        if self._transcoder:
+            self._transcoder.join(OpusTranscoder.TIMEOUT)
+            self._transcoder = None
+
     def _make_dir(self, path: str):
         if not os.path.isdir(path):
             self.log(F('Директория {} не найдена. Создаю...', path), logger.INFO)
@@ -27,6 +27,17 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
         'lang_check': False,
         'software_player': '',
         'lazy_record': False,
+        'tts_workers': 4,
+        'tts_provider_limit': 2,
+        'tts_queue_limit': 100,
+        'tts_chunk_size': 200,
+        'output_sink': False,
+        'stream_buffer': 256,
+        'tts_preconnect': False,
+        'pubsub_workers': 4,
+        'pubsub_queue': 100,
+        'pubsub_policy': 'drop_oldest',
+        'pubsub_slow': 500,
     },
     'listener': {
         'detector': '',
@@ -39,6 +50,7 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
         'silent_multiplier': 1.0,
         'speech_timeout': 3,
         'no_listen_music': False,
+        'speculative_partials': 0,
     },
     'smarthome': {
         'ip': '',
@@ -54,9 +66,14 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
         'allow_addresses': '',
         'disable_http': False,
         'disable_server': False,
+        'server_clients': 10,
         'unsafe_rpc': False,
         'send_rms': False,
         'async_notify': True,
+        'notify_coalesce': 250,
+        'duplex_async': True,
+        'batch_workers': 4,
+        'batch_timeout': 30,
     },
     'music': {
         'control': True,
@@ -79,6 +96,7 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
         'print_ms': True,
         'method': 3,
         'file': '',
+        'file_format': 'text',
     },
     'yandex': {
         'api': 1,
@@ -120,6 +138,10 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
     'cache': {
         'tts_priority': '',
         'tts_size': 100,
+        'pcm_size': 8,
+        'tts_opus': False,
+        'share_port': 0,
+        'share_url': '',
         'path': '',
     },
     'models': {
@@ -175,7 +197,7 @@ CFG = {  # Дефолтные настройки https://github.com/Aculeasis/md
 
 STATE = {
     'system': {
-        'ini_version': 54,
+        'ini_version': 72,
         'merge': 1,
         'PLUGINS_API': 3,
         'VERSION': (0, 18, 10),
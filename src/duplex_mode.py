@@ -8,9 +8,10 @@ from uuid import uuid4
 
 import logger
 from lib.api.misc import api_commands
-from lib.api.socket_api_handler import SocketAPIHandler, APIHandler
+from lib.api.socket_api_handler import BatchPool, SocketAPIHandler, APIHandler
+from lib.duplex_async import DuplexLoop
 from lib.socket_wrapper import Connect
-from lib.subscriptions_worker import SubscriptionsWorker
+from lib.subscriptions_worker import AsyncSubscriptions, SubscriptionsWorker
 from owner import Owner
 from utils import pretty_time
 
@@ -26,6 +27,9 @@ class DuplexPool(threading.Thread):
         self._queue = queue.Queue()
         self._pool = OrderedDict()
         self._pool_size = None
+        self._loop = None
+        # Один на все подключения пула
+        self._batch_pool = BatchPool()
         self.work = False
         self.own.subscribe(self.UPGRADE_DUPLEX, self._handle_upgrade_duplex, self.UPGRADE_DUPLEX)
 
@@ -79,9 +83,19 @@ class DuplexPool(threading.Thread):
         self.log('New worker: {}::{}:{}'.format(*conn.info))
         id_ = '{}'.format(uuid4())
         name = '{}:{}'.format(*conn.info[1:])
-        self._pool[id_] = DuplexInstance(
-            self.cfg, self.log.add(name), self.own, name, conn, cmd, lambda: self._queue.put_nowait(('del', id_))
+        args = (
+            self.cfg, self.log.add(name), self.own, name, conn, cmd, lambda: self._queue.put_nowait(('del', id_)),
+            self._batch_pool
         )
+        detached = conn.detach() if self.cfg.gt('smarthome', 'duplex_async') else None
+        if detached:
+            if not self._loop:
+                self._loop = DuplexLoop()
+                self._loop.start()
+            self._pool[id_] = AsyncDuplexInstance(self._loop, detached, *args)
+        else:
+            # TLS и прочее что нельзя отдать циклу, по старинке - тред на подключение
+            self._pool[id_] = DuplexInstance(*args)
         self._remove_overloads()
 
     def _del_worker(self, id_: str):
@@ -128,6 +142,10 @@ class DuplexPool(threading.Thread):
                 self.log('get cmd: {}. WTF?'.format(cmd), logger.CRIT)
         self._pool_size = 0
         self._remove_overloads()
+        if self._loop:
+            self._loop.join(5)
+            self._loop = None
+        self._batch_pool.shutdown()
 
 
 def _make_dict_reply(cmd: str or None) -> dict:
@@ -137,28 +155,42 @@ def _make_dict_reply(cmd: str or None) -> dict:
         return {'method': 'ping', 'params': [str(time.time())], 'id': 'pong'}
 
 
+def _stats_str(stats: dict) -> str:
+    return '{messages} messages, {bytes} bytes in {syscalls} writes'.format(**stats)
+
+
 class _APIHandler(APIHandler):
-    @api_commands('subscribe', pure_json=True)
+    @api_commands('subscribe', pure_json=True, serial=True)
     def _api_subscribe(self, _, data: list):
         return self.get('notify_worker').subscribe(data)
 
-    @api_commands('unsubscribe', pure_json=True)
+    @api_commands('unsubscribe', pure_json=True, serial=True)
     def _api_unsubscribe(self, _, data: list):
         return self.get('notify_worker').unsubscribe(data)
 
+    @api_commands('subscribe.coalesce', pure_json=True, serial=True)
+    def _api_subscribe_coalesce(self, _, data: dict):
+        """
+        Склейка частых событий этой подписки: {"window": ms, "events": {событие: off | latest | batch | null}}.
+        latest - за окно приходит последнее значение, batch - последнее и все значения в params.batch.
+        null - политика по умолчанию.
+        """
+        return self.get('notify_worker').coalesce(data)
+
     @api_commands('events_list', pure_json=True)
     def _api_events_list(self, *_):
         return self.get('notify_worker').events_list()
 
 
 class DuplexInstance(SocketAPIHandler):
-    def __init__(self, cfg, log, owner: Owner, name: str, conn: Connect, cmd: str or None, close_callback):
-        super().__init__(cfg, log, owner, name, _APIHandler)
+    def __init__(self, cfg, log, owner: Owner, name: str, conn: Connect, cmd: str or None, close_callback,
+                 batch_pool: BatchPool):
+        super().__init__(cfg, log, owner, name, _APIHandler, batch_pool)
         self.api.getters_up({'notify_worker': lambda : self._notify_worker})
         self._conn = conn
         self.__cmd = cmd
         self.__close_callback = close_callback
-        self._notify_worker = SubscriptionsWorker(owner, conn)
+        self._notify_worker = SubscriptionsWorker(owner, conn, cfg.gt('smarthome', 'notify_coalesce', 0) / 1000)
         super().start()
 
     def close_signal(self):
@@ -182,7 +214,7 @@ class DuplexInstance(SocketAPIHandler):
                     self.parse(line)
         finally:
             self._conn.close()
-            self.log('close.', logger.INFO)
+            self.log('close. Sent: {}'.format(_stats_str(self._conn.write_stats)), logger.INFO)
             self.__close_callback()
 
     def _testing(self) -> bool:
@@ -194,3 +226,68 @@ class DuplexInstance(SocketAPIHandler):
             self.log('OPEN ERROR: {}'.format(e), logger.ERROR)
             return False
         return True
+
+
+class AsyncDuplexInstance(SocketAPIHandler):
+    """
+    DuplexInstance без своего треда: сокет живет в DuplexLoop, команды выполняются в пуле потоков цикла
+    строго по порядку, ответы и уведомления уходят через цикл.
+    """
+    def __init__(self, loop: DuplexLoop, detached: tuple, cfg, log, owner: Owner, name: str, conn: Connect,
+                 cmd: str or None, close_callback, batch_pool: BatchPool):
+        super().__init__(cfg, log, owner, name, _APIHandler, batch_pool)
+        self.api.getters_up({'notify_worker': lambda : self._notify_worker})
+        self._loop = loop
+        self.__close_callback = close_callback
+        self.__closed = threading.Event()
+        self.__lines = []
+        self.__busy = False
+        self.work = True
+        sock, ws, auth = detached
+        self._conn = loop.attach(sock, ws, (conn.ip, conn.port), self._on_line, self._on_close, auth)
+        self._notify_worker = AsyncSubscriptions(owner, self._conn, cfg.gt('smarthome', 'notify_coalesce', 0) / 1000)
+        self.log('start', logger.INFO)
+        try:
+            self._conn.write(_make_dict_reply(cmd))
+        except RuntimeError as e:
+            self.log('OPEN ERROR: {}'.format(e), logger.ERROR)
+            self._conn.close()
+
+    def start(self):
+        pass
+
+    def is_alive(self) -> bool:
+        return not self.__closed.is_set()
+
+    def close_signal(self):
+        self.work = False
+        self._notify_worker.close_signal()
+        self._conn.close()
+
+    def join(self, timeout=10):
+        self.close_signal()
+        self.__closed.wait(timeout)
+
+    def do_ws_allow(self, *args, **kwargs):
+        return False
+
+    def _on_line(self, line: str):
+        # Тред цикла. Очередь своя, чтобы команды одного подключения не обгоняли друг друга
+        if not self.work:
+            return
+        self.__lines.append(line)
+        if not self.__busy:
+            self._next()
+
+    def _next(self, *_):
+        self.__busy = bool(self.__lines) and self.work and self._conn.alive
+        if self.__busy:
+            self._loop.executor(self.parse, self.__lines.pop(0)).add_done_callback(self._next)
+
+    def _on_close(self):
+        self.work = False
+        self.__lines.clear()
+        self._notify_worker.close_signal()
+        self.log('close. Sent: {}'.format(_stats_str(self._conn.write_stats)), logger.INFO)
+        self.__closed.set()
+        self.__close_callback()
@@ -319,8 +319,11 @@ class Azure(BaseSTT):
 class VoskServer(BaseSTT):
     # https://alphacephei.com/vosk/server
     # https://github.com/alphacep/vosk-server/blob/master/websocket/asr_server.py
-    def __init__(self, audio_data: AudioData, url='', **_):
+    def __init__(self, audio_data: AudioData, url='', partial=None, **_):
         self.rate = audio_data.sample_rate if audio_data.sample_rate < 16000 else 16000
+        # Вызывается с каждой промежуточной гипотезой, если вернет True - распознавание прерывается
+        self._partial = partial if callable(partial) else None
+        self._done = False
         url = url_builder_cached(url or '127.0.0.1', def_port=2700)
         super().__init__(url, audio_data, 'wav', convert_rate=self.rate, convert_width=2, proxy_key='stt_vosk-rest')
 
@@ -332,14 +335,37 @@ class VoskServer(BaseSTT):
                 **proxies(proxy_key, ws_format=True),
             )
             self._rq.send(json.dumps({'config': {'sample_rate': self.rate}}))
-            for chunk in self._chunks():
-                self._rq.send(chunk, opcode=ABNF.OPCODE_BINARY)
-            self._rq.send('{"eof" : 1}')
+            if self._partial:
+                self._send_speculative()
+            else:
+                for chunk in self._chunks():
+                    self._rq.send(chunk, opcode=ABNF.OPCODE_BINARY)
+            if not self._done:
+                self._rq.send('{"eof" : 1}')
         except REQUEST_ERRORS as e:
             self._close()
             raise RuntimeErrorTrace(e)
 
+    def _send_speculative(self):
+        # Сервер отвечает на каждый чанк, так что читаем ответы сразу и отдаем гипотезы на проверку
+        chunks = self._chunks()
+        try:
+            for chunk in chunks:
+                self._rq.send(chunk, opcode=ABNF.OPCODE_BINARY)
+                recv = json.loads(self._rq.recv())
+                if 'text' in recv:
+                    self._text, self._done = recv['text'], True
+                elif recv.get('partial'):
+                    self._text = recv['partial']
+                    self._done = self._partial(self._text)
+                if self._done:
+                    break
+        finally:
+            chunks.close()
+
     def _reply_check(self):
+        if self._done:
+            return self._close()
         try:
             while True:
                 recv = json.loads(self._rq.recv())
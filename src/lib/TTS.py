@@ -5,8 +5,6 @@ import time
 from functools import lru_cache
 from shlex import quote
 
-import requests
-
 from utils import (
     REQUEST_ERRORS, RuntimeErrorTrace, yandex_speed_normalization, url_builder_cached, yandex_cloud_reply_check
 )
@@ -14,7 +12,7 @@ from .gtts_monkey_patching import Google, gTTSError
 from .keys_utils import YandexSessionStorage
 from .polly_boto3 import AWSBoto3
 from .polly_signing import signing as polly_signing
-from .proxy import proxies
+from .sessions import sessions
 
 __all__ = ['support', 'GetTTS', 'BaseTTS', 'gTTSError']
 
@@ -41,12 +39,13 @@ class BaseTTS:
 
     def _request(self, proxy_key):
         try:
-            self._rq = requests.get(
+            self._rq = sessions.request(
+                'GET',
                 self._url,
+                proxy_key,
                 params=self._params,
                 stream=True,
                 timeout=30,
-                proxies=proxies(proxy_key)
             )
         except REQUEST_ERRORS as e:
             raise RuntimeErrorTrace(e)
@@ -102,13 +101,14 @@ class YandexCloud(BaseTTS):
 
     def _request(self, proxy_key):
         try:
-            self._rq = requests.post(
+            self._rq = sessions.request(
+                'POST',
                 self._url,
+                proxy_key,
                 data=self._params,
                 headers=self._headers,
                 stream=True,
                 timeout=30,
-                proxies=proxies(proxy_key)
             )
         except REQUEST_ERRORS as e:
             raise RuntimeErrorTrace(e)
@@ -132,12 +132,13 @@ class YandexCloudDemo(BaseTTS):
 
         self._params['message'] = self._params.pop('text')
         try:
-            self._rq = requests.post(
+            self._rq = sessions.request(
+                'POST',
                 self._url,
+                proxy_key,
                 json=self._params,
                 stream=True,
                 timeout=30,
-                proxies=proxies(proxy_key),
                 **self.session.requests_options,
             )
         except REQUEST_ERRORS as e:
@@ -178,13 +179,14 @@ class AWS(BaseTTS):
 
     def _request(self, proxy_key):
         try:
-            self._rq = requests.post(
+            self._rq = sessions.request(
+                'POST',
                 self._url,
+                proxy_key,
                 data=self._body,
                 headers=self._headers,
                 stream=True,
                 timeout=30,
-                proxies=proxies(proxy_key)
             )
         except REQUEST_ERRORS as e:
             raise RuntimeErrorTrace(e)
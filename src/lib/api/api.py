@@ -1,9 +1,9 @@
 import base64
-import json
 import os
 import time
 
 import logger
+from lib import json_codec
 from lib.api.misc import (
     InternalException, api_commands, dict_key_checker, json_parser, dict_list_to_list_in_tuple, Null
 )
@@ -32,6 +32,7 @@ class API:
         self._getters, self._setters = {'auth': lambda : False}, {}
         self.API, self.API_CODE = {}, {}
         self.TRUE_JSON, self.TRUE_LEGACY, self.PURE_JSON, self.ALLOW_RESPONSE = set(), set(), set(), set()
+        self.SERIAL, self.PARSED = set(), set()
         self._collector()
 
     @staticmethod
@@ -84,6 +85,8 @@ class API:
             filling(self.TRUE_LEGACY, 'true_legacy')
             filling(self.PURE_JSON, 'pure_json')
             filling(self.ALLOW_RESPONSE, 'allow_response')
+            filling(self.SERIAL, 'serial')
+            filling(self.PARSED, 'parsed')
             # pure_json поддерживает только чистый json
             self.TRUE_JSON -= self.PURE_JSON
             self.TRUE_LEGACY -= self.PURE_JSON
@@ -118,11 +121,11 @@ class API:
         raise InternalException(msg='Not implemented yet - {}'.format(cmd))
 
     @api_commands('hi', 'voice', 'volume', 'nvolume', 'mvolume', 'nvolume_say', 'mvolume_say', 'listener',
-                  'volume_q', 'music_volume_q')
+                  'volume_q', 'music_volume_q', serial=True)
     def _api_terminal_direct(self, name: str, cmd: str):
         self.own.terminal_call(OLD_CMD[name] if name in OLD_CMD else name, cmd)
 
-    @api_commands('ask', true_json=True)
+    @api_commands('ask', true_json=True, serial=True)
     def _api_ask(self, cmd, data):
         """
         Произнести текст и перейти в режим ожидания голосовой команды.
@@ -132,34 +135,44 @@ class API:
         """
         self._base_says(cmd, data)
 
-    @api_commands('tts', true_json=True)
+    @api_commands('tts', true_json=True, serial=True)
     def _api_tts(self, cmd, data):
         """
         Произнести текст.
 
         JSON-RPC использует другой синтаксис и позволяет опционально задать провайдера:
         {"method": "tts", "params": {"text": "привет", "provider": "google"}}
+        Для фоновой озвучки также можно задать key (заменит ждущее сообщение с тем же key),
+        ttl (секунд в очереди) и priority (больше - раньше):
+        {"method": "tts", "params": {"text": "Громкость 50", "key": "volume", "ttl": 10, "priority": 1}}
         """
         self._base_says(cmd, data)
 
     def _base_says(self, cmd, data):
         data = data if isinstance(data, dict) else {'text': data[0] if isinstance(data, list) and data else data}
         dict_key_checker(data, keys=('text',))
-        self.own.terminal_call(cmd, TextBox(data['text'], data.get('provider')))
+        if self.own.tts_overloaded:
+            raise InternalException(5, 'TTS queue is full, try later')
+        for key in ('ttl', 'priority'):
+            if not isinstance(data.get(key, 0), int):
+                raise InternalException(3, 'Wrong value type in {}: {}'.format(repr(key), repr(type(data[key]))))
+        box = TextBox(data['text'], data.get('provider'), key=data.get('key'), ttl=data.get('ttl', 0),
+                      priority=data.get('priority', 0))
+        self.own.terminal_call(cmd, box)
 
-    @api_commands('play')
+    @api_commands('play', serial=True)
     def _api_play(self, _, cmd: str):
         self.own.music_play(cmd)
 
-    @api_commands('pause')
+    @api_commands('pause', serial=True)
     def _api_pause(self, __, _):
         self.own.music_pause()
 
-    @api_commands('settings')
-    def _api_settings(self, _, cmd: str) -> dict:
+    @api_commands('settings', serial=True, parsed=True)
+    def _api_settings(self, _, cmd: str or dict) -> dict:
         return self.own.settings_from_srv(cmd)
 
-    @api_commands('rec')
+    @api_commands('rec', serial=True)
     def _api_rec(self, _, cmd: str):
         param = cmd.split('_')  # должно быть вида rec_1_1, play_2_1, compile_5_1
         if len([1 for x in param if len(x)]) != 3:
@@ -178,7 +191,7 @@ class API:
         else:
             raise InternalException(2, 'Unknown command for \'rec\': {}'.format(repr(param[0])[:100]))
 
-    @api_commands('send_model')
+    @api_commands('send_model', serial=True, parsed=True)
     def _api_send_model(self, _, data: str):
         """
         Получение модели от сервера.
@@ -252,7 +265,7 @@ class API:
         """
         return {'models': self.cfg.get_all_models(), 'allow': self.cfg.get_allow_models()}
 
-    @api_commands('test.record', pure_json=True)
+    @api_commands('test.record', pure_json=True, serial=True)
     def _api_test_recoder(self, _, data):
         """file: str, limit: [int, float]"""
         dict_key_checker(data, ('file',))
@@ -267,12 +280,12 @@ class API:
             raise InternalException(code=4, msg='file empty')
         self.own.terminal_call('test.record', (file, limit))
 
-    @api_commands('test.play', 'test.delete', pure_json=True)
+    @api_commands('test.play', 'test.delete', pure_json=True, serial=True)
     def _api_test_play_delete(self, cmd, data):
         """files: list[str]"""
         self.own.terminal_call(cmd, dict_list_to_list_in_tuple(data, ('files',)))
 
-    @api_commands('test.test', pure_json=True)
+    @api_commands('test.test', pure_json=True, serial=True)
     def _api_test_test(self, _, data):
         """providers: list[str], files: list[str]"""
         self.own.terminal_call('test.test', dict_list_to_list_in_tuple(data, ('providers', 'files')))
@@ -316,6 +329,8 @@ class API:
         result = {'cmd': cmd, 'msg': ''}
         if not cmd:
             result.update(cmd=[x for x in self.API if allow(x)], msg='Available commands')
+            if self.get('auth'):
+                result['pubsub'] = _pubsub_summary(self.own.pubsub_stats())
         elif cmd == '*':
             result.update(cmd={x: flags2(x) for x in self.API if allow(x)}, msg='Flags: TRUE_JSON, PURE_JSON')
         elif not (cmd in self.API and allow(cmd)):
@@ -333,17 +348,29 @@ class API:
                 result['flags'] = flags
         return result
 
+    @api_commands('pubsub.stats')
+    def _api_pubsub_stats(self, _, data: str) -> dict:
+        """
+        Счетчики шины событий, время в ms. reset - обнулить после снимка.
+        queue - очередь шины, events - вызовы и задержка по каналам и событиям,
+        subscribers - вызовы, потери, ошибки, медленные (дольше pubsub_slow), задержка, время выполнения и очередь
+        каждого коллбэка. Краткая сводка есть в info.
+        """
+        if data and data != 'reset':
+            raise InternalException(msg='Wrong data: {}'.format(repr(data)))
+        return self.own.pubsub_stats(data == 'reset')
+
     @api_commands('notifications.list')
     def _api_notifications_list(self, *_):
         return self.own.list_notifications()
 
-    @api_commands('notifications.add', 'notifications.remove')
-    def _api_notifications_modify(self, cmd: str, events: str):
+    @api_commands('notifications.add', 'notifications.remove', serial=True, parsed=True)
+    def _api_notifications_modify(self, cmd: str, events: str or list):
         try:
-            events = json.loads(events)
+            events = events if isinstance(events, (dict, list)) else json_codec.loads(events)
             if not isinstance(events, list):
                 events = None
-        except (json.decoder.JSONDecodeError, TypeError):
+        except json_codec.DecodeError:
             if events:
                 events = events.split(',')
         if not events:
@@ -358,8 +385,8 @@ class API:
     def _api_get_map_settings(self, *_):
         return make_map_settings(self.cfg.wiki_desc)
 
-    @api_commands('call.plugin')  # @api_commands('call.plugin', 'call.owner', 'call.global')
-    def _api_rpc_call(self, cmd: str, data: str):
+    @api_commands('call.plugin', serial=True, parsed=True)  # @api_commands('call.plugin', 'call.owner', 'call.global')
+    def _api_rpc_call(self, cmd: str, data: str or dict):
         if not self.cfg.gt('smarthome', 'unsafe_rpc'):
             raise InternalException(msg='[smarthome] unsafe_rpc = off')
         path, args, kwargs = _rpc_data_extractor(data)
@@ -386,7 +413,7 @@ class API:
 
         return _rpc_caller(entry, path, walked, args, kwargs)
 
-    @api_commands('maintenance.reload', 'maintenance.stop')
+    @api_commands('maintenance.reload', 'maintenance.stop', serial=True)
     def _api_maintenance(self, cmd: str, *_):
         self.own.die_in(3, reload=cmd.endswith('.reload'))
 
@@ -394,7 +421,7 @@ class API:
     def _api_backup_manual(self, *_):
         self.own.backup_manual()
 
-    @api_commands('backup.restore')
+    @api_commands('backup.restore', serial=True)
     def _api_backup_restore(self, _, data):
         if not data:
             raise InternalException(msg='Empty filename')
@@ -416,7 +443,7 @@ class API:
     def _api_backup_list(self, *_) -> list:
         return [{'filename': filename, 'timestamp': timestamp} for filename, timestamp in self.own.backup_list()]
 
-    @api_commands('sre', true_json=True)
+    @api_commands('sre', true_json=True, serial=True)
     def _api_sre(self, _, data):
         """
         Обработает текст так, как если бы он был успешно распознан.
@@ -451,9 +478,21 @@ class BaseAPIHandler(API):
             raise InternalException(code=-32601, msg='Unknown command: \'{}\''.format(cmd[:100]), id_=msg['id'])
 
         self.id = msg['id']
-        result = self.API[msg[self.METHOD]](msg[self.METHOD], msg['params'])
+        result = self.API[msg[self.METHOD]](msg[self.METHOD], self.legacy_params(msg))
         return {'result': result, 'id': msg['id']} if msg['id'] is not None else None
 
+    def legacy_params(self, msg: dict, parsed: bool = None):
+        """
+        params для обработчика. Legacy dict или list получат как есть команды из PARSED (или parsed=True),
+        остальные - строку с json, она собирается только здесь.
+        """
+        params = msg['params']
+        if not isinstance(params, json_codec.Parsed):
+            return params
+        if parsed is None:
+            parsed = msg[self.METHOD] in self.PARSED
+        return params.parsed if parsed else str(params)
+
     def call_result(self, msg: dict) -> None:
         if msg['id'] in self.ALLOW_RESPONSE:
             self.API[msg['id']](msg['id'], msg[self.RESULT])
@@ -476,10 +515,10 @@ class BaseAPIHandler(API):
         self.is_jsonrpc = is_json if is_json is not None else (line.startswith('{') or line.startswith('['))
         if self.is_jsonrpc:
             try:
-                line = json.loads(line)
+                line = json_codec.loads(line)
                 if not isinstance(line, (dict, list)):
                     raise InternalException(code=-32700, msg='must be a dict or list type', id_=Null)
-            except (json.decoder.JSONDecodeError, TypeError) as e:
+            except json_codec.DecodeError as e:
                 raise InternalException(code=-32700, msg=str(e), id_=Null)
         return line
 
@@ -518,8 +557,8 @@ class BaseAPIHandler(API):
                 if isinstance(params, list) and len(params) == 1 and isinstance(params[0], str):
                     params = params[0]
                 elif isinstance(params, (dict, list)):
-                    # Обратно в строку - костыль.
-                    params = json.dumps(params)
+                    # Обратно в строку - костыль. Строку соберет legacy_params, если она нужна обработчику
+                    params = json_codec.Parsed(params)
                 else:
                     raise InternalException(
                         code=-32602, msg='legacy, params must be a list[str]', id_=id_, method=method
@@ -571,9 +610,9 @@ class BaseAPIHandler(API):
         return msg
 
 
-def _rpc_data_extractor(data: str) -> tuple:
+def _rpc_data_extractor(data: str or dict) -> tuple:
     try:
-        data = json.loads(data)
+        data = data if isinstance(data, (dict, list)) else json_codec.loads(data)
         if not isinstance(data, dict):
             raise TypeError('must be a dict type')
         path = data['path']
@@ -588,7 +627,7 @@ def _rpc_data_extractor(data: str) -> tuple:
         kwargs = data.get('kwargs', {})
         if not isinstance(kwargs, dict):
             raise TypeError('kwargs must be a dict type, get {}'.format(type(kwargs)))
-    except (json.decoder.JSONDecodeError, TypeError, KeyError, ValueError) as e:
+    except (*json_codec.DecodeError, KeyError) as e:
         raise InternalException(code=2, msg='Wrong request: {}'.format(e))
     return path, args, kwargs
 
@@ -610,11 +649,26 @@ def _rpc_caller(obj, path: list, walked: list, args: list, kwargs: dict):
         result = list(result)
     # Проверка на сериализуемость и repr
     try:
-        json.dumps(result, ensure_ascii=False)
+        json_codec.dumps(result)
         return result
-    except (TypeError, json.JSONDecoder, ValueError):
+    except (TypeError, ValueError):
         pass
     try:
         return repr(result)
     except Exception as e:
         return 'result serialization error: {}'.format(e)
+
+
+def _pubsub_summary(stats: dict, top=5) -> dict:
+    # Самые медленные подписчики по среднему времени выполнения
+    subscribers = [(name, val) for name, val in stats['subscribers'].items() if 'duration' in val]
+    subscribers.sort(key=lambda x: x[1]['duration']['avg'], reverse=True)
+    return {
+        'queue': stats['queue'],
+        'slowest': {
+            name: {
+                'avg': val['duration']['avg'], 'max': val['duration']['max'],
+                'slow': val['slow'], 'dropped': val['dropped'], 'queue_max': val.get('queue_max', 0),
+            } for name, val in subscribers[:top]
+        },
+    }
@@ -1,6 +1,6 @@
-import json
 import threading
 
+from lib import json_codec
 from lib.socket_wrapper import Connect
 from owner import Owner
 from utils import singleton
@@ -83,7 +83,8 @@ class SelfAuthInstance:
                 self._owners.clear()
 
 
-def api_commands(*commands, true_json=None, true_legacy=None, pure_json=None, allow_response=None):
+def api_commands(*commands, true_json=None, true_legacy=None, pure_json=None, allow_response=None, serial=None,
+                 parsed=None):
     """
     Враппер для связывания команд с методом.
     :param commands: Список команд.
@@ -93,6 +94,10 @@ def api_commands(*commands, true_json=None, true_legacy=None, pure_json=None, al
     или строку из 'cmd:result' без преобразования в json если result простой тип.
     :param pure_json: Список команд, которые доступны только в JSON-RPC.
     :param allow_response: Может обработать ответ, примитивно только если команда совпала с id.
+    :param serial: Список команд, которые в JSON-RPC batch не выполняются параллельно с другими:
+    все что трогает терминал, авторизацию или само подключение.
+    :param parsed: Список legacy команд, которые сами разбирают json из data: если params были dict или list,
+    получат их как есть, без json строки.
     :return: Исходный метод.
     """
     def _commands(_flags):
@@ -111,6 +116,8 @@ def api_commands(*commands, true_json=None, true_legacy=None, pure_json=None, al
         filling(f, 'true_legacy', _commands(true_legacy))
         filling(f, 'pure_json', _commands(pure_json))
         filling(f, 'allow_response', _commands(allow_response))
+        filling(f, 'serial', _commands(serial))
+        filling(f, 'parsed', _commands(parsed))
         return f
     return wrapper
 
@@ -125,10 +132,10 @@ def upgrade_duplex(own: Owner, soc: Connect, msg=''):
         raise RuntimeError('No subscribers: {}'.format(cmd))
 
 
-def json_parser(data: str, keys: tuple = ()) -> dict:
+def json_parser(data: str or dict, keys: tuple = ()) -> dict:
     try:
-        data = json.loads(data)
-    except (json.decoder.JSONDecodeError, TypeError) as e:
+        data = data if isinstance(data, (dict, list)) else json_codec.loads(data)
+    except json_codec.DecodeError as e:
         raise InternalException(msg=e)
     dict_key_checker(data, keys)
     return data
@@ -1,9 +1,10 @@
 import hashlib
-import json
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 import logger
+from lib import json_codec
 from lib.api.api import BaseAPIHandler, dict_key_checker
 from lib.api.misc import InternalException, SelfAuthInstance, Unlock, api_commands
 from lib.socket_wrapper import Connect
@@ -30,12 +31,12 @@ class APIHandler(BaseAPIHandler):
             return msg
         return 'already'
 
-    @api_commands('authorization')
+    @api_commands('authorization', serial=True)
     def _api_authorization(self, cmd, remote_hash):
         """Авторизация, повышает привилегии текущего подключения."""
         return self._base_authorization(cmd, lambda token: hashlib.sha512(token.encode()).hexdigest() == remote_hash)
 
-    @api_commands('authorization.totp', pure_json=True)
+    @api_commands('authorization.totp', pure_json=True, serial=True)
     def _api_authorization_totp(self, cmd, data):
         """
         Перед хешированием токена добавляет к нему "соль" - Unix time поделенный на 2 и округленный до целого.
@@ -58,7 +59,7 @@ class APIHandler(BaseAPIHandler):
         time_diff = '; diff: {}'.format(pretty_time(time_ - timestamp)) if timestamp else ''
         return self._base_authorization(cmd, lambda token: check_token_with_totp(token, remote_hash, time_), time_diff)
 
-    @api_commands('authorization.self', pure_json=True)
+    @api_commands('authorization.self', pure_json=True, serial=True)
     def _api_authorization_self(self, cmd, data: dict):
         """
         Альтернативный способ авторизации, для внутренних нужд:
@@ -84,7 +85,7 @@ class APIHandler(BaseAPIHandler):
             return msg
         return 'already'
 
-    @api_commands('deauthorization')
+    @api_commands('deauthorization', serial=True)
     def _api_deauthorization(self, cmd, _):
         """Отменяет авторизацию для текущего подключения."""
         if self.get('auth'):
@@ -95,6 +96,36 @@ class APIHandler(BaseAPIHandler):
         return 'already'
 
 
+class BatchPool:
+    """
+    Пул для параллельных записей JSON-RPC batch. Сервер держит один на все свои подключения
+    и закрывает в join, потоки создаются при первом batch.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._size = 0
+        self._closed = False
+
+    def submit(self, size: int, call, *args):
+        """RuntimeError - пул закрыт или пересоздан из-за смены настроек."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('BatchPool closed')
+            if size != self._size:
+                if self._executor:
+                    self._executor.shutdown(wait=False)
+                self._executor, self._size = ThreadPoolExecutor(max_workers=size), size
+            return self._executor.submit(call, *args)
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            if self._executor:
+                self._executor.shutdown(wait=False)
+            self._executor, self._size = None, 0
+
+
 class SocketAPIHandler(threading.Thread):
     # Канал для неблокирующих команд
     # Вызов: команда, данные
@@ -104,9 +135,12 @@ class SocketAPIHandler(threading.Thread):
     # Обработчик будет приостановлен на 60 сек или до вызова блокировки подписчиком.
     NET_BLOCK = 'net_block'
 
-    def __init__(self, cfg, log, owner: Owner, name, api_handler=APIHandler):
+    def __init__(self, cfg, log, owner: Owner, name, api_handler=APIHandler, batch_pool: BatchPool = None):
         super().__init__(name=name)
         self.cfg, self.log, self.own = cfg, log, owner
+        # Пул сервера или свой, свой закрываем в join
+        self._batch_pool = batch_pool or BatchPool()
+        self._own_batch_pool = batch_pool is None
 
         self.work = False
         self._conn = Connect(None, None, self.do_ws_allow)
@@ -128,6 +162,8 @@ class SocketAPIHandler(threading.Thread):
         SelfAuthInstance().unsubscribe(self.own)
         self._conn.close()
         super().join(timeout=timeout)
+        if self._own_batch_pool:
+            self._batch_pool.shutdown()
 
     def start(self):
         if not self.work:
@@ -172,13 +208,14 @@ class SocketAPIHandler(threading.Thread):
 
         if msg['type'] == BaseAPIHandler.METHOD:
             if self.own.has_subscribers(msg[BaseAPIHandler.METHOD], self.NET):
-                self.log('Command {} intercepted'.format(repr(msg[BaseAPIHandler.METHOD])))
-                self.own.sub_call(self.NET, msg[BaseAPIHandler.METHOD], msg['params'])
+                self.log('Command {!r} intercepted', logger.DEBUG, args=(msg[BaseAPIHandler.METHOD],))
+                self.own.sub_call(self.NET, msg[BaseAPIHandler.METHOD], self.api.legacy_params(msg, False))
                 return none()
             if self.own.has_subscribers(msg[BaseAPIHandler.METHOD], self.NET_BLOCK):
-                self.log('Command {} intercepted in blocking mode'.format(repr(msg[BaseAPIHandler.METHOD])))
+                self.log('Command {!r} intercepted in blocking mode', logger.DEBUG, args=(msg[BaseAPIHandler.METHOD],))
                 self._lock.clear()
-                self.own.sub_call(self.NET_BLOCK, msg[BaseAPIHandler.METHOD], msg['params'], self._lock, self._conn)
+                params = self.api.legacy_params(msg, False)
+                self.own.sub_call(self.NET_BLOCK, msg[BaseAPIHandler.METHOD], params, self._lock, self._conn)
                 # Приостанавливаем выполнение, ждем пока обработчик нас разблокирует
                 # 1 минуты хватит?
                 self._lock.wait(60)
@@ -190,7 +227,7 @@ class SocketAPIHandler(threading.Thread):
         if not data:
             return self._handle_exception(InternalException(code=-32600, msg='no data'))
         else:
-            self.log('Received data: {}'.format(repr(data)[:1500]))
+            self.log(lambda: 'Received data: {}'.format(repr(data)[:1500]))
 
         try:
             data = self.api.prepare(data)
@@ -200,7 +237,59 @@ class SocketAPIHandler(threading.Thread):
         if not (self.api.is_jsonrpc and isinstance(data, list)):
             return self.__processing(data)
         # JSON-RPC Batch
-        return [x for x in [self.__processing(cmd) for cmd in data] if x is not None] or None
+        return [x for x in self._batch(data) if x is not None] or None
+
+    def _batch(self, data: list) -> list:
+        """
+        Подряд идущие независимые записи выполняются параллельно в общем пуле, serial записи - по одной,
+        после всех предыдущих. Порядок ответов сохраняется, что не успело за batch_timeout - ошибка.
+        """
+        workers = self.cfg.gt('smarthome', 'batch_workers', 0)
+        if workers < 1 or len(data) < 2:
+            return [self.__processing(cmd) for cmd in data]
+        deadline = time.time() + self.cfg.gt('smarthome', 'batch_timeout', 30)
+        result, wave = [], []
+        for cmd in data:
+            if not self._is_serial(cmd):
+                wave.append(cmd)
+                continue
+            result.extend(self._batch_wave(wave, workers, deadline))
+            wave = []
+            result.append(self.__processing(cmd) if time.time() < deadline else self._batch_timeout(cmd))
+        result.extend(self._batch_wave(wave, workers, deadline))
+        return result
+
+    def _batch_wave(self, wave: list, workers: int, deadline: float) -> list:
+        if len(wave) < 2 or time.time() >= deadline:
+            return [self.__processing(cmd) if time.time() < deadline else self._batch_timeout(cmd) for cmd in wave]
+        try:
+            futures = [self._batch_pool.submit(workers, self.__processing, cmd) for cmd in wave]
+        except RuntimeError:
+            # Пул пересоздали из-за смены настроек или уже закрыли
+            return [self.__processing(cmd) for cmd in wave]
+        result = []
+        for cmd, future in zip(wave, futures):
+            try:
+                result.append(future.result(max(0.0, deadline - time.time())))
+            except FutureTimeoutError:
+                future.cancel()
+                result.append(self._batch_timeout(cmd))
+        return result
+
+    def _is_serial(self, cmd) -> bool:
+        method = cmd.get(BaseAPIHandler.METHOD) if isinstance(cmd, dict) else None
+        if not isinstance(method, str):
+            # Ответы и мусор - по порядку
+            return True
+        return (method in self.api.SERIAL or self.own.has_subscribers(method, self.NET)
+                or self.own.has_subscribers(method, self.NET_BLOCK))
+
+    def _batch_timeout(self, cmd) -> dict or None:
+        id_ = cmd.get('id') if isinstance(cmd, dict) else None
+        if id_ is None:
+            return None
+        e = InternalException(code=-32000, msg='batch timeout', id_=id_)
+        return self._handle_exception(e, str(cmd.get(BaseAPIHandler.METHOD)))
 
     def parse(self, data: str):
         result = self._parse(data)
@@ -228,7 +317,7 @@ class SocketAPIHandler(threading.Thread):
                 elif result and isinstance(result, dict):
                     reply = ';'.join('{}:{}'.format(key, val) for key, val in result.items())
             try:
-                reply = reply or '{}:{}'.format(cmd, json.dumps(data, ensure_ascii=False))
+                reply = reply or '{}:{}'.format(cmd, json_codec.dumps(data))
             except TypeError:
                 return
             self._write(reply, True)
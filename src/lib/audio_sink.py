@@ -0,0 +1,382 @@
+import audioop
+import queue
+import subprocess
+import threading
+import time
+import wave
+
+from lib.pcm_cache import RAW_RATE
+
+# Единый формат вывода, все источники приводим к нему
+RATE, CHANNELS, WIDTH = RAW_RATE, 1, 2
+SINK_CMD = ['aplay', '-q', '-t', 'raw', '-f', 'S16_LE', '-r', str(RATE), '-c', str(CHANNELS), '-B', '100000', '-']
+DECODERS = {
+    '.mp3': ['mpg123', '-q', '-s', '-e', 's16', '-m', '-r', str(RATE), '-'],
+    '.opus': ['opusdec', '--quiet', '--rate', str(RATE), '-', '-'],
+}
+CHUNK = RATE * WIDTH // 50  # 20 ms
+
+
+class _Converter:
+    def __init__(self, rate, channels, width):
+        if channels not in (1, 2):
+            raise RuntimeError('Unsupported channels: {}'.format(channels))
+        self._rate, self._channels, self._width = rate, channels, width
+        self._state = None
+
+    def __call__(self, data: bytes) -> bytes:
+        if self._width == 1:
+            # 8 бит в wav беззнаковые
+            data = audioop.bias(data, 1, -128)
+        if self._channels == 2:
+            data = audioop.tomono(data, self._width, 0.5, 0.5)
+        if self._width != WIDTH:
+            data = audioop.lin2lin(data, self._width, WIDTH)
+        if self._rate != RATE:
+            data, self._state = audioop.ratecv(data, WIDTH, CHANNELS, self._rate, RATE, self._state)
+        return data
+
+
+class _StreamReader:
+    # Точный read(n) для wave поверх потока, который отдает чанки как придется
+    def __init__(self, stream):
+        self._stream = stream
+        self._buff = b''
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buff) < size):
+            data = self._stream.read()
+            if not data:
+                self._eof = True
+            self._buff += data
+        size = len(self._buff) if size < 0 else size
+        data, self._buff = self._buff[:size], self._buff[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class _PCMSource:
+    def __init__(self, pcm):
+        self._data = memoryview(pcm.data)
+        self._pos = 0
+        self._step = CHUNK * pcm.rate * pcm.channels * pcm.width // (RATE * WIDTH * CHANNELS)
+        self._step -= self._step % (pcm.channels * pcm.width)
+        self._convert = _Converter(pcm.rate, pcm.channels, pcm.width)
+
+    def read(self) -> bytes:
+        data = self._data[self._pos:self._pos + self._step]
+        self._pos += len(data)
+        return self._convert(bytes(data)) if data else b''
+
+    def close(self):
+        self._pos = len(self._data)
+
+
+class _WaveSource:
+    def __init__(self, fp):
+        self._fp = fp
+        try:
+            self._wave = wave.open(fp, 'rb')
+            self._convert = _Converter(self._wave.getframerate(), self._wave.getnchannels(), self._wave.getsampwidth())
+        except Exception:
+            fp.close()
+            raise
+        self._frames = CHUNK * self._wave.getframerate() // (RATE * WIDTH)
+
+    def read(self) -> bytes:
+        data = self._wave.readframes(self._frames)
+        return self._convert(data) if data else b''
+
+    def close(self):
+        self._fp.close()
+
+
+class _DecoderSource:
+    def __init__(self, ext, path, stream):
+        stdin = open(path, 'rb') if stream is None else subprocess.PIPE
+        try:
+            self._popen = subprocess.Popen(
+                DECODERS[ext], stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        finally:
+            if stream is None:
+                stdin.close()
+        if stream is not None:
+            threading.Thread(target=self._feed, args=(stream,), name='SinkFeeder').start()
+
+    def _feed(self, stream):
+        try:
+            data = stream.read()
+            while data:
+                self._popen.stdin.write(data)
+                data = stream.read()
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                self._popen.stdin.close()
+            except OSError:
+                pass
+
+    def read(self) -> bytes:
+        return self._popen.stdout.read(CHUNK)
+
+    def close(self):
+        if self._popen.poll() is None:
+            self._popen.kill()
+        self._popen.stdout.close()
+        self._popen.wait()
+
+
+def make_source(path: str, stream, ext: str, pcm=None):
+    """Источник PCM в формате вывода или None, если этот звук синку не по зубам."""
+    if pcm is not None:
+        return _PCMSource(pcm)
+    if ext == '.wav':
+        return _WaveSource(_StreamReader(stream) if stream is not None else open(path, 'rb'))
+    if ext in DECODERS:
+        return _DecoderSource(ext, path, stream)
+    return None
+
+
+class Playback:
+    """Слой микшера, для плеера заменяет Popen: poll, wait, kill."""
+    STEP = 0.35  # изменение громкости за чанк, ~60 ms на полное затухание
+
+    def __init__(self, sink, source, callback, overlay: bool, gain: float or None):
+        self._sink = sink
+        self._source = source
+        self._callback = callback
+        self.overlay = overlay
+        self._gain = gain
+        self._fading = False
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        # Источник может тормозить (стрим, декодер), читаем его отдельно чтобы не стопорить микшер
+        self._queue = queue.Queue(maxsize=10)
+        threading.Thread(target=self._reader, name='SinkReader').start()
+
+    @property
+    def fading(self) -> bool:
+        return self._fading
+
+    @property
+    def faded(self) -> bool:
+        return self._fading and self._gain is not None and self._gain <= 0
+
+    def read(self) -> bytes or None:
+        # None - данных пока нет, b'' - конец
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _reader(self):
+        try:
+            data = self._source.read()
+            while data and not self._event.is_set():
+                data = data[:len(data) - len(data) % WIDTH]
+                if data and not self._put(data):
+                    return
+                data = self._source.read()
+        except Exception as e:
+            if not self._event.is_set():
+                self._sink.log('Source error: {}'.format(e))
+        self._put(b'')
+
+    def _put(self, data: bytes) -> bool:
+        while not self._event.is_set():
+            try:
+                self._queue.put(data, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def volume(self, data: bytes, target: float) -> bytes:
+        target = 0.0 if self._fading else target
+        if self._gain is None:
+            self._gain = target
+        elif self._gain < target:
+            self._gain = min(target, self._gain + self.STEP)
+        elif self._gain > target:
+            self._gain = max(target, self._gain - self.STEP)
+        return data if self._gain == 1.0 else audioop.mul(data, WIDTH, self._gain)
+
+    def fade_out(self):
+        self._fading = True
+
+    def poll(self):
+        return 0 if self._event.is_set() else None
+
+    def wait(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise subprocess.TimeoutExpired('AudioSink', timeout)
+        return 0
+
+    def kill(self):
+        self._sink.stop(self)
+
+    def finish(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+        try:
+            self._source.close()
+        except (OSError, ValueError):
+            pass
+        if self._callback:
+            self._callback(False)
+
+
+class AudioSink(threading.Thread):
+    """
+    Один долгоживущий вывод сырого PCM с микшером. Пишем с опережением не больше LEAD,
+    поэтому остановка и замена звука срабатывают сразу, а процесс не перезапускается.
+    Новый звук плавно заменяет старый, наложенные (overlay) звучат поверх и приглушают остальные.
+    """
+    LEAD = 0.1
+    DUCK = 0.3
+    BYTES_PER_SEC = RATE * WIDTH * CHANNELS
+
+    def __init__(self, log):
+        super().__init__(name='AudioSink')
+        self.log = log
+        self._cv = threading.Condition()
+        self._layers = []
+        # Источник кончился, но буфер вывода еще доигрывает: [(время окончания, слой)]
+        self._ending = []
+        self._popen = None
+        self._end = 0
+        self._work = False
+
+    @property
+    def ready(self) -> bool:
+        return self._work
+
+    def start(self):
+        self._work = True
+        super().start()
+
+    def join(self, timeout=None):
+        with self._cv:
+            self._work = False
+            self._cv.notify_all()
+        super().join(timeout)
+        self._close()
+
+    def play(self, source, callback, overlay: bool = False) -> Playback:
+        with self._cv:
+            replaced = False
+            if not overlay:
+                for layer in self._layers:
+                    if not layer.overlay:
+                        layer.fade_out()
+                        replaced = True
+            # При замене новый звук нарастает, пока старый затихает
+            playback = Playback(self, source, callback, overlay, 0.0 if replaced else None)
+            self._layers.append(playback)
+            self._cv.notify_all()
+        return playback
+
+    def stop(self, playback: Playback):
+        with self._cv:
+            if playback in self._layers:
+                playback.fade_out()
+                self._cv.notify_all()
+                return
+            self._ending = [x for x in self._ending if x[1] is not playback]
+        playback.finish()
+
+    def run(self):
+        while self._work:
+            with self._cv:
+                ended = self._pop_ended()
+                while self._work and not self._layers and not ended:
+                    self._cv.wait(self._ending[0][0] - time.time() if self._ending else None)
+                    ended = self._pop_ended()
+                layers = list(self._layers)
+            for layer in ended:
+                layer.finish()
+            duck = self.DUCK if any(layer.overlay for layer in layers) else 1.0
+            chunks = []
+            for layer in layers:
+                data = layer.read() if not layer.faded else b''
+                if data is None and layer.fading:
+                    # Затихающему нечего играть, выкидываем сразу
+                    data = b''
+                if data:
+                    chunks.append(layer.volume(data, 1.0 if layer.overlay else duck))
+                elif data is not None:
+                    self._remove(layer, layer.fading)
+            if chunks:
+                self._write(self._mix(chunks))
+            elif layers:
+                time.sleep(0.01)
+        with self._cv:
+            layers = self._layers + [layer for _, layer in self._ending]
+            self._layers, self._ending = [], []
+        for layer in layers:
+            layer.finish()
+
+    def _remove(self, layer: Playback, now: bool):
+        with self._cv:
+            self._layers.remove(layer)
+            if not now:
+                self._ending.append((max(self._end, time.time()), layer))
+                self._ending.sort(key=lambda x: x[0])
+                return
+        layer.finish()
+
+    def _pop_ended(self) -> list:
+        now, ended = time.time(), []
+        while self._ending and self._ending[0][0] <= now:
+            ended.append(self._ending.pop(0)[1])
+        return ended
+
+    @staticmethod
+    def _mix(chunks: list) -> bytes:
+        size = max(len(chunk) for chunk in chunks)
+        result = None
+        for chunk in chunks:
+            if len(chunk) < size:
+                chunk += bytes(size - len(chunk))
+            result = chunk if result is None else audioop.add(result, chunk, WIDTH)
+        return result
+
+    def _write(self, data: bytes):
+        now = time.time()
+        ahead = self._end - now
+        if ahead > self.LEAD:
+            time.sleep(ahead - self.LEAD)
+            now = time.time()
+        try:
+            if self._popen is None or self._popen.poll() is not None:
+                self._close()
+                self._popen = subprocess.Popen(SINK_CMD, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self._popen.stdin.write(data)
+            self._popen.stdin.flush()
+        except (OSError, ValueError) as e:
+            self.log('Sink error: {}'.format(e))
+            self._close()
+            if isinstance(e, FileNotFoundError):
+                # Выводить некуда, плеер вернется к старому способу
+                self._work = False
+            return
+        self._end = max(self._end, now) + len(data) / self.BYTES_PER_SEC
+
+    def _close(self):
+        if self._popen is None:
+            return
+        try:
+            self._popen.stdin.close()
+        except OSError:
+            pass
+        if self._popen.poll() is None:
+            self._popen.kill()
+        self._popen.wait()
+        self._popen = None
@@ -0,0 +1,90 @@
+import time
+
+# Политики событий
+OFF = 'off'
+LATEST = 'latest'  # за окно уходит только последнее значение
+BATCH = 'batch'  # за окно уходит одно сообщение со всеми значениями
+POLICIES = (OFF, LATEST, BATCH)
+
+DEFAULT_POLICIES = {
+    'volume': LATEST,
+    'music_volume': LATEST,
+    'music_status': LATEST,
+    'talking': LATEST,
+    'record': LATEST,
+    'log': BATCH,
+}
+# Парные события считаются одним
+EVENT_KEYS = {
+    'start_talking': 'talking',
+    'stop_talking': 'talking',
+    'start_record': 'record',
+    'stop_record': 'record',
+    'start_stt_event': 'stt_event',
+    'stop_stt_event': 'stt_event',
+}
+
+
+class Coalescer:
+    """
+    Склеивает частые события. Первое событие ключа уходит сразу, следующие в течение окна копятся
+    и уходят одним сообщением в конце окна. Не потокобезопасен, живет в треде отправителя.
+    Отдает список (имя, [данные], batch), для LATEST и OFF в списке одно значение.
+    """
+    def __init__(self, window: float, policies: dict = None):
+        self.window = window
+        self.policies = dict(DEFAULT_POLICIES if policies is None else policies)
+        # ключ: [имя, [данные], срок, политика]
+        self._pending = {}
+        # ключ: когда ушло последнее сообщение
+        self._sent = {}
+
+    def policy(self, name: str) -> str:
+        return self.policies.get(EVENT_KEYS.get(name, name), OFF) if self.window > 0 else OFF
+
+    def configure(self, window: float = None, policies: dict = None) -> list:
+        """Меняет окно и политики (None - политика по умолчанию), возвращает что накопилось."""
+        if window is not None:
+            self.window = window
+        for key, policy in (policies or {}).items():
+            if policy is None:
+                self.policies.pop(key, None)
+                if key in DEFAULT_POLICIES:
+                    self.policies[key] = DEFAULT_POLICIES[key]
+            else:
+                self.policies[key] = policy
+        return self.flush(True)
+
+    def add(self, name: str, data) -> list:
+        policy = self.policy(name)
+        if policy == OFF:
+            return [(name, [data], False)]
+        key, now = EVENT_KEYS.get(name, name), time.time()
+        pending = self._pending.get(key)
+        if pending is None and now - self._sent.get(key, 0) >= self.window:
+            self._sent[key] = now
+            return [(name, [data], policy == BATCH)]
+        if pending is None:
+            self._pending[key] = [name, [data], self._sent[key] + self.window, policy]
+        else:
+            pending[0] = name
+            if policy == BATCH:
+                pending[1].append(data)
+            else:
+                pending[1] = [data]
+        return self.flush()
+
+    def timeout(self) -> float or None:
+        """Сколько ждать до ближайшей отправки, None - нечего ждать."""
+        if not self._pending:
+            return None
+        return max(0.0, min(x[2] for x in self._pending.values()) - time.time())
+
+    def flush(self, force=False) -> list:
+        now, result = time.time(), []
+        for key, (name, data, deadline, policy) in list(self._pending.items()):
+            if force or deadline <= now:
+                del self._pending[key]
+                self._sent[key] = now
+                result.append((name, data, policy == BATCH))
+        return result
@@ -0,0 +1,281 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import json_codec
+from lib.socket_wrapper import CRLF
+
+# Опкоды веб-сокета
+_TEXT, _CLOSE, _PING, _PONG = 0x1, 0x8, 0x9, 0xA
+# Строка или сообщение без конца длиннее этого - разрываем
+MAX_LINE = 1024 * 1024
+# Клиент не успевает читать, буфер отправки больше этого - разрываем
+MAX_WRITE_BUFFER = 4 * 1024 * 1024
+
+
+def _unmask(payload: bytes, mask: bytes) -> bytes:
+    size = len(payload)
+    if not size:
+        return payload
+    mask = (mask * (size // 4 + 1))[:size]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(size, 'big')
+
+
+def _ws_frame(payload: bytes, opcode=_TEXT) -> bytes:
+    # Сервер отправляет без маски
+    size = len(payload)
+    if size < 126:
+        head = bytes((0x80 | opcode, size))
+    elif size < 65536:
+        head = bytes((0x80 | opcode, 126)) + size.to_bytes(2, 'big')
+    else:
+        head = bytes((0x80 | opcode, 127)) + size.to_bytes(8, 'big')
+    return head + payload
+
+
+class _Protocol(asyncio.Protocol):
+    """Разбор входящих данных: строки по \\r\\n для TCP или кадры веб-сокета."""
+    def __init__(self, conn):
+        self._conn = conn
+        self._buff = bytearray()
+        self._message = bytearray()
+
+    def connection_made(self, transport):
+        self._conn.transport = transport
+
+    def connection_lost(self, exc):
+        self._conn.lost()
+
+    def data_received(self, data: bytes):
+        self._buff.extend(data)
+        if self._conn.ws:
+            self._ws_parse()
+        else:
+            self._tcp_parse()
+        if len(self._buff) + len(self._message) > MAX_LINE:
+            self._conn.close()
+
+    def _tcp_parse(self):
+        while self._conn.alive:
+            end = self._buff.find(CRLF)
+            if end < 0:
+                return
+            line = bytes(self._buff[:end])
+            del self._buff[:end + 2]
+            if not line:
+                # \r\n\r\n - конец сеанса
+                return self._conn.close()
+            try:
+                self._conn.line(line.decode('utf8'))
+            except UnicodeDecodeError:
+                continue
+
+    def _ws_parse(self):
+        buff = self._buff
+        while self._conn.alive and len(buff) >= 2:
+            fin, opcode, masked, size, pos = buff[0] & 0x80, buff[0] & 0x0F, buff[1] & 0x80, buff[1] & 0x7F, 2
+            if size > 125:
+                pos += 2 if size == 126 else 8
+                if len(buff) < pos:
+                    return
+                size = int.from_bytes(buff[2:pos], 'big')
+            if size + len(self._message) > MAX_LINE:
+                # Не ждем, пока придет весь кадр
+                return self._conn.close()
+            end = pos + (4 if masked else 0) + size
+            if len(buff) < end:
+                return
+            payload = bytes(buff[end - size:end])
+            if masked:
+                payload = _unmask(payload, bytes(buff[pos:pos + 4]))
+            del buff[:end]
+            if opcode == _PING:
+                self._conn.send(_ws_frame(payload, _PONG))
+            elif opcode == _CLOSE:
+                self._conn.close()
+            elif opcode not in (_PONG,):
+                # Текст и продолжение
+                self._message.extend(payload)
+                if fin:
+                    message, self._message = bytes(self._message), bytearray()
+                    try:
+                        self._conn.line(message.decode('utf8'))
+                    except UnicodeDecodeError:
+                        continue
+
+
+class AsyncConnect:
+    """
+    Подключение в цикле DuplexLoop, для обработчиков API заменяет Connect.
+    write можно вызывать из любого треда, чтение - коллбэк on_line в треде цикла.
+    """
+    def __init__(self, owner, ws: bool, ip_info, on_line, on_close, auth: bool = False):
+        self._owner = owner
+        self.loop = owner.loop
+        self.ws = ws
+        self._ip_info = ip_info
+        self._on_line = on_line
+        self._on_close = on_close
+        self.transport = None
+        self.auth = auth
+        self.alive = True
+        self._stats = {'messages': 0, 'bytes': 0, 'syscalls': 0}
+
+    @property
+    def proto(self) -> str:
+        return 'ws' if self.ws else 'tcp'
+
+    @property
+    def ip(self):
+        return self._ip_info[0] if self._ip_info else None
+
+    @property
+    def port(self):
+        return self._ip_info[1] if self._ip_info else None
+
+    @property
+    def info(self) -> tuple:
+        return self.proto.upper(), self.ip, self.port
+
+    @property
+    def write_stats(self) -> dict:
+        """Как Connect.write_stats, syscalls - вызовы transport.write."""
+        stats = self._stats.copy()
+        syscalls = stats['syscalls'] or 1
+        stats['messages_per_syscall'] = round(stats['messages'] / syscalls, 2)
+        stats['bytes_per_syscall'] = stats['bytes'] // syscalls
+        return stats
+
+    def settimeout(self, _):
+        pass
+
+    def extract(self):
+        # Сокет живет в цикле, отдать его нельзя
+        return None
+
+    def start_remote_log(self):
+        pass
+
+    def line(self, line: str):
+        self._on_line(line)
+
+    def write(self, data):
+        """Как Connect.write: dict -> json, в любой непонятной ситуации RuntimeError."""
+        self.write_many((data,))
+
+    def write_many(self, items):
+        """Несколько сообщений одним вызовом transport.write."""
+        if not self.alive:
+            raise RuntimeError('Connection closed')
+        items = [self._encode(data) for data in items]
+        if self.ws:
+            data = b''.join(_ws_frame(data) for data in items)
+        else:
+            data = CRLF.join(items) + CRLF
+        self._call(self.send, data, len(items))
+
+    @staticmethod
+    def _encode(data) -> bytes:
+        if not data:
+            data = ''
+        elif isinstance(data, (dict, list)):
+            try:
+                data = json_codec.dumps_bytes(data)
+            except (TypeError, ValueError) as e:
+                raise RuntimeError(e)
+        if isinstance(data, str):
+            data = data.encode()
+        elif not isinstance(data, bytes):
+            raise RuntimeError('Unsupported data type: {}'.format(repr(type(data))))
+        return data
+
+    def send(self, data: bytes, messages=1):
+        # Только в треде цикла
+        if not (self.alive and self.transport):
+            return
+        self.transport.write(data)
+        self._stats['messages'] += messages
+        self._stats['bytes'] += len(data)
+        self._stats['syscalls'] += 1
+        if self.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            self.close()
+
+    def close(self):
+        self._call(self._close)
+
+    def _close(self):
+        if not self.alive:
+            return
+        if self.transport:
+            # Клиенту сообщаем о завершении сеанса
+            self.transport.write(_ws_frame((1000).to_bytes(2, 'big'), _CLOSE) if self.ws else CRLF)
+            self.transport.close()
+        self.alive = False
+
+    def lost(self):
+        self.alive = False
+        self.transport = None
+        callback, self._on_close = self._on_close, None
+        if callback:
+            callback()
+
+    def _call(self, callback, *args):
+        if self.loop.is_closed():
+            return
+        try:
+            if self.loop.is_running() and threading.current_thread() is self._owner:
+                callback(*args)
+            else:
+                self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # Цикл уже остановлен
+            pass
+
+
+class DuplexLoop(threading.Thread):
+    """
+    Один тред с циклом asyncio на все duplex подключения. Команды API выполняются в пуле потоков,
+    по порядку для каждого подключения.
+    """
+    WORKERS = 8
+
+    def __init__(self):
+        super().__init__(name='DuplexLoop')
+        self.loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.WORKERS)
+        self._started = threading.Event()
+
+    def start(self):
+        super().start()
+        self._started.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+            self._executor.shutdown(wait=False)
+
+    def join(self, timeout=None):
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        super().join(timeout)
+
+    def attach(self, sock, ws: bool, ip_info, on_line, on_close, auth: bool = False) -> AsyncConnect:
+        """
+        Забирает сокет в цикл. on_line(line) вызывается в треде цикла, on_close() - после закрытия.
+        auth - авторизация, полученная подключением до передачи в цикл.
+        """
+        conn = AsyncConnect(self, ws, ip_info, on_line, on_close, auth)
+        sock.setblocking(False)
+        future = asyncio.run_coroutine_threadsafe(
+            self.loop.create_connection(lambda: _Protocol(conn), sock=sock), self.loop
+        )
+        future.result()
+        return conn
+
+    def executor(self, call, *args) -> asyncio.Future:
+        # Только в треде цикла
+        return self.loop.run_in_executor(self._executor, call, *args)
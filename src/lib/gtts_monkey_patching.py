@@ -13,7 +13,7 @@ import requests
 import urllib3
 from gtts.tts import log, gTTSError
 
-from .proxy import proxies
+from .sessions import sessions
 
 
 # TODO: Следить за актуальностью копипаст
@@ -59,12 +59,8 @@ class Google(gtts.gTTS):
         prepared_requests = self._prepare_requests()
         for idx, pr in enumerate(prepared_requests):
             try:
-                with requests.Session() as s:
-                    # Send request
-                    r = s.send(request=pr,
-                               # proxies=urllib.request.getproxies(),
-                               proxies=proxies('tts_google'),
-                               verify=False)
+                # Send request, keep-alive сессия вместо новой на каждый кусок
+                r = sessions.send(pr, 'tts_google', verify=False)
 
                 log.debug("headers-%i: %s", idx, r.request.headers)
                 log.debug("url-%i: %s", idx, r.request.url)
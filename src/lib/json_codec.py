@@ -0,0 +1,101 @@
+import json
+
+# Быстрые кодеки не обязательны: orjson, затем ujson, иначе стандартный json.
+# orjson разбирает целые больше 64 бит как float, для API это не важно.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+CODECS = ('orjson', 'ujson', 'json')
+# Ошибки разбора всех кодеков - наследники ValueError
+DecodeError = (ValueError, TypeError)
+
+NAME = 'json'
+_loads = json.loads
+_dumps = None
+
+
+class Parsed:
+    """
+    Параметры legacy команд: разобранный объект, строка с json собирается только если она понадобилась.
+    loads отдаст объект без повторного разбора.
+    """
+    __slots__ = ('parsed', '_str')
+
+    def __init__(self, obj):
+        self.parsed = obj
+        self._str = None
+
+    def __str__(self):
+        if self._str is None:
+            self._str = dumps(self.parsed)
+        return self._str
+
+    def __repr__(self):
+        return repr(str(self))
+
+
+def select(name: str = None) -> str:
+    """Выбирает кодек по имени или лучший из установленных, возвращает имя выбранного."""
+    global NAME, _loads, _dumps
+    available = {'orjson': orjson, 'ujson': ujson, 'json': json}
+    for name in (name,) if name else CODECS:
+        if available.get(name):
+            break
+    else:
+        raise RuntimeError('JSON codec not installed: {}'.format(name))
+    NAME = name
+    if name == 'orjson':
+        _loads, _dumps = orjson.loads, _orjson_dumps
+    elif name == 'ujson':
+        _loads, _dumps = ujson.loads, _ujson_dumps
+    else:
+        _loads, _dumps = json.loads, None
+    return NAME
+
+
+def _orjson_dumps(obj) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _ujson_dumps(obj) -> bytes:
+    return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode()
+
+
+def loads(data: str or bytes):
+    if isinstance(data, Parsed):
+        return data.parsed
+    try:
+        return _loads(data)
+    except DecodeError:
+        if _loads is json.loads:
+            raise
+    # Быстрые кодеки строже (NaN, Infinity), пусть решает стандартный
+    return json.loads(data)
+
+
+def dumps_bytes(obj) -> bytes:
+    """json.dumps(obj, ensure_ascii=False).encode(), при ошибке TypeError или ValueError."""
+    if _dumps:
+        try:
+            return _dumps(obj)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode()
+
+
+def dumps(obj) -> str:
+    if _dumps:
+        try:
+            return _dumps(obj).decode()
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return json.dumps(obj, ensure_ascii=False)
+
+
+select()
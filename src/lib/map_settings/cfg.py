@@ -1,11 +1,13 @@
 from lib import STT
 from lib import TTS
 from lib.polly_signing import AWS_REGIONS
+from lib.publisher import POLICIES
 from lib.snowboy_training import Training
 
 VAD_MODE = ['snowboy', 'webrtc', 'apm', 'energy']
 VAD_LVL = [0, 1, 2, 3]
 LOG_LVL = ['debug', 'info', 'warn', 'error', 'crit']
+LOG_FORMAT = ['text', 'json']
 _0_100 = list(range(101))
 RHVoice = ['anna', 'elena', 'irina', 'aleksandr']
 
@@ -103,6 +105,40 @@ CFG_DSC = {
         'lazy_record': {
             'name': '',
         },
+        'tts_workers': {
+            'name': '',
+        },
+        'tts_provider_limit': {
+            'name': '',
+        },
+        'tts_queue_limit': {
+            'name': '',
+        },
+        'tts_chunk_size': {
+            'name': '',
+        },
+        'output_sink': {
+            'name': '',
+        },
+        'stream_buffer': {
+            'name': '',
+        },
+        'tts_preconnect': {
+            'name': '',
+        },
+        'pubsub_workers': {
+            'name': '',
+        },
+        'pubsub_queue': {
+            'name': '',
+        },
+        'pubsub_policy': {
+            'name': '',
+            'options': POLICIES,
+        },
+        'pubsub_slow': {
+            'name': '',
+        },
     },
     'listener': {
         'stream_recognition': {
@@ -132,6 +168,9 @@ CFG_DSC = {
         'no_listen_music': {
             'name': '',
         },
+        'speculative_partials': {
+            'name': '',
+        },
     },
     'smarthome': {
         'ip': {
@@ -161,12 +200,27 @@ CFG_DSC = {
         'heartbeat_timeout': {
             'name': ''
         },
+        'notify_coalesce': {
+            'name': ''
+        },
         'disable_http': {
             'name': '',
         },
         'disable_server': {
             'name': '',
         },
+        'server_clients': {
+            'name': '',
+        },
+        'duplex_async': {
+            'name': '',
+        },
+        'batch_workers': {
+            'name': '',
+        },
+        'batch_timeout': {
+            'name': '',
+        },
     },
     'music': {
         'control': {
@@ -226,6 +280,10 @@ CFG_DSC = {
         'file': {
             'name': '',
         },
+        'file_format': {
+            'name': '',
+            'options': LOG_FORMAT,
+        },
     },
     'yandex': {
         'api': {
@@ -319,6 +377,18 @@ CFG_DSC = {
         'tts_size': {
             'name': '',
         },
+        'pcm_size': {
+            'name': '',
+        },
+        'tts_opus': {
+            'name': '',
+        },
+        'share_port': {
+            'name': '',
+        },
+        'share_url': {
+            'name': '',
+        },
         'path': {
             'name': '',
         },
@@ -0,0 +1,99 @@
+import os
+import subprocess
+import threading
+import wave
+from collections import OrderedDict, namedtuple
+
+# Декодеры выдают сырой s16le с этими параметрами, wav читаем как есть
+RAW_RATE = 24000
+DECODERS = {
+    '.mp3': ['mpg123', '-q', '-s', '-e', 's16', '-m', '-r', str(RAW_RATE), '{}'],
+    '.opus': ['opusdec', '--quiet', '--rate', str(RAW_RATE), '{}', '-'],
+}
+
+PCM = namedtuple('PCM', ['rate', 'channels', 'width', 'data'])
+
+
+def decode(path: str) -> PCM or None:
+    ext = os.path.splitext(path)[1]
+    try:
+        if ext == '.wav':
+            with wave.open(path, 'rb') as fp:
+                return PCM(fp.getframerate(), fp.getnchannels(), fp.getsampwidth(), fp.readframes(fp.getnframes()))
+        if ext not in DECODERS:
+            return None
+        cmd = [path if arg == '{}' else arg for arg in DECODERS[ext]]
+        data = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=30, check=True).stdout
+    except (OSError, EOFError, wave.Error, subprocess.SubprocessError):
+        return None
+    return PCM(RAW_RATE, 1, 2, data) if data else None
+
+
+class PCMCache:
+    """
+    Горячий кэш декодированных звуков в памяти, ограничен размером, вытесняет давно не игравшие.
+    Кэшируем то, что уже проигрывалось HITS раз.
+    """
+    HITS = 2
+
+    def __init__(self, max_size: int = 0):
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._hits = {}
+        self._loading = set()
+        self.size = 0
+        self.max_size = max_size
+
+    def get(self, path: str) -> PCM or None:
+        with self._lock:
+            pcm = self._data.get(path)
+            if pcm is not None:
+                self._data.move_to_end(path)
+            return pcm
+
+    def played(self, path: str) -> bool:
+        """Учитывает проигрывание файла. True - файл пора загрузить в кэш."""
+        with self._lock:
+            if self.max_size < 1 or path in self._data or path in self._loading:
+                return False
+            self._hits[path] = self._hits.get(path, 0) + 1
+            if len(self._hits) > 1000:
+                self._hits = {key: val for key, val in self._hits.items() if val > 1}
+            if self._hits[path] < self.HITS:
+                return False
+            self._loading.add(path)
+            return True
+
+    def load(self, path: str) -> bool:
+        try:
+            if self.max_size < 1 or os.path.getsize(path) > self.max_size:
+                return False
+            pcm = decode(path)
+        except OSError:
+            pcm = None
+        finally:
+            with self._lock:
+                self._loading.discard(path)
+        if pcm is None or len(pcm.data) > self.max_size // 4:
+            return False
+        with self._lock:
+            self._pop(path)
+            self._data[path] = pcm
+            self.size += len(pcm.data)
+            self._hits.pop(path, None)
+            self._evict()
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _pop(self, path: str):
+        pcm = self._data.pop(path, None)
+        if pcm is not None:
+            self.size -= len(pcm.data)
+
+    def _evict(self):
+        while self.size > self.max_size and self._data:
+            self._pop(next(iter(self._data)))
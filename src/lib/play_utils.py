@@ -50,6 +50,8 @@ init_backends()
 
 
 class StreamPlayer(threading.Thread):
+    CHUNK = 4096
+
     def __init__(self, popen, fp):
         super().__init__()
         self._fp = fp
@@ -64,8 +66,17 @@ class StreamPlayer(threading.Thread):
         if self.is_alive():
             super().join()
 
+    def _reader(self):
+        # RingBuffer читаем в один и тот же буфер, без лишних копий
+        readinto = getattr(self._fp, 'readinto', None)
+        if readinto is None:
+            return self._fp.read
+        buff = memoryview(bytearray(self.CHUNK))
+        return lambda: buff[:readinto(buff)]
+
     def run(self):
-        data = self._fp.read()
+        read = self._reader()
+        data = read()
         while data and self.poll() is None:
             try:
                 self._popen.write(data)
@@ -75,7 +86,7 @@ class StreamPlayer(threading.Thread):
                 # Скорее всего это аппаратная проблема или проблема паузы между чанками
                 # На всякий случай я увеличу размер чанка при стриминге wav до 4 KiB, но это не сильно помогает
                 break
-            data = self._fp.read()
+            data = read()
         self._popen.close()
 
 
@@ -166,8 +177,36 @@ def _get_cmd1(path):
     return cmd
 
 
+class PCMStream:
+    """Отдает PCM из памяти кусками, как RingBuffer."""
+    CHUNK = 8192
+
+    def __init__(self, data: bytes):
+        self._data = memoryview(data)
+        self._pos = 0
+
+    def read(self, _=None):
+        chunk = self._data[self._pos:self._pos + self.CHUNK]
+        self._pos += len(chunk)
+        return chunk
+
+    def write(self, data):
+        # Плеер останавливает стрим пустой записью
+        if not data:
+            self._pos = len(self._data)
+
+
+def get_pcm_popen(pcm, callback):
+    # Сырой PCM сразу в aplay, без чтения с диска и декодера
+    cmd = [
+        'aplay', '-q', '-t', 'raw', '-f', 'S{}_LE'.format(pcm.width * 8) if pcm.width > 1 else 'U8',
+        '-r', str(pcm.rate), '-c', str(pcm.channels), '-'
+    ]
+    return StreamPlayer(Popen(cmd, callback), PCMStream(pcm.data))
+
+
 def get_popen(ext, file, stream, callback, backend=None):
-    file_path = '-' if stream else file
+    file_path = '-' if stream is not None else file
     if backend in BACKENDS:
         cmd1 = None
         cmd2 = BACKENDS[backend].copy()
@@ -178,7 +217,7 @@ def get_popen(ext, file, stream, callback, backend=None):
     else:
         cmd1 = None
         cmd2 = _get_cmd2(ext, file_path)
-    if stream:
+    if stream is not None:
         return StreamPlayer(_select_popen(cmd1, cmd2, callback), stream)
     else:
         return _select_popen(cmd1, cmd2, callback)
@@ -1,8 +1,102 @@
+import collections
 import queue
 import threading
+import time
+import traceback
+
+import logger
+
+# Что делать, когда очередь подписчика полна
+BLOCK = 'block'  # публикующий ждет до BLOCK_TIMEOUT, потом выкидываем самое старое
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'  # такое же событие в очереди заменяется новым, иначе как drop_oldest
+POLICIES = (BLOCK, DROP_OLDEST, COALESCE)
+# Границы корзин гистограмм, ms
+BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class _Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, ms: float):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        for idx, bound in enumerate(BUCKETS):
+            if ms <= bound:
+                break
+        else:
+            idx = len(BUCKETS)
+        self.buckets[idx] += 1
+
+    def to_dict(self) -> dict:
+        names = ['<={}'.format(x) for x in BUCKETS] + ['>{}'.format(BUCKETS[-1])]
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 3) if self.count else 0,
+            'max': round(self.max, 3),
+            'buckets': dict(zip(names, self.buckets)),
+        }
+
+
+class _Stats:
+    """Счетчики события или подписчика, время в ms."""
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.dropped = 0
+        self.slow = 0
+        self.warned = 0
+        self.drop_warned = 0
+        # От публикации до вызова
+        self.delay = _Histogram()
+        # Сколько выполнялся коллбэк
+        self.duration = _Histogram()
+
+    def to_dict(self) -> dict:
+        result = {'calls': self.calls, 'delay': self.delay.to_dict()}
+        if self.duration.count or self.dropped:
+            result.update(errors=self.errors, dropped=self.dropped, slow=self.slow, duration=self.duration.to_dict())
+        return result
+
+
+def callback_name(callback) -> str:
+    # Модуль выдает плагин, qualname - класс и метод
+    name = getattr(callback, '__qualname__', None) or type(callback).__qualname__
+    return '{}:{}'.format(getattr(callback, '__module__', None) or '?', name)
+
+
+class _Subscriber:
+    """Очередь одного коллбэка. Выполняется не больше чем в одном потоке за раз, порядок сохраняется."""
+    def __init__(self, callback, policy):
+        self.callback = callback
+        self.policy = policy
+        self.queue = collections.deque()
+        # Сколько подписок (канал, событие) на этот коллбэк
+        self.refs = 0
+        self.scheduled = False
+        self.closed = False
+        self.stats = None
+        self.queue_max = 0
 
 
 class PubSub(threading.Thread):
+    """
+    Шина событий. Вызовы и изменения подписок обрабатываются в треде шины по порядку.
+    Если workers > 0, у каждого подписчика своя ограниченная очередь, а коллбэки выполняются в пуле потоков,
+    так что медленный подписчик не тормозит остальных. workers == 0 - все коллбэки прямо в треде шины.
+    """
+    BLOCK_TIMEOUT = 1
+    IDLE_TIMEOUT = 60
+    # Сколько вызовов одного подписчика подряд, потом очередь других
+    BATCH = 10
+    # Не чаще раза в WARN_INTERVAL секунд на подписчика
+    WARN_INTERVAL = 60
+
     def __init__(self):
         super().__init__(name='PubSub')
         # Подписки, формат `[канал][событие]: [список коллбэков]`
@@ -11,10 +105,69 @@ class PubSub(threading.Thread):
         self._queue = queue.Queue()
         self.stopping = False
         self._unsubscribe_later = []
+        self.workers = 4
+        self.queue_size = 100
+        self.policy = DROP_OLDEST
+        # Порог медленного коллбэка, ms. 0 - не предупреждать
+        self.slow = 0
+        self.log = None
+        self._stats_lock = threading.Lock()
+        # (канал, событие): _Stats
+        self._event_stats = {}
+        # имя коллбэка: _Stats, переживает отписку
+        self._subscriber_stats = {}
+        # коллбэк: _Subscriber
+        self._subscribers = {}
+        self._cv = threading.Condition()
+        self._ready = collections.deque()
+        self._threads = set()
+        self._idle = 0
+        self._pool_work = True
         self.start()
 
-    def subscribe(self, event, callback, channel='default') -> bool:
-        return self._subscribe_action('add_subscribe', event, callback, channel)
+    def configure(self, workers: int, queue_size: int, policy: str, slow: int = 0):
+        with self._cv:
+            self.workers = max(0, workers)
+            self.queue_size = max(1, queue_size)
+            self.policy = policy if policy in POLICIES else DROP_OLDEST
+            self.slow = max(0, slow)
+
+    def stats(self, reset=False) -> dict:
+        """
+        Снимок счетчиков шины: очередь шины, события по каналам и подписчики.
+        Для подписчиков еще текущая и максимальная очередь.
+        """
+        with self._cv:
+            queues = {}
+            for sub in self._subscribers.values():
+                name = callback_name(sub.callback)
+                queue_, max_ = queues.get(name, (0, 0))
+                queues[name] = (queue_ + len(sub.queue), max(max_, sub.queue_max))
+                if reset:
+                    sub.queue_max = len(sub.queue)
+            threads = len(self._threads)
+        with self._stats_lock:
+            events = {}
+            for (channel, name), stats in self._event_stats.items():
+                events.setdefault(channel, {})[name] = stats.to_dict()
+            subscribers = {name: stats.to_dict() for name, stats in self._subscriber_stats.items()}
+            if reset:
+                for stats in list(self._event_stats.values()) + list(self._subscriber_stats.values()):
+                    stats.__init__()
+        for name, (queue_, max_) in queues.items():
+            subscribers.setdefault(name, _Stats().to_dict()).update(queue=queue_, queue_max=max_)
+        return {
+            'queue': self._queue.qsize(),
+            'workers': threads,
+            'slow_ms': self.slow,
+            'events': events,
+            'subscribers': subscribers,
+        }
+
+    def subscribe(self, event, callback, channel='default', policy=None) -> bool:
+        if policy is not None and policy not in POLICIES:
+            return False
+        return self._subscribe_action('add_subscribe', event, callback, channel, policy)
 
     def unsubscribe(self, event, callback, channel='default') -> bool:
         return self._subscribe_action('remove_subscribe', event, callback, channel)
@@ -32,13 +185,33 @@ class PubSub(threading.Thread):
 
     def call(self, name, *args, **kwargs):
         # Внешний вызов, канал default
-        self._queue.put_nowait(('default', name, args, kwargs))
+        self._backpressure('default', name)
+        self._queue.put_nowait(('default', name, args, kwargs, time.time()))
 
     def sub_call(self, channel: str, event: str, *args, **kwargs):
-        self._queue.put_nowait((channel, event, args, kwargs))
+        self._backpressure(channel, event)
+        self._queue.put_nowait((channel, event, args, kwargs, time.time()))
 
     def _call(self, channel, name, *args, **kwargs):
-        self._queue.put_nowait((channel, name, args, kwargs))
+        self._backpressure(channel, name)
+        self._queue.put_nowait((channel, name, args, kwargs, time.time()))
+
+    def _backpressure(self, channel, name):
+        # BLOCK: ждет публикующий, а не тред шины. Коллбэки шины не ждут, иначе могут ждать сами себя
+        callbacks = self._event_callbacks.get(channel, {}).get(name)
+        current = threading.current_thread()
+        if not (callbacks and self.workers) or current is self or current in self._threads:
+            return
+        end = time.time() + self.BLOCK_TIMEOUT
+        with self._cv:
+            while not self.stopping and time.time() < end:
+                subs = [self._subscribers.get(callback) for callback in list(callbacks)]
+                if not any(self._is_full(sub) for sub in subs if sub):
+                    break
+                self._cv.wait(end - time.time())
+
+    def _is_full(self, sub: _Subscriber) -> bool:
+        return (sub.policy or self.policy) == BLOCK and not sub.closed and len(sub.queue) >= self.queue_size
 
     def join(self, timeout=30):
         self._queue.put_nowait(None)
@@ -47,6 +220,13 @@ class PubSub(threading.Thread):
     def run(self):
         while self._processing(self._queue.get()):
             pass
+        # Доделываем что осталось в очередях подписчиков
+        with self._cv:
+            self._pool_work = False
+            self._cv.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(self.BLOCK_TIMEOUT * 10)
 
     def report(self):
         while self._unsubscribe_later:
@@ -58,9 +238,9 @@ class PubSub(threading.Thread):
         if isinstance(data, tuple):
             self._call_processing(*data)
         elif isinstance(data, list):
-            (cmd, channel, data) = data
+            (cmd, channel, data, policy) = data
             if cmd == 'add_subscribe':
-                self._add_subscribe(data, channel)
+                self._add_subscribe(data, channel, policy)
             elif cmd == 'remove_subscribe':
                 if self.stopping:
                     self._unsubscribe_later.append((data, channel))
@@ -74,33 +254,172 @@ class PubSub(threading.Thread):
             raise RuntimeError('Wrong type of data: {}'.format(repr(data)))
         return True
 
-    def _call_processing(self, channel, name, args, kwargs):
+    def _call_processing(self, channel, name, args, kwargs, ts):
         # Вызываем подписчиков
         if channel in self._event_callbacks and name in self._event_callbacks[channel]:
-            for callback in self._event_callbacks[channel][name]:
-                callback(name, *args, **kwargs)
+            with self._stats_lock:
+                stats = self._event_stats.get((channel, name))
+                if stats is None:
+                    stats = self._event_stats[(channel, name)] = _Stats()
+                stats.calls += 1
+                stats.delay.add((time.time() - ts) * 1000)
+            item = (channel, name, args, kwargs, ts)
+            if not self.workers:
+                for callback in list(self._event_callbacks[channel][name]):
+                    self._dispatch(self._subscribers[callback], item)
+                return
+            with self._cv:
+                for callback in self._event_callbacks[channel][name]:
+                    self._put(self._subscribers[callback], item)
+
+    def _put(self, sub: _Subscriber, item: tuple):
+        policy = sub.policy or self.policy
+        if policy == COALESCE:
+            for idx, queued in enumerate(sub.queue):
+                if queued[:2] == item[:2]:
+                    # Новые аргументы, но место в очереди и время постановки старые
+                    sub.queue[idx] = item[:4] + queued[4:]
+                    return
+        # Тред шины никогда не ждет, BLOCK уже отработал в _backpressure
+        dropped = 0
+        while len(sub.queue) >= self.queue_size:
+            sub.queue.popleft()
+            dropped += 1
+        if dropped:
+            self._dropped(sub, item[1], dropped)
+        sub.queue.append(item)
+        sub.queue_max = max(sub.queue_max, len(sub.queue))
+        if not sub.scheduled:
+            sub.scheduled = True
+            self._ready.append(sub)
+            if self._idle:
+                self._cv.notify_all()
+            elif len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._worker, name='PubSubWorker')
+                self._threads.add(thread)
+                thread.start()
 
-    def _add_subscribe(self, data, channel):
+    def _worker(self):
+        while True:
+            with self._cv:
+                while not self._ready and self._pool_work:
+                    self._idle += 1
+                    notified = self._cv.wait(self.IDLE_TIMEOUT)
+                    self._idle -= 1
+                    if not (notified or self._ready):
+                        break
+                if not self._ready:
+                    self._threads.discard(threading.current_thread())
+                    return
+                sub = self._ready.popleft()
+                items = [sub.queue.popleft() for _ in range(min(self.BATCH, len(sub.queue)))]
+                # Освободилось место для BLOCK
+                self._cv.notify_all()
+            for item in items:
+                if sub.closed:
+                    break
+                self._dispatch(sub, item)
+            with self._cv:
+                if sub.queue and not sub.closed:
+                    self._ready.append(sub)
+                    self._cv.notify_all()
+                else:
+                    sub.scheduled = False
+
+    def _dropped(self, sub: _Subscriber, name: str, count: int):
+        now, warn = time.time(), False
+        with self._stats_lock:
+            stats = self._sub_stats(sub)
+            stats.dropped += count
+            total = stats.dropped
+            if now - stats.drop_warned > self.WARN_INTERVAL:
+                stats.drop_warned, warn = now, True
+        if warn and self.log:
+            self.log('Queue of {} is full on \'{}\', dropped oldest: {} (total {})'.format(
+                callback_name(sub.callback), name, count, total), logger.WARN)
+
+    def _sub_stats(self, sub: _Subscriber) -> _Stats:
+        # Под _stats_lock
+        if sub.stats is None:
+            name = callback_name(sub.callback)
+            sub.stats = self._subscriber_stats.get(name)
+            if sub.stats is None:
+                sub.stats = self._subscriber_stats[name] = _Stats()
+        return sub.stats
+
+    def _dispatch(self, sub: _Subscriber, item: tuple):
+        _, name, args, kwargs, ts = item
+        start = time.time()
+        error = False
+        try:
+            sub.callback(name, *args, **kwargs)
+        except Exception:
+            error = True
+            if not self.workers:
+                raise
+            # Падение подписчика не должно ронять шину
+            if self.log:
+                self.log('Callback {} on \'{}\' failed:\n{}'.format(
+                    callback_name(sub.callback), name, traceback.format_exc()), logger.ERROR)
+            else:
+                # Логгер еще не подключен
+                traceback.print_exc()
+        finally:
+            end = time.time()
+            duration = (end - start) * 1000
+            warn = False
+            with self._stats_lock:
+                stats = self._sub_stats(sub)
+                stats.calls += 1
+                stats.errors += error
+                stats.delay.add((start - ts) * 1000)
+                stats.duration.add(duration)
+                if self.slow and duration >= self.slow:
+                    stats.slow += 1
+                    if end - stats.warned > self.WARN_INTERVAL:
+                        stats.warned, warn = end, True
+            if warn and self.log:
+                self.log('Slow callback {} on \'{}\': {:.0f} ms (delay {:.0f} ms)'.format(
+                    callback_name(sub.callback), name, duration, (start - ts) * 1000), logger.WARN)
+
+    def _add_subscribe(self, data, channel, policy=None):
         # Добавляем подписчиков
         if channel not in self._event_callbacks:
             self._event_callbacks[channel] = {}
         for name, callback in data:
             if name not in self._event_callbacks[channel]:
                 self._event_callbacks[channel][name] = set()
+            if callback in self._event_callbacks[channel][name]:
+                continue
             self._event_callbacks[channel][name].add(callback)
+            with self._cv:
+                if callback not in self._subscribers:
+                    self._subscribers[callback] = _Subscriber(callback, policy)
+                elif policy:
+                    self._subscribers[callback].policy = policy
+                self._subscribers[callback].refs += 1
 
     def _remove_subscribe(self, data, channel):
         # Удаляем подписчиков
         for name, callback in data:
-            if name not in self._event_callbacks.get(channel, {}):
+            if callback not in self._event_callbacks.get(channel, {}).get(name, ()):
                 continue
             self._event_callbacks[channel][name].discard(callback)
+            with self._cv:
+                sub = self._subscribers[callback]
+                sub.refs -= 1
+                if not sub.refs:
+                    # Отписался совсем, недоставленное выкидываем
+                    sub.closed = True
+                    sub.queue.clear()
+                    del self._subscribers[callback]
+                    self._cv.notify_all()
             if not self._event_callbacks[channel][name]:
                 del self._event_callbacks[channel][name]
             if not self._event_callbacks[channel]:
                 del self._event_callbacks[channel]
 
-    def _subscribe_action(self, cmd, event, callback, channel) -> bool:
+    def _subscribe_action(self, cmd, event, callback, channel, policy=None) -> bool:
         if isinstance(event, (list, tuple)) and isinstance(callback, (list, tuple)):
             # Так нельзя
             return False
@@ -114,6 +433,6 @@ class PubSub(threading.Thread):
         else:
             data = [(event, callback)]
         if data:
-            self._queue.put_nowait([cmd, channel, data])
+            self._queue.put_nowait([cmd, channel, data, policy])
             return True
         return False
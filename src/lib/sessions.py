@@ -0,0 +1,92 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from utils import REQUEST_ERRORS
+from .proxy import proxies
+
+
+class _Sessions:
+    """
+    Keep-alive сессии requests по ключам lib.proxy, TLS соединение живет дольше одной фразы.
+    Прокси берется на каждый запрос, так что смена настроек подхватывается сразу.
+    """
+    # Сервера обычно держат простаивающее соединение 30-60 секунд, свежее не трогаем
+    FRESH = 15
+    PRECONNECT_TIMEOUT = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        # Куда ходили последний раз и когда, для предварительного подключения
+        self._origins = {}
+        self._closed = {}
+
+    def get(self, key: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = requests.Session()
+            return session
+
+    def request(self, method: str, url: str, key: str, quiet=False, **kwargs) -> requests.Response:
+        self._touch(key, url)
+        return self.get(key).request(method, url, proxies=proxies(key, quiet), **kwargs)
+
+    def send(self, prepared: requests.PreparedRequest, key: str, **kwargs) -> requests.Response:
+        self._touch(key, prepared.url)
+        return self.get(key).send(prepared, proxies=proxies(key), **kwargs)
+
+    def _touch(self, key: str, url: str):
+        parts = urlsplit(url)
+        self._origins[key] = ('{}://{}/'.format(parts.scheme, parts.netloc), time.time())
+
+    def preconnect(self, key: str):
+        """Фоном открывает соединение туда, куда ключ ходил последний раз, если оно могло закрыться."""
+        origin, last_use = self._origins.get(key, (None, 0))
+        if origin and time.time() - last_use > self.FRESH:
+            threading.Thread(target=self._preconnect, args=(key, origin), name='Preconnect').start()
+
+    def _preconnect(self, key: str, origin: str):
+        try:
+            self.request('HEAD', origin, key, quiet=True, timeout=self.PRECONNECT_TIMEOUT).close()
+        except REQUEST_ERRORS:
+            pass
+
+    def clear(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+            self._origins.clear()
+        for key, session in sessions.items():
+            self._add_stats(self._closed, key, session)
+            session.close()
+
+    def stats(self) -> dict:
+        """{ключ: {'new': новых соединений, 'reused': запросов по уже открытым}}"""
+        with self._lock:
+            result = {key: val.copy() for key, val in self._closed.items()}
+            for key, session in self._sessions.items():
+                self._add_stats(result, key, session)
+        return result
+
+    @staticmethod
+    def _add_stats(target: dict, key: str, session: requests.Session):
+        connections = requests_ = 0
+        for adapter in session.adapters.values():
+            managers = [getattr(adapter, 'poolmanager', None)] + list(getattr(adapter, 'proxy_manager', {}).values())
+            for manager in filter(None, managers):
+                for pool_key in manager.pools.keys():
+                    pool = manager.pools.get(pool_key)
+                    if pool is not None:
+                        connections += pool.num_connections
+                        requests_ += pool.num_requests
+        if not requests_:
+            return
+        stats = target.setdefault(key, {'new': 0, 'reused': 0})
+        stats['new'] += connections
+        stats['reused'] += max(0, requests_ - connections)
+
+
+sessions = _Sessions()
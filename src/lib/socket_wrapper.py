@@ -8,7 +8,6 @@ This code was modified by Aculeasis, 2019
 
 import base64
 import hashlib
-import json
 import socket
 import ssl
 import threading
@@ -17,6 +16,8 @@ from contextlib import closing
 import platform
 import websocket  # pip install websocket-client
 
+from lib import json_codec
+
 HANDSHAKE_STR = (
     "HTTP/1.1 101 Switching Protocols\r\n"
     "Upgrade: WebSocket\r\n"
@@ -71,6 +72,14 @@ def get_headers(request_text: bytearray) -> dict:
     return result
 
 
+class _Batch:
+    """Сообщения одной записи в TCP сокет, ошибку получат все их писатели."""
+    __slots__ = ('error',)
+
+    def __init__(self):
+        self.error = None
+
+
 class Connect:
     CHUNK_SIZE = 1024 * 4
 
@@ -82,6 +91,11 @@ class Connect:
         self.auth = auth
         self._send_lock = threading.Lock()
         self._recv_lock = threading.Lock()
+        # Сообщения ждущие отправки, их заберет тот кто держит _send_lock
+        self._pending = []
+        self._batch = _Batch()
+        self._pending_lock = threading.Lock()
+        self._stats = {'messages': 0, 'bytes': 0, 'syscalls': 0}
         self.alive = conn is not None
 
     @property
@@ -113,6 +127,15 @@ class Connect:
     def info(self) -> tuple:
         return self.proto.upper(), self.ip, self.port
 
+    @property
+    def write_stats(self) -> dict:
+        """Сколько отправлено сообщений и байт, за сколько вызовов send."""
+        stats = self._stats.copy()
+        syscalls = stats['syscalls'] or 1
+        stats['messages_per_syscall'] = round(stats['messages'] / syscalls, 2)
+        stats['bytes_per_syscall'] = stats['bytes'] // syscalls
+        return stats
+
     def settimeout(self, timeout):
         if self._conn:
             self._conn.settimeout(timeout)
@@ -127,6 +150,23 @@ class Connect:
                 self._ip_info = None
                 self.auth = False
 
+    def detach(self) -> tuple or None:
+        """
+        Отдает сырой сокет, признак веб-сокета и авторизацию, Connect после этого пуст.
+        None - сокет отдать нельзя: TLS, клиентский веб-сокет или в буфере уже есть непрочитанные данные.
+        """
+        conn = self._conn
+        if self._is_ws:
+            if not isinstance(conn, WSServerAdapter) or conn.frame_buffer.recv_buffer:
+                return None
+            conn = conn.sock
+        if type(conn) is not socket.socket:
+            return None
+        auth, self.auth = self.auth, False
+        self.alive = False
+        self._conn = None
+        return conn, self._is_ws, auth
+
     def insert(self, conn, ip_info):
         self.auth = False
         self.alive = True
@@ -150,7 +190,7 @@ class Connect:
     def _tcp_close(self):
         try:
             # Сообщаем серверу о завершении сеанса отправкой \r\n\r\n
-            self._tcp_write(CRLF)
+            self._tcp_write([CRLF])
         except RuntimeError:
             pass
         try:
@@ -175,39 +215,78 @@ class Connect:
         Если это веб-сокет то кидаем все в str.
         В любой непонятной ситуации кидает RuntimeError.
         """
+        self.write_many((data,))
+
+    def write_many(self, items):
+        """
+        Как write для нескольких сообщений. В TCP все уходит одной записью в сокет вместе с сообщениями
+        от других тредов, которые ждали пока сокет занят.
+        """
         if not self._conn:
             return
+        items = [self._encode(data) for data in items]
+        if self._is_ws:
+            with self._send_lock:
+                for data in items:
+                    self._ws_write(data)
+        else:
+            self._tcp_write(items)
+
+    def _encode(self, data) -> str or bytes:
         if not data:
             data = ''
         elif isinstance(data, (dict, list)):
             try:
-                data = json.dumps(data, ensure_ascii=False)
-            except TypeError as e:
+                return json_codec.dumps(data) if self._is_ws else json_codec.dumps_bytes(data)
+            except (TypeError, ValueError) as e:
                 raise RuntimeError(e)
-
-        with self._send_lock:
-            self._ws_write(data) if self._is_ws else self._tcp_write(data)
-
-    def _tcp_write(self, data: str or bytes):
+        if self._is_ws:
+            return data
         if isinstance(data, str):
-            data = data.encode()
+            return data.encode()
         elif not isinstance(data, bytes):
             raise RuntimeError('Unsupported data type: {}'.format(repr(type(data))))
-        data += CRLF
-        timeout = 0
-        while data:
+        return data
+
+    def _tcp_write(self, items: list):
+        with self._pending_lock:
+            self._pending.extend(items)
+            batch = self._batch
+        with self._send_lock:
+            with self._pending_lock:
+                if batch is not self._batch:
+                    # Уже отправил тот, кто держал сокет
+                    if batch.error is not None:
+                        raise RuntimeError(batch.error)
+                    return
+                items, self._pending, self._batch = self._pending, [], _Batch()
             try:
-                sending = self._conn.send(data)
-            except socket.timeout as e:
-                timeout += 1
-                if timeout > 5:
+                self._tcp_send(CRLF.join(items) + CRLF, len(items))
+            except RuntimeError as e:
+                batch.error = e
+                raise
+
+    def _tcp_send(self, data: bytes, messages: int):
+        view, timeout, syscalls = memoryview(data), 0, 0
+        try:
+            while view:
+                try:
+                    sending = self._conn.send(view)
+                except socket.timeout as e:
+                    # send уже прождал таймаут сокета
+                    timeout += 1
+                    if timeout > 5:
+                        raise RuntimeError(e)
+                    continue
+                except (socket.error, AttributeError) as e:
                     raise RuntimeError(e)
-                time.sleep(0.1)
-                continue
-            except (socket.error, AttributeError) as e:
-                raise RuntimeError(e)
-            timeout = 0
-            data = data[sending:]
+                syscalls += 1
+                timeout = 0
+                view = view[sending:]
+        finally:
+            self._stats['syscalls'] += syscalls
+        self._stats['messages'] += messages
+        self._stats['bytes'] += len(data)
 
     def _ws_write(self, data: str or bytes):
         if isinstance(data, bytes):
@@ -216,9 +295,12 @@ class Connect:
             raise RuntimeError('Unsupported data type: {}'.format(repr(type(data))))
         if self._conn.auth:
             try:
-                self._conn.send(data)
+                sending = self._conn.send(data)
             except ALL_EXCEPTS as e:
                 raise RuntimeError(e)
+            self._stats['messages'] += 1
+            self._stats['bytes'] += sending
+            self._stats['syscalls'] += 1
 
     def read(self):
         """
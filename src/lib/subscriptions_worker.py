@@ -3,37 +3,75 @@ import queue
 import threading
 
 from lib.api.api import InternalException
+from lib.coalescer import Coalescer, POLICIES
 from lib.socket_wrapper import Connect
 from owner import Owner
 
 
 class SubscriptionsWorker(threading.Thread):
-    def __init__(self, own: Owner, conn: Connect):
+    # Сколько событий из очереди собрать в одну запись в сокет
+    BATCH = 64
+
+    def __init__(self, own: Owner, conn: Connect, window: float = 0):
         super().__init__()
         self.own = own
         self._conn = conn
         self._queue = queue.Queue()
+        self._coalescer = Coalescer(window)
         self._subscribes = set()
         self.work = True
         self.start()
 
     def run(self) -> None:
         while self.work:
-            notify = self._queue.get()
-            if notify is None:
+            try:
+                notify = self._queue.get(timeout=self._coalescer.timeout())
+            except queue.Empty:
+                notify = ()
+            # Все что уже накопилось в очереди уходит одной записью
+            notifies = [notify]
+            while notify is not None and len(notifies) < self.BATCH:
+                try:
+                    notify = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                notifies.append(notify)
+            ready = []
+            for notify in notifies:
+                if notify is None:
+                    break
+                ready.extend(self._process(notify))
+            try:
+                if ready and self._conn.alive:
+                    self._conn.write_many([_make_notify(*x) for x in ready])
+            except RuntimeError:
                 break
-            elif self._conn.alive:
-                name, args, kwargs = _send_adapter(*notify)
-                msg = {'method': 'notify.{}'.format(name), 'params': {'args': args, 'kwargs': kwargs}}
-                self._conn.write(msg)
-            else:
+            if notify is None or not self._conn.alive:
                 break
         self._unsubscribe_all()
 
+    def _process(self, notify) -> list:
+        if isinstance(notify, dict):
+            return self._coalescer.configure(notify.get('window'), notify.get('events'))
+        elif notify:
+            return self._coalescer.add(notify[0], notify[1:])
+        return self._coalescer.flush()
+
     def _new_message(self, name, *args, **kwargs):
         if self.work:
             self._queue.put_nowait((name, args, kwargs))
 
+    def coalesce(self, data: dict) -> bool:
+        """
+        Склейка частых событий этой подписки, применится в треде отправки.
+        window - окно в ms (0 - выключить), events - {событие: off, latest, batch или None - по умолчанию}.
+        """
+        if not self.work:
+            return False
+        window, events = _sanitize_coalesce(data)
+        self._queue.put_nowait({'window': window, 'events': events})
+        return True
+
     def _unsubscribe_all(self):
         self.work = False
         if self._subscribes:
@@ -66,12 +104,104 @@ class SubscriptionsWorker(threading.Thread):
         return _send_list_adapter(self.own.events_list()) if self.work else []
 
 
+class AsyncSubscriptions:
+    """
+    SubscriptionsWorker для подключений в цикле asyncio: без своего треда,
+    события из шины переходят в цикл через call_soon_threadsafe, склейка по таймеру цикла.
+    """
+    def __init__(self, own: Owner, conn, window: float = 0):
+        self.own = own
+        self._conn = conn
+        self._loop = conn.loop
+        self._coalescer = Coalescer(window)
+        self._subscribes = set()
+        self._timer = None
+        self.work = True
+
+    def _new_message(self, name, *args, **kwargs):
+        self._call(self._add, name, (args, kwargs))
+
+    def _call(self, callback, *args):
+        if self.work:
+            try:
+                self._loop.call_soon_threadsafe(callback, *args)
+            except RuntimeError:
+                # Цикл уже остановлен
+                pass
+
+    def _add(self, name, data: tuple):
+        self._process(self._coalescer.add(name, data))
+
+    def _configure(self, window, events):
+        self._process(self._coalescer.configure(window, events))
+
+    def _flush(self):
+        self._timer = None
+        self._process(self._coalescer.flush())
+
+    def _process(self, ready: list):
+        if not (self.work and self._conn.alive):
+            return
+        try:
+            self._conn.write_many([_make_notify(*x) for x in ready])
+        except RuntimeError:
+            return self.close_signal()
+        if self._timer:
+            self._timer.cancel()
+        timeout = self._coalescer.timeout()
+        self._timer = self._loop.call_later(timeout, self._flush) if timeout is not None else None
+
+    def coalesce(self, data: dict) -> bool:
+        if not self.work:
+            return False
+        self._call(self._configure, *_sanitize_coalesce(data))
+        return True
+
+    def close_signal(self):
+        self.work = False
+        if self._subscribes:
+            self.own.unsubscribe(list(self._subscribes), self._new_message)
+            self._subscribes.clear()
+
+    def join(self, *_):
+        self.close_signal()
+
+    subscribe = SubscriptionsWorker.subscribe
+    unsubscribe = SubscriptionsWorker.unsubscribe
+    events_list = SubscriptionsWorker.events_list
+
+
+def _make_notify(name, data: list, batch: bool) -> dict:
+    send_name, args, kwargs = _send_adapter(name, *data[-1])
+    msg = {'method': 'notify.{}'.format(send_name), 'params': {'args': args, 'kwargs': kwargs}}
+    if batch:
+        # Старые клиенты увидят последнее значение
+        msg['params']['batch'] = [dict(zip(('args', 'kwargs'), _send_adapter(name, *x)[1:])) for x in data]
+    return msg
+
+
 def _sanitize_subscribe_list(data: list) -> set:
     if not data or not isinstance(data, list) or any(True for el in data if not isinstance(el, str) or el == ''):
         raise InternalException(msg='params must be non-empty list<str>')
     return _receive_adapter(set(data))
 
 
+def _sanitize_coalesce(data: dict) -> tuple:
+    if not isinstance(data, dict):
+        raise InternalException(msg='params must be dict')
+    window, events = data.get('window'), data.get('events') or {}
+    if window is not None:
+        if not isinstance(window, int) or isinstance(window, bool) or window < 0:
+            raise InternalException(msg='window must be non-negative int')
+        window /= 1000
+    if not isinstance(events, dict):
+        raise InternalException(msg='events must be dict')
+    for key, val in events.items():
+        if not key or not (val is None or val in POLICIES):
+            raise InternalException(msg='Wrong policy for \'{}\': {}'.format(key, repr(val)))
+    return window, events
+
+
 _ADAPTER_SEND_MAP = {
     'start_talking': ('talking', True),
     'stop_talking': ('talking', False),
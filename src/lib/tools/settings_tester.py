@@ -9,14 +9,31 @@ SETTINGS_TESTER = {
         'ask_me_again': lambda x: min_max(x, min_=0),
         'phrase_time_limit': lambda x: min_max(x, min_=1),
         'silent_multiplier': lambda x: min_max(x, 0.1, 5.0),
+        'tts_workers': lambda x: min_max(x, min_=1),
+        'tts_provider_limit': lambda x: min_max(x, min_=0),
+        'tts_queue_limit': lambda x: min_max(x, min_=0),
+        'tts_chunk_size': lambda x: min_max(x, min_=0),
+        'stream_buffer': lambda x: min_max(x, min_=16),
+        'pubsub_workers': lambda x: min_max(x, min_=0),
+        'pubsub_queue': lambda x: min_max(x, min_=1),
+        'pubsub_slow': lambda x: min_max(x, min_=0),
     },
     'listener': {
         'vad_lvl': lambda x: min_max(x, 1, 3),
         'speech_timeout': lambda x: min_max(x, min_=0),
+        'speculative_partials': lambda x: min_max(x, min_=0),
     },
     'smarthome': {
         'heartbeat_timeout': lambda x: min_max(x, min_=0),
+        'notify_coalesce': lambda x: min_max(x, min_=0),
         'pool_size': lambda x: min_max(x, min_=0),
+        'server_clients': lambda x: min_max(x, min_=1),
+        'batch_workers': lambda x: min_max(x, min_=0),
+        'batch_timeout': lambda x: min_max(x, min_=1),
+    },
+    'cache': {
+        'pcm_size': lambda x: min_max(x, min_=0),
+        'share_port': lambda x: min_max(x, 0, 65535),
     },
     'log': {
         'method': lambda x: min_max(x, 0, 3),
@@ -0,0 +1,379 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+MANIFEST = '.manifest.json'
+# Файлы по 1 KiB и меньше считаем поврежденными
+MIN_FILE_SIZE = 1024
+
+
+def split_name(name: str) -> tuple:
+    # provider_sha1.ext -> (provider, sha1, ext). Чужие файлы тоже учитываем, но найти их нельзя
+    base, ext = os.path.splitext(name)
+    try:
+        provider, sha1 = base.rsplit('_', 1)
+    except ValueError:
+        return '', '', ext[1:]
+    if len(sha1) != 40:
+        return '', '', ext[1:]
+    return provider, sha1, ext[1:]
+
+
+class TTSCache:
+    """
+    Индекс tts кэша в памяти, файловую систему трогаем только при загрузке, записи и удалении.
+    Порядок записей - LRU, первые давно не использовались.
+    """
+    SAVE_INTERVAL = 300
+    # Переполненный кэш чистим с запасом, до этой доли от max_size
+    LOW_WATER = 0.7
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        # имя файла: [размер, время последнего использования, исходный формат или '', не перекодировать]
+        self._files = OrderedDict()
+        # sha1: {(провайдер, исходный формат): имя файла}
+        self._by_hash = {}
+        self.size = 0
+        # < 0 - без ограничений
+        self.max_size = -1
+        self._dirty = False
+        self._save_time = 0
+
+    def __len__(self):
+        return len(self._files)
+
+    @property
+    def path(self) -> str or None:
+        return self._path
+
+    def load(self, path: str) -> list:
+        """
+        (Пере)строит индекс из манифеста, новые файлы добавляет, пропавшие забывает.
+        :return: список удаленных поврежденных файлов.
+        """
+        # Путь из настроек как есть: 'tts/', '~/x/../tts' - сравниваем только нормализованные
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._path and self._path != path:
+                self._save()
+            self._path = path
+            self._files.clear()
+            self._by_hash.clear()
+            self.size = 0
+            manifest = self._load_manifest()
+            # Скрытые - манифест и временные файлы
+            on_disk = set(name for name in os.listdir(path) if not name.startswith('.'))
+            wrong_files, found = [], []
+            for name, size, last_use, orig, keep in manifest:
+                if name in on_disk:
+                    on_disk.discard(name)
+                    found.append((name, size, last_use, orig, keep))
+            for name in on_disk:
+                file_path = os.path.join(path, name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                if not os.path.isfile(file_path):
+                    continue
+                if stat.st_size > MIN_FILE_SIZE:
+                    found.append((name, stat.st_size, stat.st_atime, '', False))
+                else:
+                    self._remove(name)
+                    wrong_files.append(name)
+            found.sort(key=lambda x: x[2])
+            for name, size, last_use, orig, keep in found:
+                self._insert(name, size, last_use, orig, keep)
+            self._dirty = bool(on_disk) or len(found) != len(manifest)
+            self._save_time = time.time()
+            return wrong_files
+
+    def find(self, sha1: str, candidates: list, exact: bool = False) -> str or None:
+        """
+        :param sha1: хэш текста.
+        :param candidates: список (провайдер, формат) в порядке приоритета.
+        :param exact: только файлы в запрошенном формате, без перекодированных. Найденный файл
+        больше не перекодируется.
+        :return: полный путь до файла или None.
+        """
+        with self._lock:
+            by_hash = self._by_hash.get(sha1)
+            if not by_hash:
+                return None
+            for key in candidates:
+                name = by_hash.get(key)
+                if name and (not exact or split_name(name)[2] == key[1]):
+                    self._files[name][1] = time.time()
+                    if exact:
+                        self._files[name][3] = True
+                    self._files.move_to_end(name)
+                    self._dirty = True
+                    return os.path.join(self._path, name)
+            return None
+
+    def add(self, file_path: str, orig: str = '', keep: bool = False) -> list:
+        """
+        Добавляет только что записанный файл и сразу вытесняет давно не используемые.
+        :param orig: исходный формат, если файл уже перекодирован.
+        :param keep: файл нужен именно в этом формате (части для склейки), не перекодировать.
+        :return: список удаленных файлов.
+        """
+        name = os.path.basename(file_path)
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = 0
+        with self._lock:
+            if self._path is None or os.path.dirname(os.path.abspath(file_path)) != self._path:
+                return []
+            self._pop(name)
+            if size <= MIN_FILE_SIZE:
+                self._remove(name)
+                return [name]
+            self._insert(name, size, time.time(), orig, keep)
+            self._dirty = True
+            deleted = self._evict()
+            if deleted or time.time() - self._save_time > self.SAVE_INTERVAL:
+                self._save()
+            return deleted
+
+    def replace(self, name: str, file_path: str) -> bool:
+        """
+        Заменяет запись перекодированным файлом, исходный формат остается ключом поиска.
+        Старый файл не удаляет. False - записи уже нет или ее нельзя перекодировать, новый файл не нужен.
+        """
+        new_name = os.path.basename(file_path)
+        with self._lock:
+            data = self._files.get(name)
+            if data is None or data[3] or new_name in self._files:
+                return False
+            orig = data[2] or split_name(name)[2]
+            self._pop(name)
+            self._insert(new_name, os.path.getsize(file_path), data[1], orig)
+            self._dirty = True
+            return True
+
+    def pending(self, ext: str) -> list:
+        """Файлы еще не в формате ext и которые можно перекодировать, сначала недавно использованные."""
+        with self._lock:
+            return [
+                name for name, data in reversed(self._files.items())
+                if not data[3] and split_name(name)[1] and split_name(name)[2] != ext
+            ]
+
+    def discard(self, file_path: str):
+        name = os.path.basename(file_path)
+        with self._lock:
+            self._pop(name)
+            self._remove(name)
+            self._dirty = True
+
+    def evict(self) -> list:
+        with self._lock:
+            deleted = self._evict()
+            if deleted:
+                self._save()
+            return deleted
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _insert(self, name: str, size: int, last_use: float, orig: str = '', keep: bool = False):
+        provider, sha1, ext = split_name(name)
+        orig = '' if orig == ext else orig
+        self._files[name] = [size, last_use, orig, keep]
+        self.size += size
+        if sha1:
+            # Свежий файл главнее перекодированного, тот доживет до вытеснения
+            self._by_hash.setdefault(sha1, {})[(provider, orig or ext)] = name
+
+    def _pop(self, name: str):
+        data = self._files.pop(name, None)
+        if data is None:
+            return
+        self.size -= data[0]
+        provider, sha1, ext = split_name(name)
+        by_hash = self._by_hash.get(sha1)
+        key = (provider, data[2] or ext)
+        if by_hash is not None and by_hash.get(key) == name:
+            del by_hash[key]
+            if not by_hash:
+                del self._by_hash[sha1]
+
+    def _evict(self) -> list:
+        deleted = []
+        if self.max_size < 0 or self.size <= self.max_size:
+            return deleted
+        # Не вытесняем по файлу на каждое добавление
+        low_water = int(self.max_size * self.LOW_WATER)
+        while self.size > low_water and self._files:
+            name = next(iter(self._files))
+            self._pop(name)
+            self._remove(name)
+            deleted.append(name)
+        return deleted
+
+    def _remove(self, name: str):
+        try:
+            os.remove(os.path.join(self._path, name))
+        except OSError:
+            pass
+
+    def _load_manifest(self) -> list:
+        try:
+            with open(os.path.join(self._path, MANIFEST), encoding='utf8') as fp:
+                data = json.load(fp)
+            if data.get('path') != self._path:
+                return []
+            return [
+                (
+                    str(item[0]), int(item[1]), float(item[2]), str(item[3]) if len(item) > 3 else '',
+                    bool(item[4]) if len(item) > 4 else False
+                )
+                for item in data['files']
+            ]
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            return []
+
+    def _save(self):
+        if not (self._dirty and self._path and os.path.isdir(self._path)):
+            return
+        file_path = os.path.join(self._path, MANIFEST)
+        data = {'path': self._path, 'files': [[name, *val] for name, val in self._files.items()]}
+        try:
+            with open(file_path + '.tmp', 'w', encoding='utf8') as fp:
+                json.dump(data, fp, ensure_ascii=False)
+            os.replace(file_path + '.tmp', file_path)
+        except OSError:
+            return
+        self._dirty = False
+        self._save_time = time.time()
+
+
+class OpusTranscoder(threading.Thread):
+    """
+    Фоном пережимает файлы кэша в opus с низким битрейтом, в тот же бюджет влезает больше фраз.
+    Индекс помнит исходный формат, поиск по нему продолжает находить файл.
+    """
+    EXT = 'opus'
+    BITRATE = 24
+    # Старый файл могли только что найти и отдать плееру, удаляем позже
+    GRACE = 60
+    TIMEOUT = 120
+    TMP = '.transcode.opus'
+
+    def __init__(self, cache: TTSCache, log):
+        super().__init__(name='OpusTranscoder')
+        self.cache = cache
+        self.log = log
+        self._event = threading.Event()
+        # Не получилось или не стало меньше, второй раз не пробуем
+        self._skip = set()
+        self._trash = []
+        self._work = False
+
+    @staticmethod
+    def available() -> bool:
+        return bool(shutil.which('ffmpeg') or shutil.which('opusenc'))
+
+    def start(self):
+        self._work = True
+        super().start()
+
+    def join(self, timeout=None):
+        self._work = False
+        self._event.set()
+        super().join(timeout)
+
+    def run(self):
+        while self._work:
+            pending = self.cache.pending(self.EXT)
+            # Вытесненные и уже не нужные забываем
+            self._skip.intersection_update(pending)
+            for name in pending:
+                if not self._work:
+                    break
+                if name not in self._skip:
+                    self._transcode(name)
+                self._clean()
+            self._event.wait(self.GRACE)
+            self._clean()
+        self._clean(True)
+
+    def _transcode(self, name: str):
+        path = self.cache.path
+        if not path:
+            return
+        src, tmp = os.path.join(path, name), os.path.join(path, self.TMP)
+        dst = os.path.join(path, os.path.splitext(name)[0] + '.' + self.EXT)
+        self._skip.add(name)
+        try:
+            if os.path.exists(dst) or not self._run(self._commands(src, tmp)):
+                return
+            old_size, new_size = os.path.getsize(src), os.path.getsize(tmp)
+            if new_size <= MIN_FILE_SIZE or new_size >= old_size:
+                return
+            os.replace(tmp, dst)
+        except OSError as e:
+            self.log('Transcoding error {}: {}'.format(name, e))
+            return
+        finally:
+            _remove(tmp)
+        if self.cache.replace(name, dst):
+            self._trash.append((time.time() + self.GRACE, src))
+            self.log('Transcoded {} -> {}: {} -> {} bytes'.format(name, os.path.basename(dst), old_size, new_size))
+        else:
+            _remove(dst)
+
+    def _commands(self, src: str, dst: str) -> list:
+        bitrate = str(self.BITRATE)
+        if shutil.which('ffmpeg'):
+            return [[
+                'ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', src,
+                '-ac', '1', '-c:a', 'libopus', '-b:a', bitrate + 'k', '-f', 'ogg', dst
+            ]]
+        opusenc = ['opusenc', '--quiet', '--bitrate', bitrate, '--downmix-mono']
+        if src.endswith('.wav'):
+            return [opusenc + [src, dst]]
+        return [['mpg123', '-q', '-w', '-', src], opusenc + ['-', dst]]
+
+    def _run(self, commands: list) -> bool:
+        # Цепочка через пайпы: декодер | кодер
+        processes, stdin = [], None
+        try:
+            for idx, cmd in enumerate(commands):
+                last = idx == len(commands) - 1
+                popen = subprocess.Popen(
+                    cmd, stdin=stdin, stdout=None if last else subprocess.PIPE, stderr=subprocess.DEVNULL
+                )
+                if stdin is not None:
+                    stdin.close()
+                stdin = popen.stdout
+                processes.append(popen)
+            return not [popen for popen in processes if popen.wait(self.TIMEOUT)]
+        except (OSError, subprocess.SubprocessError):
+            for popen in processes:
+                if popen.poll() is None:
+                    popen.kill()
+                popen.wait()
+            return False
+
+    def _clean(self, force=False):
+        now = time.time()
+        for item in [item for item in self._trash if force or item[0] <= now]:
+            self._trash.remove(item)
+            _remove(item[1])
+
+
+def _remove(file_path: str):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
@@ -0,0 +1,95 @@
+import bisect
+import threading
+
+# Приоритеты задач синтеза, меньше - важнее
+SAY = 0
+LOW_SAY = 1
+PRE_SYNTHESIS = 2
+
+
+class TTSPoolOverloaded(RuntimeError):
+    pass
+
+
+class TTSPool:
+    """
+    Ограниченный пул потоков для синтеза речи.
+    Задачи берутся по приоритету, потом в порядке поступления, но с учетом лимита на провайдера.
+    Задача - объект с атрибутом provider и методом run.
+    """
+    IDLE_TIMEOUT = 60
+
+    def __init__(self, workers: int = 4, provider_limit: int = 2, queue_limit: int = 100):
+        self.workers = workers
+        self.provider_limit = provider_limit
+        self.queue_limit = queue_limit
+        self._cv = threading.Condition()
+        self._queue = []
+        self._seq = 0
+        self._threads = set()
+        self._idle = 0
+        self._active = {}
+        self._work = True
+
+    @property
+    def size(self) -> int:
+        return len(self._queue)
+
+    @property
+    def overloaded(self) -> bool:
+        return 0 < self.queue_limit <= len(self._queue)
+
+    def submit(self, job, priority: int):
+        with self._cv:
+            if not self._work:
+                raise TTSPoolOverloaded('TTS pool stopped')
+            if priority > SAY and self.overloaded:
+                # Озвучка важнее очереди, остальное отбрасываем
+                raise TTSPoolOverloaded('TTS queue is full: {}'.format(len(self._queue)))
+            self._seq += 1
+            # seq уникален, до сравнения задач не дойдет
+            bisect.insort(self._queue, (priority, self._seq, job))
+            if not self._idle and len(self._threads) < max(1, self.workers):
+                thread = threading.Thread(target=self._worker, name='TTSWorker')
+                self._threads.add(thread)
+                thread.start()
+            self._cv.notify_all()
+
+    def join(self, timeout=10):
+        with self._cv:
+            self._work = False
+            self._cv.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(timeout)
+
+    def _take(self):
+        # Первая задача, для провайдера которой есть свободный слот
+        limit = self.provider_limit
+        for idx, (_, _, job) in enumerate(self._queue):
+            if limit < 1 or self._active.get(job.provider, 0) < limit:
+                del self._queue[idx]
+                self._active[job.provider] = self._active.get(job.provider, 0) + 1
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                job = self._take()
+                while job is None and self._work:
+                    self._idle += 1
+                    notified = self._cv.wait(self.IDLE_TIMEOUT)
+                    self._idle -= 1
+                    job = self._take()
+                    if job is None and not notified:
+                        break
+                if job is None:
+                    self._threads.discard(threading.current_thread())
+                    return
+            try:
+                job.run()
+            finally:
+                with self._cv:
+                    self._active[job.provider] -= 1
+                    self._cv.notify_all()
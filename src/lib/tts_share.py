@@ -0,0 +1,247 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import logger
+from utils import REQUEST_ERRORS
+from .tts_cache import MIN_FILE_SIZE, TTSCache, split_name
+
+# Общий tts кэш для нескольких терминалов: один хранит, остальные спрашивают по тому же имени provider_sha1.ext
+NAME = re.compile(r'^[\w.-]+_[0-9a-f]{40}\.(mp3|opus|wav)$')
+CHUNK = 8192
+MAX_UPLOAD = 10 * 1024 * 1024
+FORMAT_HEADER = 'X-TTS-Format'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        self.server.share.get(self)
+
+    def do_PUT(self):
+        self.server.share.put(self)
+
+
+class ShareServer(threading.Thread):
+    """
+    HTTP сервис над локальным tts кэшем.
+    GET /tts/<имя> - файл потоком, PUT /tts/<имя> - положить в кэш, GET /stats - попадания и промахи.
+    """
+
+    def __init__(self, cache: TTSCache, port: int, allow, log):
+        super().__init__(name='ShareServer')
+        self.cache = cache
+        self.port = port
+        self._allow = allow
+        self.log = log
+        self._httpd = None
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'uploads': 0, 'rejected': 0}
+        self.work = False
+
+    def start(self):
+        if self.port < 1:
+            return
+        try:
+            self._httpd = ThreadingHTTPServer(('', self.port), _Handler)
+        except OSError as e:
+            return self.log('Start error on :{}: {}'.format(self.port, e), logger.CRIT)
+        self._httpd.daemon_threads = True
+        self._httpd.share = self
+        self.work = True
+        super().start()
+
+    def join(self, timeout=None):
+        if self._httpd:
+            self._httpd.shutdown()
+            super().join(timeout)
+
+    def run(self):
+        self.log('TTS cache share on :{}'.format(self.port), logger.INFO)
+        self._httpd.serve_forever(poll_interval=0.5)
+        self._httpd.server_close()
+        self.log('Stats: {}'.format(self.stats), logger.INFO)
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _parse(self, handler) -> str or None:
+        if not self._allow(handler.client_address[0]):
+            handler.send_error(403)
+            return None
+        path = handler.path.split('?', 1)[0]
+        if path == '/stats':
+            return path
+        name = path[5:] if path.startswith('/tts/') else ''
+        if not (NAME.match(name) and self.cache.path):
+            handler.send_error(404)
+            return None
+        return name
+
+    def get(self, handler):
+        name = self._parse(handler)
+        if name == '/stats':
+            with self._lock:
+                stats = dict(self.stats, files=len(self.cache), size=self.cache.size)
+            return self._send(handler, 200, json.dumps(stats).encode(), 'application/json')
+        if not name:
+            return
+        provider, sha1, ext = split_name(name)
+        file_path = self.cache.find(sha1, [(provider, ext)], 'exact=1' in handler.path)
+        try:
+            fp = open(file_path, 'rb') if file_path else None
+        except OSError:
+            fp = None
+        if fp is None:
+            self._count('misses')
+            return handler.send_error(404)
+        self._count('hits')
+        with fp:
+            handler.send_response(200)
+            handler.send_header('Content-Type', 'application/octet-stream')
+            handler.send_header('Content-Length', str(os.fstat(fp.fileno()).st_size))
+            # Файл мог быть перекодирован, отдаем как есть
+            handler.send_header(FORMAT_HEADER, os.path.splitext(file_path)[1][1:])
+            handler.end_headers()
+            try:
+                shutil.copyfileobj(fp, handler.wfile, CHUNK)
+            except OSError:
+                handler.close_connection = True
+
+    def put(self, handler):
+        name = self._parse(handler)
+        if not name or name == '/stats':
+            return handler.send_error(404) if name else None
+        size = int(handler.headers.get('Content-Length') or 0)
+        provider, sha1, ext = split_name(name)
+        if not MIN_FILE_SIZE < size <= MAX_UPLOAD:
+            self._count('rejected')
+            handler.close_connection = True
+            return self._send(handler, 413, b'')
+        if self.cache.find(sha1, [(provider, ext)], True):
+            # Уже есть, тело дочитываем чтобы клиент не получил обрыв
+            self._count('rejected')
+            while size > 0:
+                data = handler.rfile.read(min(CHUNK, size))
+                if not data:
+                    break
+                size -= len(data)
+            return self._send(handler, 409, b'')
+        tmp = os.path.join(self.cache.path, '.share_{}'.format(uuid.uuid4().hex))
+        try:
+            with open(tmp, 'wb') as fp:
+                while size > 0:
+                    data = handler.rfile.read(min(CHUNK, size))
+                    if not data:
+                        raise OSError('Connection closed')
+                    fp.write(data)
+                    size -= len(data)
+            file_path = os.path.join(self.cache.path, name)
+            os.replace(tmp, file_path)
+        except OSError as e:
+            self.log('Upload {} error: {}'.format(name, e), logger.WARN)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            handler.close_connection = True
+            return
+        self.cache.add(file_path)
+        self._count('uploads')
+        self._send(handler, 201, b'')
+
+    @staticmethod
+    def _send(handler, code: int, body: bytes, content_type='text/plain'):
+        handler.send_response(code)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+class _Fetch:
+    def __init__(self, rq, ext: str):
+        self._rq = rq
+        self.ext = ext
+
+    def stream_to_fps(self, fps: list):
+        try:
+            for chunk in self._rq.iter_content(chunk_size=CHUNK):
+                for fp in fps:
+                    fp.write(chunk)
+        except REQUEST_ERRORS as e:
+            raise RuntimeError(e)
+        finally:
+            self._rq.close()
+
+
+class ShareClient:
+    """Клиент общего кэша. После ошибки связи RETRY секунд не спрашиваем, чтобы не тормозить синтез."""
+    TIMEOUT = (1, 5)
+    RETRY = 30
+
+    def __init__(self):
+        self.url = ''
+        self._lock = threading.Lock()
+        self._error_time = 0
+        self.stats = {'hits': 0, 'misses': 0, 'errors': 0, 'uploads': 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _ready(self) -> bool:
+        return bool(self.url) and time.time() - self._error_time > self.RETRY
+
+    def _error(self, e):
+        self._count('errors')
+        self._error_time = time.time()
+        return e
+
+    def _file_url(self, name: str) -> str:
+        return '{}/tts/{}'.format(self.url.rstrip('/'), name)
+
+    def fetch(self, provider: str, sha1: str, ext: str, exact: bool = False) -> _Fetch or None:
+        """Ответ с потоком файла или None. ext ответа может отличаться, если не exact."""
+        if not self._ready():
+            return None
+        url = self._file_url('{}_{}.{}'.format(provider, sha1, ext))
+        try:
+            rq = requests.get(url, params={'exact': 1} if exact else None, stream=True, timeout=self.TIMEOUT)
+        except REQUEST_ERRORS as e:
+            raise RuntimeError(self._error(e))
+        if rq.status_code == 404:
+            rq.close()
+            self._count('misses')
+            return None
+        if not rq.ok:
+            rq.close()
+            raise RuntimeError(self._error('{}: {}'.format(rq.status_code, rq.reason)))
+        self._count('hits')
+        return _Fetch(rq, rq.headers.get(FORMAT_HEADER, ext))
+
+    def upload(self, file_path: str, log):
+        """Отдает свежий файл в общий кэш фоном."""
+        if self._ready():
+            threading.Thread(target=self._upload, args=(file_path, log), name='ShareUpload').start()
+
+    def _upload(self, file_path: str, log):
+        try:
+            with open(file_path, 'rb') as fp:
+                rq = requests.put(self._file_url(os.path.basename(file_path)), data=fp, timeout=self.TIMEOUT)
+        except (OSError, *REQUEST_ERRORS) as e:
+            return log('Share upload error: {}'.format(self._error(e)), logger.WARN)
+        if rq.status_code == 201:
+            self._count('uploads')
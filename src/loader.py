@@ -15,6 +15,7 @@ from lib import volume as volume_
 from lib.available_version import available_version_msg
 from lib.proxy import proxies
 from lib.publisher import PubSub
+from lib.tts_share import ShareServer
 from listener import Listener
 from modules_manager import ModuleManager
 from music_controls import music_constructor
@@ -65,6 +66,8 @@ class Loader(Owner):
 
         self._cfg = ConfigHandler(cfg=init_cfg, state=init_state, path=path, log=self._logger.add('CFG'), owner=self)
         self._logger.init(cfg=self._cfg, owner=self)
+        self._pub.log = self._logger.add('PubSub')
+        self._pubsub_configure()
         self._log = self._logger.add('SYSTEM')
 
         self._listen = Listener(cfg=self._cfg, log=self._logger.add('REC'), owner=self)
@@ -82,6 +85,7 @@ class Loader(Owner):
         self._duplex_pool = DuplexPool(cfg=self._cfg, log=self._logger.add('DP'), owner=self)
 
         self._discovery = DiscoveryServer(cfg=self._cfg, log=self._logger.add('Discovery'))
+        self._share = self._share_constructor()
 
     def start_all_systems(self):
         self._music.start()
@@ -95,12 +99,14 @@ class Loader(Owner):
         self._terminal.start()
         self._server.start()
         self._discovery.start()
+        self._share.start()
         self._backup.start()
         self._plugins.start()
 
         self.messenger(lambda: self.log(available_version_msg(self._cfg.version_info), logger.INFO), None)
         self.sub_call('default', 'version', self._cfg.version_str)
         self.volume_callback(self.get_volume())
+        self._tts.warmup(self._stt.sys_say.all())
 
     def stop_all_systems(self):
         self._cfg.config_save(final=True)
@@ -108,6 +114,7 @@ class Loader(Owner):
         self._mm.stop()
         self.join_thread(self._discovery)
         self.join_thread(self._server)
+        self.join_thread(self._share)
         self.join_thread(self._terminal)
         self.join_thread(self._backup)
         self.join_thread(self._updater)
@@ -120,7 +127,12 @@ class Loader(Owner):
 
         self._stt.stop()
         self._play.stop()
+        self._tts.stop()
         self.join_thread(self._music)
+        self._cfg.tts_transcoder_stop()
+        self._cfg.tts_cache.save()
+        if self._cfg.tts_share.url:
+            self.log('TTS share client: {}'.format(self._cfg.tts_share.stats), logger.INFO)
 
         if self._restore_filename:
             self._backup.restore(self._restore_filename)
@@ -136,6 +148,18 @@ class Loader(Owner):
     def log(self, msg: str, lvl=logger.DEBUG):
         self._log(msg, lvl)
 
+    def _pubsub_configure(self):
+        self._pub.configure(
+            self._cfg.gts('pubsub_workers', 4), self._cfg.gts('pubsub_queue', 100), self._cfg.gts('pubsub_policy'),
+            self._cfg.gts('pubsub_slow', 0)
+        )
+
+    def _share_constructor(self) -> ShareServer:
+        return ShareServer(
+            self._cfg.tts_cache, self._cfg.gt('cache', 'share_port', 0), self._cfg.allow_connect,
+            self._logger.add('Share')
+        )
+
     def join_thread(self, obj):
         def obj_log(msg_: str, lvl=logger.DEBUG):
             if log_present:
@@ -167,8 +191,8 @@ class Loader(Owner):
                     name_, pretty_time(stop_time), diagnostic_msg())
                 self.log(msg, logger.ERROR)
 
-    def subscribe(self, event, callback, channel='default') -> bool:
-        return self._pub.subscribe(event, callback, channel)
+    def subscribe(self, event, callback, channel='default', policy=None) -> bool:
+        return self._pub.subscribe(event, callback, channel, policy)
 
     def unsubscribe(self, event, callback, channel='default') -> bool:
         return self._pub.unsubscribe(event, callback, channel)
@@ -182,6 +206,9 @@ class Loader(Owner):
     def events_list(self, channel='default') -> list:
         return self._pub.events_list(channel)
 
+    def pubsub_stats(self, reset=False) -> dict:
+        return self._pub.stats(reset)
+
     def send_notify(self, event: str, *args, **kwargs):
         return self._pub.sub_call('default', event, *args, **kwargs)
 
@@ -379,13 +406,18 @@ class Loader(Owner):
     def music_track_name(self) -> str or None:
         return self._music.get_track_name()
 
-    def tts(self, msg, realtime: bool = True):
-        return self._tts.tts(msg, realtime)
+    def tts(self, msg, realtime: bool = True, priority: int = None):
+        return self._tts.tts(msg, realtime, priority)
+
+    @property
+    def tts_overloaded(self) -> bool:
+        return self._tts.overloaded
 
     def ask_again_callback(self):
         self._pub.call('ask_again')
 
     def voice_activated_callback(self):
+        self._tts.preconnect()
         self._pub.call('voice_activated')
 
     def speech_recognized_callback(self, status: bool):
@@ -435,6 +467,9 @@ class Loader(Owner):
     def modules_tester(self, phrase: str, call_me=None, rms=None, model=None):
         return self._mm.tester(phrase, call_me, rms, model)
 
+    def modules_speculative(self, phrase: str) -> bool:
+        return self._mm.speculative(phrase)
+
     def die_in(self, wait, reload=False):
         self.reload = reload
         self._sig.die_in(wait)
@@ -518,6 +553,10 @@ class Loader(Owner):
             if is_sub_dict('cache', diff):
                 # re-check tts cache
                 self._cfg.tts_cache_check()
+                if self._share.port != self._cfg.gt('cache', 'share_port', 0):
+                    self.join_thread(self._share)
+                    self._share = self._share_constructor()
+                    self._share.start()
             if is_sub_dict('proxy', diff):
                 # re-init proxy
                 self._cfg.proxies_init()
@@ -548,6 +587,8 @@ class Loader(Owner):
                 reload_terminal = True
                 detector_reconfigure = 'detector' in diff['listener']
                 vad_reconfigure = bool([key for key in ('vad_mode', 'vad_chrome') if key in diff['listener']])
+            if is_sub_dict('settings', diff) and [key for key in diff['settings'] if key.startswith('pubsub_')]:
+                self._pubsub_configure()
             if is_sub_dict('settings', diff) or reload_terminal:
                 # reload terminal
                 # noinspection PyTypeChecker
@@ -559,6 +600,11 @@ class Loader(Owner):
             if lang_check is not None:
                 diff['settings']['lang_check'] = lang_check
 
+            if lang or is_sub_dict('cache', diff) or is_sub_dict(self._cfg.gts('providertts'), diff) or \
+                    (is_sub_dict('settings', diff) and 'providertts' in diff['settings']):
+                # new voice - new cache
+                self._tts.warmup(self._stt.sys_say.all())
+
             # check and reload plugins
             self._plugins.reload(diff)
             self._cfg.print_cfg_change()
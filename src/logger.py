@@ -1,16 +1,16 @@
 #!/usr/bin/env python3
 
+import gzip
 import logging
 import os
 import queue
+import shutil
 import threading
 import time
-import zlib
-from logging.handlers import RotatingFileHandler
 from functools import lru_cache
-import json
 
 from languages import F
+from lib import json_codec
 from owner import Owner
 from utils import write_permission_check
 from uuid import uuid4
@@ -58,7 +58,7 @@ REMOTE_LOG_DEFAULT = 'colored'
 
 
 def _to_print_json(l_time: float, names: tuple, msg: str, lvl: int) -> str:
-    return json.dumps({'lvl': LVL_NAME[lvl], 'time': l_time, 'callers': names, 'msg': msg}, ensure_ascii=False)
+    return json_codec.dumps({'lvl': LVL_NAME[lvl], 'time': l_time, 'callers': names, 'msg': msg})
 
 
 def colored(msg, color):
@@ -69,17 +69,14 @@ def get_loglvl(str_lvl) -> int:
     return LOG_LEVEL.get(str_lvl, 100500)
 
 
-def _namer(name):
-    return name + '.gz'
-
-
-def _rotator(source, dest):
-    with open(source, 'rb') as sf:
-        data = sf.read()
-        compressed = zlib.compress(data, 9)
-        with open(dest, 'wb') as df:
-            df.write(compressed)
-    os.remove(source)
+def _compress(source, dest, log):
+    try:
+        with open(source, 'rb') as sf, gzip.open(dest + '.tmp', 'wb', 9) as df:
+            shutil.copyfileobj(sf, df)
+        os.replace(dest + '.tmp', dest)
+        os.remove(source)
+    except OSError as e:
+        log('Log compress error: {}'.format(e), ERROR)
 
 
 @lru_cache(maxsize=512)
@@ -91,21 +88,140 @@ def _name_builder(names: tuple, colored_=False):
 
 
 class _LogWrapper:
-    def __init__(self, name: str or tuple, call_event):
+    """
+    Вызов: log(msg) или log(msg, lvl), уровень всегда вторым позиционным - так пишут и плагины.
+    msg может быть вызываемым объектом или шаблоном, аргументы шаблона только именованным args:
+    log('Command {!r}', logger.DEBUG, args=(cmd,)). Сообщение собирается только если его кто-то увидит.
+    """
+    def __init__(self, name: str or tuple, logger_):
         self.name = (name,) if isinstance(name, str) else name
-        self._call_event = call_event
+        self._logger = logger_
+
+    def _print(self, names: tuple, msg, lvl: int, args: tuple):
+        if lvl not in LVL_NAME:
+            # log('x {}', value) - value не уровень
+            raise TypeError('Wrong log level {!r}, template arguments must be passed as args='.format(lvl))
+        if not self._logger.enabled(lvl):
+            return
+        if callable(msg):
+            msg = msg()
+        elif args:
+            msg = msg.format(*args)
+        self._logger.put(time.time(), names, msg, lvl)
+
+    def __call__(self, msg, lvl: int = DEBUG, *, args: tuple = ()):
+        self._print(self.name, msg, lvl, args)
+
+    def module(self, module_name: str, msg, lvl: int = DEBUG, *, args: tuple = ()):
+        self._print(self.name + (module_name,), msg, lvl, args)
 
-    def _print(self, *args):
-        self._call_event(time.time(), *args)
+    def add(self, name: str):
+        return _LogWrapper(self.name + (name,), self._logger)
+
+
+class _FileWriter(threading.Thread):
+    """
+    Пишет лог в файл пачками в своем треде: когда накопится FLUSH_SIZE или пройдет FLUSH_TIME.
+    Ротация - переименование, старый файл сжимается в gzip фоном.
+    Ошибки идут в log как обычные сообщения, ошибка записи - один раз до следующей удачной.
+    """
+    MAX_BYTES = 1024 * 1024
+    BACKUP_COUNT = 2
+    FLUSH_SIZE = 64 * 1024
+    FLUSH_TIME = 2
+
+    def __init__(self, file: str, json_: bool, log):
+        super().__init__(name='LogWriter')
+        self.file = file
+        self._json = json_
+        self._log = log
+        self._failed = False
+        self._cv = threading.Condition()
+        self._buffer = []
+        self._size = 0
+        self._fp = None
+        self._fp_size = 0
+        self._compressor = None
+        self._work = True
+        self.start()
 
-    def __call__(self, msg: str, lvl=DEBUG):
-        self._print(self.name, msg, lvl)
+    def write(self, l_time: float, names: tuple, msg: str, lvl: int):
+        with self._cv:
+            self._buffer.append((l_time, names, msg, lvl))
+            self._size += len(msg)
+            if self._size >= self.FLUSH_SIZE:
+                self._cv.notify()
 
-    def module(self, module_name: str, msg: str, lvl=DEBUG):
-        self._print(self.name + (module_name,), msg, lvl)
+    def join(self, timeout=None):
+        with self._cv:
+            self._work = False
+            self._cv.notify()
+        super().join(timeout)
 
-    def add(self, name: str):
-        return _LogWrapper(self.name + (name,), self._call_event)
+    def run(self):
+        work = True
+        while work:
+            with self._cv:
+                if self._work and self._size < self.FLUSH_SIZE:
+                    self._cv.wait(self.FLUSH_TIME)
+                records, self._buffer, self._size = self._buffer, [], 0
+                work = self._work
+            if records:
+                self._flush(''.join(self._format(*record) for record in records).encode())
+        self._close()
+        if self._compressor:
+            self._compressor.join()
+
+    def _format(self, l_time: float, names: tuple, msg: str, lvl: int) -> str:
+        if self._json:
+            return _to_print_json(l_time, names, msg, lvl) + '\n'
+        # Как у logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+        return '{},{:03d} {} {}: {}\n'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(l_time)), int(l_time * 1000 % 1000),
+            logging.getLevelName(lvl), _name_builder(names), msg
+        )
+
+    def _flush(self, data: bytes):
+        try:
+            if self._fp is None:
+                self._fp = open(self.file, 'ab')
+                self._fp_size = self._fp.tell()
+            if self._fp_size and self._fp_size + len(data) >= self.MAX_BYTES:
+                self._rotate()
+            self._fp.write(data)
+            self._fp.flush()
+            self._fp_size += len(data)
+            self._failed = False
+        except OSError as e:
+            self._close()
+            if not self._failed:
+                # Сообщение вернется сюда же, не зацикливаемся на каждом сбросе
+                self._failed = True
+                self._log('Log write error: {}'.format(e), ERROR)
+
+    def _rotate(self):
+        self._close()
+        if self._compressor:
+            self._compressor.join()
+        for idx in range(self.BACKUP_COUNT - 1, 0, -1):
+            source = '{}.{}.gz'.format(self.file, idx)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}.gz'.format(self.file, idx + 1))
+        os.replace(self.file, self.file + '.1')
+        self._compressor = threading.Thread(
+            target=_compress, args=(self.file + '.1', self.file + '.1.gz', self._log), name='LogCompressor'
+        )
+        self._compressor.start()
+        self._fp = open(self.file, 'ab')
+        self._fp_size = 0
+
+    def _close(self):
+        if self._fp:
+            try:
+                self._fp.close()
+            except OSError:
+                pass
+            self._fp = None
 
 
 class Logger(threading.Thread):
@@ -114,21 +230,30 @@ class Logger(threading.Thread):
     def __init__(self, tmp_own: Owner):
         super().__init__(name='Logger')
         self._queue = queue.Queue()
+        # Сообщения идут в очередь логгера напрямую, в шину только если на log кто-то подписан
         self._call_event = tmp_own.registration(self.EVENT)
-        tmp_own.subscribe(self.EVENT, self._event)
+        self._has_subscribers = tmp_own.has_subscribers
         self.cfg, self.own = None, None
         self.file_lvl = None
         self.print_lvl = None
+        # Ниже этого уровня сообщения никуда не попадут. Пока настроек нет - берем все
+        self.min_lvl = DEBUG
         self.in_print = None
-        self._handler = None
-        self._app_log = None
+        self._writer = None
         self._await = None
         self.remote_log = None
         self.log = self.add('Logger')
         self.log('start', INFO)
 
-    def _event(self, _, *args, **__):
-        self._queue.put_nowait(args)
+    def enabled(self, lvl: int) -> bool:
+        # Удаленный лог и подписчики шины получают все сообщения
+        return lvl >= self.min_lvl or (self.remote_log is not None and self.remote_log.connected) or \
+            self._has_subscribers(self.EVENT)
+
+    def put(self, *data):
+        self._queue.put_nowait(data)
+        if self._has_subscribers(self.EVENT):
+            self._call_event(*data)
 
     def init(self, cfg, owner: Owner):
         self.cfg = cfg['log']
@@ -145,9 +270,9 @@ class Logger(threading.Thread):
     def join(self, timeout=30):
         self.log('stop', INFO)
         self._await = '{}'.format(uuid4())
-        self.log(self._await)
+        # Метка остановки не должна отсеяться по уровню
+        self._queue.put_nowait((time.time(), self.log.name, self._await, DEBUG))
         super().join(timeout=timeout)
-        self.own.unsubscribe(self.EVENT, self._event)
 
     def run(self):
         while True:
@@ -172,12 +297,9 @@ class Logger(threading.Thread):
         return True
 
     def _stop_file_logging(self):
-        if self._app_log:
-            self._app_log.removeHandler(self._handler)
-            self._app_log = None
-        if self._handler:
-            self._handler.close()
-            self._handler = None
+        if self._writer:
+            self._writer.join()
+            self._writer = None
 
     def _init(self):
         self.file_lvl = get_loglvl(self.cfg.get('file_lvl', 'info'))
@@ -186,24 +308,17 @@ class Logger(threading.Thread):
         in_file = self.cfg.get('method', 3) in [1, 3] and self.file_lvl <= CRIT
 
         self._stop_file_logging()
+        levels = [self.print_lvl] if self.in_print else []
 
         if self.cfg.get('file') and in_file and self.permission_check():
-            self._handler = RotatingFileHandler(filename=self.cfg.get('file'), maxBytes=1024 * 1024,
-                                                backupCount=2, encoding='utf8',
-                                                )
-            self._handler.rotator = _rotator
-            self._handler.namer = _namer
-            self._handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
-            self._handler.setLevel(logging.DEBUG)
-
-            self._app_log = logging.getLogger('logger')
-            # Отключаем печать в консольку
-            self._app_log.propagate = False
-            self._app_log.setLevel(logging.DEBUG)
-            self._app_log.addHandler(self._handler)
+            self._writer = _FileWriter(
+                self.cfg.get('file'), self.cfg.get('file_format') == 'json', self.log.add('File')
+            )
+            levels.append(self.file_lvl)
+        self.min_lvl = min(levels, default=CRIT + 1)
 
     def add(self, name) -> _LogWrapper:
-        return _LogWrapper(name, self._call_event)
+        return _LogWrapper(name, self)
 
     def _best_print(self, l_time: float, names: tuple, msg: str, lvl: int):
         if lvl not in COLORS:
@@ -220,11 +335,8 @@ class Logger(threading.Thread):
             else:
                 print_line = print_line or self._to_print(l_time, names, msg, lvl)
             self.remote_log.msg(print_line)
-        if self._app_log and lvl >= self.file_lvl:
-            self._to_file(_name_builder(names), msg, lvl)
-
-    def _to_file(self, name, msg, lvl):
-        self._app_log.log(lvl, '{}: {}'.format(name, msg))
+        if self._writer and lvl >= self.file_lvl:
+            self._writer.write(l_time, names, msg, lvl)
 
     def _str_time(self, l_time: float) -> str:
         time_str = time.strftime('%Y.%m.%d %H:%M:%S', time.localtime(l_time))
@@ -243,6 +355,8 @@ class Logger(threading.Thread):
 class RemoteLogger(threading.Thread):
     REMOTE_LOG = 'remote_log'
     CHANNEL = 'net_block'
+    # Сколько строк из очереди собрать в одну запись в сокет
+    BATCH = 256
 
     def __init__(self, cfg, owner: Owner, log):
         super().__init__(name='RemoteLogger')
@@ -275,10 +389,22 @@ class RemoteLogger(threading.Thread):
 
     def run(self):
         self.init()
+        pending = None
         while True:
-            data = self._queue.get()
+            data, pending = pending or self._queue.get(), None
             if data[0] == 'msg':
-                self._to_remote_log(data[1], data[2])
+                # Строки что уже в очереди уходят одной записью
+                lines = [data[1]]
+                while len(lines) < self.BATCH:
+                    try:
+                        pending = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if pending[0] != 'msg' or pending[2] is not data[2]:
+                        break
+                    lines.append(pending[1])
+                    pending = None
+                self._to_remote_log(lines, data[2])
             elif data[0] is None:
                 break
             elif data[0] == 'reload':
@@ -293,10 +419,10 @@ class RemoteLogger(threading.Thread):
     def msg(self, line: str):
         self._queue.put_nowait(('msg', line, self._conn))
 
-    def _to_remote_log(self, line: str, conn):
+    def _to_remote_log(self, lines: list, conn):
         if conn == self._conn and self._conn.alive:
             try:
-                self._conn.write(line)
+                self._conn.write_many(lines)
             except RuntimeError:
                 self._close_connect()
 
@@ -337,7 +463,8 @@ class RemoteLogger(threading.Thread):
                 self._conn.close()
             except RuntimeError:
                 pass
-            self.log('CLOSE REMOTE LOG FOR {}:{}'.format(self._conn.ip, self._conn.port), WARN)
+            self.log('CLOSE REMOTE LOG FOR {}:{}. Sent: {messages} lines, {bytes} bytes in {syscalls} writes'.format(
+                self._conn.ip, self._conn.port, **self._conn.write_stats), WARN)
             self._conn = None
 
     def _add_connect(self, conn, mode):
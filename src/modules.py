@@ -16,6 +16,7 @@ mod = ModuleWrapper()
 
 @mod.name(ANY, F('Блокировка'), F('Включение/выключение блокировки терминала'))
 @mod.phrase([F('блокировка'), EQ])
+@mod.speculative()
 def lock(self, phrase, *_):
     if self.get_one_way is lock:
         if phrase == F('блокировка'):
@@ -30,6 +31,7 @@ def lock(self, phrase, *_):
 @mod.phrase([F('режим разработчика'), EQ], NM)
 @mod.phrase([F('выход'), EQ], DM)
 @mod.hardcoded()
+@mod.speculative()
 def debug(_, phrase, *__):
     if phrase == F('выход'):
         return Set(debug=False), Say(F('Внимание! Выход из режима разработчика'))
@@ -80,6 +82,7 @@ def this_say(_, __, phrase):
 
 @mod.name(ANY, F('Ничего'), F('Ничего'))
 @mod.phrase([F('Ничего'), EQ])
+@mod.speculative()
 def this_nothing(*_):
     pass
 
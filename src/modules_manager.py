@@ -127,7 +127,7 @@ class ModuleManager:
         self._module_name = None
         # Без расширения
         self._cfg_name = 'modules'
-        self._cfg_options = ['enable', 'mode', 'hardcoded']
+        self._cfg_options = ['enable', 'mode', 'hardcoded', 'speculative']
         # Не проверяем данные модули на конфликты
         self._no_check = ['majordomo', 'terminator']
         self._lock = threading.Lock()
@@ -245,7 +245,7 @@ class ModuleManager:
         return data
 
     def __option_check(self, name, option: str, val) -> bool:
-        if option in ['enable', 'hardcoded']:
+        if option in ['enable', 'hardcoded', 'speculative']:
             if isinstance(val, bool):
                 return True
             else:
@@ -339,6 +339,41 @@ class ModuleManager:
                 return self._return_wrapper(f, reply)
         return self._return_wrapper(None, None)
 
+    def speculative(self, phrase: str) -> bool:
+        # Пробный поиск по промежуточной гипотезе STT, модули не вызываются.
+        # Гипотезу можно выполнить досрочно только если первой ее захватит EQ-фраза модуля с разрешенным speculative
+        phrase_check = phrase.lower()
+        if not phrase_check or not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if self.one_way:
+                return False
+            # Итератор держит _ext_lock пока идет по динамическим модулям, закрываем до захвата
+            words_iter = self._words_iter()
+            try:
+                for f, words, mode_ in words_iter:
+                    if words == '':
+                        return False
+                    elif mode_ == EQ:
+                        match = phrase_check == words
+                    elif mode_ == SW:
+                        match = phrase_check.startswith(words)
+                    else:
+                        match = phrase_check.endswith(words)
+                    if match:
+                        break
+                else:
+                    return False
+            finally:
+                words_iter.close()
+            if mode_ != EQ:
+                return False
+            with self._ext_lock:
+                module = self._ext_all.get(f)
+            return (module or self.all[f]).get('speculative', False)
+        finally:
+            self._lock.release()
+
     def tester(self, phrase: str, call_me=None, rms=None, model=None):
         with self._lock:
             self.rms = rms
@@ -475,6 +510,7 @@ class ModuleWrapper:
             if not [x for x in ALL_MODES if x in val]:
                 raise RuntimeError('Module {} not have words'.format(val.get('name', key)))
             val['hardcoded'] = val.get('hardcoded', False)
+            val['speculative'] = val.get('speculative', False)
             f_name = key.__name__
             if f_name in unique_magic_names:
                 msg = 'Magic function name must be unique, \'{}\' conflicts with \'{}\'. Name - {}'
@@ -542,6 +578,13 @@ class ModuleWrapper:
             return f
         return wrap
 
+    def speculative(self):
+        # EQ-фразы модуля можно выполнять по промежуточным результатам распознавания, не дожидаясь финального
+        def wrap(f):
+            self._add(f, speculative=True)
+            return f
+        return wrap
+
 
 def list_to_tuple(data: list) -> tuple:
     return tuple(key if not isinstance(key, list) else list_to_tuple(key) for key in data)
@@ -9,6 +9,7 @@ import requests
 
 import logger
 from languages import F
+from lib.coalescer import Coalescer
 from lib.outgoing_socket import OutgoingSocket
 from owner import Owner
 from utils import url_builder, REQUEST_ERRORS
@@ -34,6 +35,7 @@ class MajordomoNotifier(threading.Thread):
         self._skip = SkipNotifications()
         self._dynamic_self_events = set(self.SELF_EVENTS)
         self._events = ()
+        self._coalescer = Coalescer(self._cfg['notify_coalesce'] / 1000)
         self.outgoing = OutgoingSocket(cfg, log.add('O'), self.own)
 
     def list_notifications(self) -> list:
@@ -110,6 +112,8 @@ class MajordomoNotifier(threading.Thread):
             self._unsubscribe()
             self._subscribe()
             self._queue.put_nowait(None)
+            # Уже накопленное уйдет в свой срок
+            self._coalescer.window = self._cfg['notify_coalesce'] / 1000
             if 'outgoing_socket' in diff.get('smarthome', {}):
                 self.outgoing.reload()
 
@@ -131,32 +135,45 @@ class MajordomoNotifier(threading.Thread):
     def run(self):
         def allow_notify():
             return self._allow_notify and not self._skip.is_skip
+        last_activity = time.time()
         while self.work:
-            to_sleep = self._cfg['heartbeat_timeout']
-            if to_sleep <= 0:
-                to_sleep = None
+            heartbeat = self._cfg['heartbeat_timeout']
+            to_sleep = [x for x in (
+                max(0, heartbeat - (time.time() - last_activity)) if heartbeat > 0 else None, self._coalescer.timeout()
+            ) if x is not None]
             try:
-                data = self._queue.get(timeout=to_sleep)
+                data = self._queue.get(timeout=min(to_sleep) if to_sleep else None)
             except queue.Empty:
-                if self._allow_messages and allow_notify():
-                    # Отправляем пинг на сервер
-                    data = self.own.get_volume_status
-                    data['uptime'] = uptime()
-                    self._send_notify(data)
+                for _, messages, batch in self._coalescer.flush():
+                    if self._allow_messages and allow_notify():
+                        self._prepare_notify(messages, batch)
+                if 0 < heartbeat <= time.time() - last_activity:
+                    last_activity = time.time()
+                    if self._allow_messages and allow_notify():
+                        # Отправляем пинг на сервер
+                        data = self.own.get_volume_status
+                        data['uptime'] = uptime()
+                        self._send_notify(data)
             else:
+                last_activity = time.time()
                 if data is None or not self._allow_messages:
                     continue
                 if data['name'] == self.CMD:
                     self._send_cmd(data['kwargs'])
                 elif allow_notify():
-                    self._prepare_notify(data)
+                    # Частые события (громкость, статусы) склеиваются
+                    for _, messages, batch in self._coalescer.add(data['name'], data):
+                        self._prepare_notify(messages, batch)
 
     def _callback(self, name, *args, **kwargs):
         self._queue.put_nowait({'name': name, 'args': args, 'kwargs': kwargs, 'uptime': uptime()})
 
-    def _prepare_notify(self, msg: dict):
+    def _prepare_notify(self, messages: list, batch: bool = False):
+        msg = messages[-1]
         name = msg['name']
         data = msg['args'][0] if msg['args'] else None
+        if batch:
+            data = [x['args'][0] if x['args'] else None for x in messages]
         kwargs = {'uptime': msg['uptime']}
 
         if name in self._dynamic_self_events:
@@ -178,7 +195,8 @@ class MajordomoNotifier(threading.Thread):
     def _send_cmd(self, kwargs: dict):
         username = kwargs.pop('username', None)
         try:
-            self.log(F('Запрос был успешен: {}', self._send('cmd', kwargs, username)), logger.DEBUG)
+            reply = self._send('cmd', kwargs, username)
+            self.log(lambda: F('Запрос был успешен: {}', reply), logger.DEBUG)
         except RuntimeError as e:
             self._skip.got_error()
             e = '[{}] {}'.format(self.own.srv_ip, e)
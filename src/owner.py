@@ -12,16 +12,19 @@ class Owner:
         """
         raise NotImplementedError
 
-    def subscribe(self, event, callback, channel='default') -> bool:
+    def subscribe(self, event, callback, channel='default', policy=None) -> bool:
         """
         Оформление подписки на событие или события. Можно подписаться сразу на много событий или
         подписать много коллбэков на одно событие передав их списком, но передать сразу 2 списка нельзя.
-        Важно: Вызываемый код не должен выполняться долго т.к. он заблокирует другие коллбэки.
+        Важно: У каждого коллбэка своя ограниченная очередь, долгий коллбэк копит ее и теряет события.
+        Если пул шины выключен (pubsub_workers = 0), долгий коллбэк заблокирует другие.
 
         :param event: не пустое имя события в str или список событий.
         :param callback: ссылка на объект который можно вызвать или список таких объектов,
         при вызове передаются: имя события, *args, **kwargs.
         :param channel: канал.
+        :param policy: что делать при переполнении очереди коллбэка: block (ждет публикующий),
+        drop_oldest, coalesce. None - из настроек.
         :return: будет ли оформлена подписка.
         """
         raise NotImplementedError
@@ -58,6 +61,14 @@ class Owner:
         """
         raise NotImplementedError
 
+    def pubsub_stats(self, reset=False) -> dict:
+        """
+        Счетчики шины событий: вызовы, потери, задержка до вызова и время выполнения коллбэков в ms.
+        :param reset: обнулить счетчики после снимка.
+        :return: {'queue', 'workers', 'slow_ms', 'events': {канал: {событие: ...}}, 'subscribers': {имя: ...}}
+        """
+        raise NotImplementedError
+
     def send_notify(self, event: str, *args, **kwargs):
         """
         sub_call в канал default
@@ -292,7 +303,11 @@ class Owner:
     def music_track_name(self) -> str or None:
         raise NotImplementedError
 
-    def tts(self, msg, realtime: bool = True):
+    def tts(self, msg, realtime: bool = True, priority: int = None):
+        raise NotImplementedError
+
+    @property
+    def tts_overloaded(self) -> bool:
         raise NotImplementedError
 
     def ask_again_callback(self):
@@ -344,6 +359,14 @@ class Owner:
     def modules_tester(self, phrase: str, call_me=None, rms=None, model=None):
         raise NotImplementedError
 
+    def modules_speculative(self, phrase: str) -> bool:
+        """
+        Пробная проверка промежуточной гипотезы STT, модули не вызываются.
+        :param phrase: гипотеза.
+        :return: можно ли выполнить ее не дожидаясь финального результата.
+        """
+        raise NotImplementedError
+
     def die_in(self, wait, reload=False):
         raise NotImplementedError
 
@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 
 import os
-import queue
 import subprocess
 import threading
 import time
 
 import logger
 from languages import F
-from lib import play_utils
+from lib import play_utils, tts_pool
+from lib.audio_sink import AudioSink, Playback, make_source
+from lib.pcm_cache import PCMCache
 from owner import Owner
 
 
@@ -24,7 +25,13 @@ class Player:
         self._only_one = threading.Lock()
         self._work = False
         self._popen = None
-        self._lp_play = LowPrioritySay(self._wait_popen, self.say, self.play)
+        self._lp_play = LowPrioritySay(self._wait_popen, self.say, self.play, self._low_tts, log)
+        self._pcm = PCMCache()
+        self._sink = None
+
+    def _low_tts(self, msg):
+        # Синтез впрок: сообщение еще может устареть или смениться, это не произнесенная фраза
+        return self.own.tts(msg, realtime=False, priority=tts_pool.LOW_SAY)
 
     def start(self):
         self._work = True
@@ -36,6 +43,14 @@ class Player:
         software_player = self.cfg.gts('software_player')
         if software_player in play_utils.BACKENDS:
             self.log('Use universal player: {}'.format(play_utils.BACKENDS[software_player][0]), logger.INFO)
+        else:
+            if self.cfg.gts('output_sink'):
+                self._sink = AudioSink(self.log)
+                self._sink.start()
+            if self._pcm_size():
+                # Сигналы звучат постоянно, держим их в памяти сразу
+                for name in ('ding', 'dong', 'bimp'):
+                    self.own.messenger(self._pcm.load, None, self.cfg.path[name])
 
     def stop(self):
         self._work = False
@@ -46,6 +61,8 @@ class Player:
         self._wait_popen(10)
         self.quiet()
         self.kill_popen()
+        if self._sink:
+            self._sink.join(5)
 
         self.log('stop.', logger.INFO)
 
@@ -146,8 +163,11 @@ class Player:
         if alarm is None:
             alarm = self.cfg.gts('alarmtts')
 
-        file = self.own.tts(msg) if not is_file else msg
-        if alarm:
+        file = self.own.tts(msg, priority=tts_pool.LOW_SAY if lvl < 2 else tts_pool.SAY) if not is_file else msg
+        if alarm and self._sink_ready():
+            # Сигнал поверх начала речи, без паузы между ними
+            self._play(self.cfg.path['dong'], overlay=True)
+        elif alarm:
             self._play(self.cfg.path['dong'])
             self._wait_popen()
         self._play(file, self.own.say_callback)
@@ -158,7 +178,7 @@ class Player:
         if wait:
             time.sleep(wait)
 
-    def _play(self, obj, callback=None):
+    def _play(self, obj, callback=None, overlay=False):
         if isinstance(obj, str):
             (path, stream, ext) = obj, None, None
         elif callable(obj):
@@ -167,27 +187,79 @@ class Player:
             (path, stream, ext) = obj
         else:
             raise RuntimeError('Get unknown object: {}'.format(str(obj)))
-        if self._popen:
+        sink = self._sink_ready()
+        if self._popen and not (sink and isinstance(self._popen, Playback)):
+            # В микшере старый звук затихнет сам, процесс нужно убить
             self._popen.kill()
         ext = ext or os.path.splitext(path)[1]
-        if not stream and not os.path.isfile(path):
+        if stream is None and not os.path.isfile(path):
             return self.log(F('Файл {} не найден.', path), logger.ERROR)
         if ext not in play_utils.CMD:
             return self.log(F('Неизвестный тип файла: {}', ext), logger.CRIT)
         self.log(F('Играю {} ...', path) if stream is None else F('Стримлю {} ...', path))
         try:
-            self._popen = play_utils.get_popen(ext, path, stream, callback, self.cfg.gts('software_player'))
+            popen = self._sink_play(path, stream, ext, callback, overlay) if sink else None
+            if popen is None:
+                if isinstance(self._popen, Playback):
+                    self._popen.kill()
+                popen = self._pcm_popen(path, stream, callback) or \
+                    play_utils.get_popen(ext, path, stream, callback, self.cfg.gts('software_player'))
+            self._popen = popen
         except FileNotFoundError as e:
             self.log('Playing error: {}'.format(e), logger.ERROR)
 
+    def _sink_ready(self) -> bool:
+        return bool(self._sink and self._sink.ready) and self.cfg.gts('software_player') not in play_utils.BACKENDS
+
+    def _sink_play(self, path, stream, ext, callback, overlay):
+        pcm = self._pcm.get(path) if stream is None and self._pcm_size() else None
+        try:
+            source = make_source(path, stream, ext, pcm)
+        except Exception as e:
+            self.log('Sink source error, fallback: {}'.format(e), logger.WARN)
+            return None
+        if source is None:
+            return None
+        if pcm is None and stream is None and self._pcm.played(path):
+            self.own.messenger(self._pcm.load, None, path)
+        return self._sink.play(source, callback, overlay)
+
+    def _pcm_size(self) -> int:
+        if self.cfg.gts('software_player') in play_utils.BACKENDS:
+            return 0
+        self._pcm.max_size = self.cfg.gt('cache', 'pcm_size', 0) * 1024 * 1024
+        return self._pcm.max_size
+
+    def _pcm_popen(self, path, stream, callback):
+        if stream is not None or not self._pcm_size():
+            return None
+        pcm = self._pcm.get(path)
+        if pcm is not None:
+            self.log('Play from memory: {}'.format(path), logger.DEBUG)
+            return play_utils.get_pcm_popen(pcm, callback)
+        if self._pcm.played(path):
+            self.own.messenger(self._pcm.load, None, path)
+        return None
+
 
 class LowPrioritySay(threading.Thread):
-    def __init__(self, wait_popen, say, play):
+    """
+    Очередь фоновых сообщений. Важные (TextBox.priority) идут раньше, устаревшие (ttl) выкидываются,
+    одинаковые не дублируются, новое сообщение с тем же TextBox.key заменяет ждущее.
+    Речь для следующего сообщения синтезируется пока играет текущее.
+    """
+    TTL = 120
+
+    def __init__(self, wait_popen, say, play, tts, log):
         super().__init__(name='LowPrioritySay')
         self._play = play
         self._say = say
+        self._tts = tts
+        self.log = log
         self._wait_popen = wait_popen
-        self._queue_in = queue.Queue()
+        self._cv = threading.Condition()
+        self._queue = []
+        self._seq = 0
         self._work = False
 
     def start(self):
@@ -197,15 +269,13 @@ class LowPrioritySay(threading.Thread):
     def stop(self, timeout=30):
         if self._work:
             self._work = False
-            self._queue_in.put_nowait(None)
+            with self._cv:
+                self._cv.notify_all()
             self.join(timeout=timeout)
 
     def clear(self):
-        while not self._queue_in.empty():
-            try:
-                self._queue_in.get_nowait()
-            except queue.Empty:
-                pass
+        with self._cv:
+            self._queue.clear()
 
     def say(self, msg: str, wait: float or int = 0, is_file: bool = False):
         self._put(1 if not is_file else 3, msg, wait)
@@ -214,15 +284,67 @@ class LowPrioritySay(threading.Thread):
         self._put(2, file, wait)
 
     def _put(self, action, target, wait):
-        self._queue_in.put_nowait([action, target, wait])
+        key = getattr(target, 'key', '')
+        ttl = getattr(target, 'ttl', 0) or self.TTL
+        with self._cv:
+            for item in self._queue:
+                if key and item['key'] == key:
+                    # Новое сообщение вытесняет старое, но не теряет его место среди равных по приоритету.
+                    # Очередь - список, _get каждый раз берет минимум, так что пересортировка не нужна
+                    item.update(
+                        priority=-getattr(target, 'priority', 0), action=action, target=target, wait=wait,
+                        expires=time.time() + ttl, ready=False,
+                    )
+                    return
+                if not key and item['action'] == action and item['target'] == target and not item['ready']:
+                    return
+            self._seq += 1
+            self._queue.append({
+                'priority': -getattr(target, 'priority', 0), 'seq': self._seq, 'action': action, 'target': target,
+                'wait': wait, 'expires': time.time() + ttl, 'key': key, 'ready': False,
+            })
+            self._cv.notify()
+
+    def _get(self, pop=True) -> dict or None:
+        with self._cv:
+            while self._work:
+                now = time.time()
+                expired = [item for item in self._queue if item['expires'] < now]
+                for item in expired:
+                    self._queue.remove(item)
+                    self.log(lambda: 'Drop expired: {}'.format(repr(item['target'])[:100]), logger.DEBUG)
+                if self._queue or not pop:
+                    break
+                self._cv.wait()
+            if not (self._work and self._queue):
+                return None
+            item = min(self._queue, key=lambda x: (x['priority'], x['seq']))
+            if pop:
+                self._queue.remove(item)
+            return item
+
+    def _prefetch(self, item: dict or None):
+        if not item or item['action'] != 1 or item['ready']:
+            return
+        target = item['target']
+        ready = self._tts(target)
+        with self._cv:
+            # Пока синтезировали, сообщение могли заменить
+            if item['target'] is target:
+                item['target'], item['ready'] = ready, True
 
     def run(self):
         while self._work:
-            say = self._queue_in.get()
+            say = self._get()
+            if say is None:
+                break
+            # Пока доигрывает предыдущее
+            self._prefetch(say)
             self._wait_popen()
-            if say is None or not self._work:
+            if not self._work:
                 break
-            if say[0] in [1, 3]:
-                self._say(msg=say[1], lvl=1, wait=say[2], is_file=say[0] == 3)
-            elif say[0] == 2:
-                self._play(file=say[1], lvl=1, wait=say[2])
+            if say['action'] in [1, 3]:
+                self._say(msg=say['target'], lvl=1, wait=say['wait'], is_file=say['action'] == 3)
+            elif say['action'] == 2:
+                self._play(file=say['target'], lvl=1, wait=say['wait'])
+            self._prefetch(self._get(False))
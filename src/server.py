@@ -1,16 +1,18 @@
 #!/usr/bin/env python3
 
 import socket
+import threading
 
 import logger as logger_
 from languages import F
 from lib.api.misc import api_commands, upgrade_duplex, InternalException
 from lib.api.socket_api_handler import SocketAPIHandler, APIHandler
+from lib.socket_wrapper import Connect
 from owner import Owner
 
 
 class _APIHandler(APIHandler):
-    @api_commands('upgrade duplex', true_json=True)
+    @api_commands('upgrade duplex', true_json=True, serial=True)
     def _upgrade_duplex(self, *_):
         try:
             upgrade_duplex(self.own, self.get('conn'), self.id)
@@ -18,12 +20,58 @@ class _APIHandler(APIHandler):
             raise InternalException(msg=str(e))
 
 
+class _Client(SocketAPIHandler):
+    """Одно подключение к серверу, свой тред и свой API (авторизация, id)."""
+    def __init__(self, cfg, log, owner: Owner, conn, ip_info, ws_allow, done, batch_pool):
+        super().__init__(cfg, log, owner, name='MDTClient', api_handler=_APIHandler, batch_pool=batch_pool)
+        self.api.getters_up({'conn': lambda : self._conn})
+        self._conn.insert(conn, ip_info)
+        self._conn.settimeout(MDTServer.TIMEOUT)
+        self._ws_allow = ws_allow
+        self._done = done
+
+    def do_ws_allow(self, ip, port, token):
+        return self._ws_allow(ip, port, token)
+
+    def start(self):
+        # SelfAuthInstance держит сервер
+        self.work = True
+        threading.Thread.start(self)
+
+    def close_signal(self):
+        self._conn.close()
+
+    def join(self, timeout=None):
+        self.close_signal()
+        threading.Thread.join(self, timeout)
+
+    def run(self):
+        try:
+            for line in self._conn.read():
+                self.parse(line)
+        except RuntimeError as e:
+            self.log('Error: {}'.format(e), logger_.ERROR)
+        finally:
+            self._conn.close()
+            self.work = False
+            self._done(self)
+
+
 class MDTServer(SocketAPIHandler):
+    """
+    Принимает подключения, каждое обслуживается в своем треде.
+    Одновременно не больше server_clients, остальные ждут в очереди сокета.
+    Неактивное TIMEOUT секунд подключение закрывается. Пул для batch общий, закрывается в join сервера.
+    """
+    TIMEOUT = 5.0
+
     def __init__(self, cfg, log, owner: Owner):
         super().__init__(cfg, log, owner, name='MDTServer', api_handler=_APIHandler)
-        self.api.getters_up({'conn': lambda : self._conn})
         self._local = ('', 7999)
         self._socket = socket.socket()
+        self._max_clients = max(1, cfg.gt('smarthome', 'server_clients', 10))
+        self._clients = set()
+        self._cv = threading.Condition()
 
     def do_ws_allow(self, ip, port, token):
         ws_token = self.cfg.gt('system', 'ws_token')
@@ -44,32 +92,48 @@ class MDTServer(SocketAPIHandler):
             self.log(F('Ошибка запуска сервера на {}:{}: {}', *self._local, e), logger_.CRIT)
             self.own.say(say)
             return False
-        self._socket.listen(1)
+        self._socket.listen(self._max_clients)
         return True
 
+    def join(self, timeout=30):
+        super().join(timeout)
+        with self._cv:
+            clients = list(self._clients)
+        for client in clients:
+            client.join(timeout)
+
     def run(self):
         if not self._open_socket():
             return
         while self.work:
+            with self._cv:
+                if len(self._clients) >= self._max_clients:
+                    # Новые подождут в очереди сокета
+                    self._cv.wait(1)
+                    continue
             try:
-                self._conn.insert(*self._socket.accept())
-                self._conn.settimeout(5.0)
+                conn, ip_info = self._socket.accept()
             except socket.timeout:
                 continue
-            allow = self.cfg.allow_connect(self._conn.ip)
-            msg = '{} new connection from {}:{}'.format('Allow' if allow else 'Ignore', self._conn.ip, self._conn.port)
+            allow = self.cfg.allow_connect(ip_info[0])
+            msg = '{} new connection from {}:{}'.format('Allow' if allow else 'Ignore', *ip_info[:2])
             self.log(msg, logger_.DEBUG if allow else logger_.WARN)
-            try:
-                if not allow:
-                    continue
-                for line in self._conn.read():
-                    self.parse(line)
-            except RuntimeError as e:
-                self.log('Error: {}'.format(e), logger_.ERROR)
-            finally:
-                self._conn.close()
+            if not allow:
+                Connect(conn, ip_info, None).close()
+                continue
+            client = _Client(
+                self.cfg, self.log, self.own, conn, ip_info, self.do_ws_allow, self._client_done, self._batch_pool
+            )
+            with self._cv:
+                self._clients.add(client)
+            client.start()
         self._socket.close()
 
+    def _client_done(self, client: _Client):
+        with self._cv:
+            self._clients.discard(client)
+            self._cv.notify()
+
 
 class DummyServer:
     work = False
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
+import collections
+import functools
 import hashlib
+import io
 import os
 import os.path
 import random
@@ -13,66 +16,404 @@ import pyaudio
 import lib.STT as STT
 import lib.TTS as TTS
 import lib.sr_wrapper as sr
+import lib.tts_pool as tts_pool
 import logger
 import utils
 from languages import F
 from lib.audio_utils import StreamRecognition, StreamDetector
+from lib.sessions import sessions
 from owner import Owner
 
 
+# Системные фразы без параметров, их синтезируем заранее
+SPOKEN = (
+    'Приветствую. Голосовой терминал настраивается, три... два... один...',
+    'Голосовой терминал завершает свою работу.',
+    'Конфигурация сохранена!',
+    'Конфигурация загружена!',
+    'Произошла ошибка распознавания',
+    'Блокировка включена',
+    'Блокировка снята',
+    'блокировка',
+    'Внимание! Выход из режима разработчика',
+    'Терминал перезагрузится через 5... 4... 3... 2... 1...',
+)
+
+
 class TextToSpeech:
+    USAGE = 'tts_usage'
+    USAGE_SIZE = 200
+    WARMUP_TOP = 30
+
     def __init__(self, cfg, log):
         self._log = log
         self.cfg = cfg
+        # Одинаковые одновременные запросы синтезируем один раз
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._pool = tts_pool.TTSPool()
+        # Сколько раз фраза произносилась, частые прогреваем первыми
+        usage = cfg.load_dict(self.USAGE) or {}
+        self._usage = collections.Counter({k: v for k, v in usage.items() if isinstance(v, int)})
+
+    @property
+    def overloaded(self) -> bool:
+        return self._pool.overloaded
+
+    def stop(self):
+        self._pool.join()
+        with self._lock:
+            usage = dict(self._usage.most_common(self.USAGE_SIZE))
+        self.cfg.save_dict(self.USAGE, usage)
+        self._log('HTTP connections: {}'.format(sessions.stats()), logger.DEBUG)
+
+    def preconnect(self):
+        # Пока пользователь говорит, поднимаем соединение с провайдером
+        if self.cfg.gts('tts_preconnect'):
+            sessions.preconnect('tts_{}'.format(self.cfg.gts('providertts')))
+
+    def warmup(self, phrases: list):
+        # Заполняет кэш в фоне с минимальным приоритетом, не ждет синтеза
+        if self.cfg.gt('cache', 'tts_size', 50) < 1:
+            return
+        provider = self.cfg.gts('providertts')
+        with self._lock:
+            frequent = [msg for msg, count in self._usage.most_common(self.WARMUP_TOP) if count > 1]
+        phrases = list(collections.OrderedDict.fromkeys(frequent + [F(key) for key in SPOKEN] + list(phrases)))
+        queued = 0
+        for msg in phrases:
+            chunks = self._split(provider, msg)
+            for chunk in chunks:
+                if self._pool.overloaded:
+                    break
+                self._tts(chunk, provider, False, tts_pool.PRE_SYNTHESIS, len(chunks) > 1, False)
+                queued += 1
+        self._log('Warmup: queued {} of {} phrases'.format(queued, len(phrases)), logger.DEBUG)
 
-    def tts(self, msg, realtime: bool = True):
+    def tts(self, msg, realtime: bool = True, priority: int = None):
         if callable(msg):
             # Audio already synthesized
             return msg
-        return _TTSWorker(self.cfg, self._log, msg, realtime).get
+        provider = msg.provider if isinstance(msg, utils.TextBox) else None
+        provider = provider or self.cfg.gts('providertts')
+        msg = str(msg)
+        if priority is None:
+            priority = tts_pool.SAY if realtime else tts_pool.PRE_SYNTHESIS
+        if realtime:
+            self._count(msg)
+        chunks = self._split(provider, msg)
+        if len(chunks) > 1:
+            self._log('Split into {} chunks: \'{}\''.format(len(chunks), msg), logger.DEBUG)
+            # Части уходят в пул сразу, ждет только чтение очередной части в _next
+            tts = functools.partial(
+                self._tts, provider=provider, realtime=realtime, priority=priority, strict=True, block=False
+            )
+            return _ChainedTTS(tts, chunks).get
+        return self._tts(msg, provider, realtime, priority)
+
+    def _count(self, msg: str):
+        with self._lock:
+            self._usage[msg] += 1
+            if len(self._usage) > self.USAGE_SIZE * 5:
+                self._usage = collections.Counter(dict(self._usage.most_common(self.USAGE_SIZE)))
+
+    def _tts(self, msg: str, provider: str, realtime: bool, priority: int, strict=False, block=True):
+        key = self._flight_key(provider, msg, strict)
+        with self._lock:
+            worker = self._in_flight.get(key)
+            if worker is None:
+                on_done = functools.partial(self._landed, key)
+                worker = _TTSWorker(self.cfg, self._log, msg, provider, realtime, on_done, strict)
+                if self._submit(worker, priority):
+                    self._in_flight[key] = worker
+                get = worker.get
+            else:
+                self._log('Joined in-flight synthesis: \'{}\''.format(msg), logger.DEBUG)
+                get = worker.join()
+        if block and not self.cfg.get('optimistic_nonblock_tts'):
+            worker.wait()
+        return get
+
+    def _submit(self, worker, priority: int) -> bool:
+        self._pool.workers = self.cfg.gts('tts_workers')
+        self._pool.provider_limit = self.cfg.gts('tts_provider_limit')
+        self._pool.queue_limit = self.cfg.gts('tts_queue_limit')
+        try:
+            self._pool.submit(worker, priority)
+        except tts_pool.TTSPoolOverloaded as e:
+            self._log('TTS request rejected: {}'.format(e), logger.WARN)
+            worker.reject()
+            return False
+        return True
+
+    def _split(self, provider: str, msg: str) -> list:
+        # Склеить можно только mp3, и каждая часть должна попасть в кэш
+        size = self.cfg.gts('tts_chunk_size')
+        if size < 1 or len(msg) <= size or self.cfg.gt('cache', 'tts_size', 50) < 1:
+            return [msg]
+        if self.cfg.yandex_api(provider) in (2, 3):
+            return [msg]
+        return utils.split_text(msg, size)
+
+    def _flight_key(self, provider: str, msg: str, strict: bool = False) -> tuple:
+        sets = utils.rhvoice_rest_sets(self.cfg[provider]) if provider == 'rhvoice-rest' else {}
+        voice = tuple(self.cfg.gt(provider, key) for key in ('speaker', 'emotion', 'speed', 'slow', 'server'))
+        return (
+            provider, hashlib.sha1(msg.encode()).hexdigest(), voice, self.cfg.tts_lang(provider),
+            self.cfg.yandex_api(provider), tuple(sorted(sets.items())), strict
+        )
+
+    def _landed(self, key: tuple, worker):
+        with self._lock:
+            if self._in_flight.get(key) is worker:
+                del self._in_flight[key]
+
+
+class _ChainedTTS:
+    """
+    Длинный текст синтезируется по частям с ограниченным упреждением,
+    части отдаются одним mp3 потоком. Чтение идет из потока плеера.
+    """
+    LOOKAHEAD = 2
+    BUFF_SIZE = 4096
+
+    def __init__(self, tts, chunks: list):
+        self._tts = tts
+        self._chunks = chunks
+        self._gets = []
+        self._idx = 0
+        self._fp = None
+        self._work = True
+        self._prefetch()
 
+    def get(self):
+        return '<{} chunks>'.format(len(self._chunks)), self, '.mp3'
+
+    def read(self, _=None):
+        while self._work:
+            if self._fp is None and not self._next():
+                break
+            data = self._fp.read(self.BUFF_SIZE)
+            if data:
+                return data
+            self._close_fp()
+        return b''
+
+    def write(self, data):
+        # Плеер останавливает стрим пустой записью
+        if not data:
+            self._work = False
+            if isinstance(self._fp, utils.RingBuffer):
+                self._fp.write(data)
+
+    def close(self):
+        self.write(b'')
+
+    def _next(self) -> bool:
+        if self._idx >= len(self._chunks):
+            return False
+        self._prefetch()
+        path, stream, _ = self._gets[self._idx]()
+        self._gets[self._idx] = None
+        self._idx += 1
+        if stream is None:
+            try:
+                stream = open(path, 'rb')
+            except OSError:
+                stream = io.BytesIO()
+        self._fp = stream
+        return True
+
+    def _close_fp(self):
+        if not isinstance(self._fp, utils.RingBuffer):
+            self._fp.close()
+        self._fp = None
+
+    def _prefetch(self):
+        while len(self._gets) < min(len(self._chunks), self._idx + 1 + self.LOOKAHEAD):
+            self._gets.append(self._tts(self._chunks[len(self._gets)]))
+
+
+class _SharedStream:
+    """
+    Поток синтеза для всех ожидающих, присоединившиеся позже сначала получают уже записанное из окна повтора.
+    Читатель появляется только при запросе результата: поток, который никто не забрал (прогрев, упреждение),
+    не держит синтез. Пишем вне блокировки, закрытые читатели (плеер остановлен) отписываются.
+    Окно повтора ограничено size, если поток пишется в файл - дальше опоздавшие читают файл. Без файла окно
+    живет, пока есть выданные, но не подписавшиеся читатели, или пока могут присоединиться новые.
+    """
+    def __init__(self, size: int):
+        self._lock = threading.Lock()
+        self._size = size
+        # None - окно сброшено
+        self._replay = bytearray()
+        self._closed = False
+        self._on_disk = False
+        self._detach = None
+        # Выданные, но еще не подписавшиеся читатели, владелец уже учтен
+        self._expected = 1
+        self._sealed = False
+        self._fps = []
+        self._written = 0
+        self._readers = 0
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            fps = self._fps.copy()
+            replay = len(self._replay) if self._replay is not None else None
+        return {
+            'written': self._written, 'readers': self._readers, 'replay': replay,
+            'dropped': sum(fp.stats['dropped'] for fp in fps), 'waits': sum(fp.stats['waits'] for fp in fps),
+        }
+
+    def start(self, on_disk: bool, detach=None):
+        # detach - больше не принимать новых читателей, вызывается один раз при переполнении окна без файла
+        with self._lock:
+            self._on_disk = on_disk
+            self._detach = detach
+
+    def expect(self):
+        with self._lock:
+            self._expected += 1
+
+    def seal(self):
+        # Новых читателей больше не будет
+        with self._lock:
+            self._sealed = True
+            self._trim()
+
+    def subscribe(self) -> utils.RingBuffer or None:
+        """None - окно уже сброшено, полный результат только в файле."""
+        with self._lock:
+            self._expected -= 1
+            self._readers += 1
+            if self._replay is None:
+                return None
+            # Опоздавшему нужно место под уже полученное
+            fp = utils.RingBuffer(max(self._size, len(self._replay) * 2))
+            if self._replay:
+                fp.write(self._replay)
+            if self._closed:
+                fp.close()
+            else:
+                self._fps.append(fp)
+            self._trim()
+        return fp
+
+    def write(self, chunk):
+        detach = None
+        with self._lock:
+            if not chunk:
+                self._closed = True
+            if self._replay is not None:
+                self._replay += chunk
+                self._trim()
+                if self._replay is not None and len(self._replay) > self._size and self._detach:
+                    detach, self._detach = self._detach, None
+            self._written += len(chunk)
+            self._fps = [fp for fp in self._fps if not fp.closed]
+            fps = self._fps.copy()
+        # Пишет один тред, порядок сохраняется. Новые читатели получат кусок из окна повтора
+        for fp in fps:
+            fp.write(chunk)
+        if detach:
+            detach()
+            self.seal()
+
+    def close(self):
+        self.write(b'')
+
+    def _trim(self):
+        # Под блокировкой
+        if self._replay is None:
+            return
+        if (self._sealed and self._expected <= 0) or (self._on_disk and len(self._replay) > self._size):
+            self._replay = None
 
-class _TTSWorker(threading.Thread):
+
+class _TTSWorker:
     WAIT = 600
 
-    def __init__(self, cfg, log, msg, realtime):
-        super().__init__(name='TTSWorker')
+    def __init__(self, cfg, log, msg: str, provider: str, realtime, on_done, strict: bool = False):
         self.cfg = cfg
         self.log = log
-        self._msg = str(msg)
-        self._provider = msg.provider if isinstance(msg, utils.TextBox) else None
-        self._provider = self._provider or self.cfg.gts('providertts')
+        self._msg = msg
+        self._provider = provider
         self._realtime = realtime
+        self._on_done = on_done
+        # Из кэша берем только файлы в запрошенном формате
+        self._strict = strict
         self._event = threading.Event()
         self._buff_size = 1024
 
-        self._file_path, self._stream, self._ext = None, None, None
+        self._file_path, self._ext = None, None
+        # Создаем сразу: попутчики присоединяются еще до начала синтеза
+        self._shared = _SharedStream(self.cfg.gts('stream_buffer') * 1024)
+        self._streaming = False
+        self._done = threading.Event()
 
         self._work_time = None
         self._start_time = time.time()
-        self.start()
 
-        if not self.cfg.get('optimistic_nonblock_tts'):
-            self._wait()
+    @property
+    def provider(self) -> str:
+        return self._provider
 
     def get(self):
-        self._wait()
+        self.wait()
         self._unlock()
-        return self._file_path, self._stream, self._ext
+        return self._result()
+
+    def join(self):
+        # Вызывается под блокировкой in-flight, пока воркер там
+        self._shared.expect()
+        return self.follower
+
+    def follower(self):
+        # Тот же результат, но со своей копией потока
+        self.wait()
+        return self._result()
+
+    def _result(self):
+        if not self._streaming:
+            return self._file_path, None, self._ext
+        stream = self._shared.subscribe()
+        if stream is None:
+            # Окно повтора сброшено, ждем готовый файл
+            self._done.wait(self.WAIT)
+            path = self._file_path if os.path.isfile(self._file_path) else self.cfg.path['tts_error']
+            return path, None, self._ext
+        return self._file_path, stream, self._ext
+
+    def wait(self):
+        self._event.wait(self.WAIT)
 
     def run(self):
+        try:
+            self._run()
+        finally:
+            self._shared.seal()
+            self._done.set()
+            self._unlock()
+            self._on_done(self)
+
+    def reject(self):
+        self._file_path = self.cfg.path['tts_error']
+        self._unlock()
+
+    def _run(self):
         if not TTS.support(self._provider) :
             self.log(F('Неизвестный провайдер: {}', self._provider), logger.CRIT)
             self._file_path = self.cfg.path['tts_error']
-            return self._unlock()
+            return
         msg = F('{} за {}{}: {}', *self._generating(), self._file_path)
         self.log(msg, logger.DEBUG if self._realtime else logger.INFO)
 
     def _generating(self):
         sha1 = hashlib.sha1(self._msg.encode()).hexdigest()
         ext = 'opus' if self.cfg.yandex_api(self._provider) in (2, 3) else 'mp3'
-        find_part = ''.join(('_', sha1, '.'))
-        rname = find_part + ext
+        rname = ''.join(('_', sha1, '.', ext))
         use_cache = self.cfg.gt('cache', 'tts_size', 50) > 0
         msg_gen = '\'{}\' '.format(self._msg)
 
@@ -80,11 +421,15 @@ class _TTSWorker(threading.Thread):
             self.log('say {}'.format(msg_gen), logger.INFO)
             msg_gen = ''
 
-        if use_cache and self._found_in_cache(find_part, ext):
+        if use_cache and self._found_in_cache(sha1, ext):
             self._unlock()
             work_time = time.time() - self._start_time
             action = F('{}найдено в кэше', msg_gen)
             time_diff = ''
+        elif use_cache and self._found_in_share(sha1, ext):
+            work_time = time.time() - self._start_time
+            action = '{}shared cache'.format(msg_gen)
+            time_diff = ''
         else:
             if not use_cache and self._provider in ('rhvoice-rest', 'rhvoice'):
                 ext = 'wav'
@@ -105,35 +450,34 @@ class _TTSWorker(threading.Thread):
             self._work_time = time.time() - self._start_time
         self._event.set()
 
-    def _wait(self):
-        self._event.wait(self.WAIT)
-
-    def _found_in_cache(self, rname: str, ext: str):
+    def _found_in_cache(self, sha1: str, ext: str):
         prov_priority = self.cfg.gt('cache', 'tts_priority', '')
-        self._file_path = None
+        providers = []
         if TTS.support(prov_priority):  # Приоритет
-            self._file_path = self._file_check(prov_priority, rname, ext)
-
-        if not self._file_path and prov_priority != self._provider:  # Обычная, второй раз не чекаем
-            self._file_path = self._file_check(self._provider, rname, ext)
-
-        if not self._file_path and prov_priority == '*':  # Ищем всех
-            for key in TTS.PROVIDERS:
-                if key != self._provider:
-                    self._file_path = self._file_check(key, rname, ext)
-                if self._file_path:
-                    break
+            providers.append(prov_priority)
+        if prov_priority != self._provider:  # Обычная, второй раз не чекаем
+            providers.append(self._provider)
+        if prov_priority == '*':  # Ищем всех
+            providers.extend(key for key in TTS.PROVIDERS if key != self._provider)
+
+        candidates = []
+        for prov in providers:
+            exts = ('mp3', 'opus') if prov == 'yandex' and not self._strict else (ext,)
+            candidates.extend((prov, ext_) for ext_ in exts)
+        self._file_path = self.cfg.tts_cache.find(sha1, candidates, self._strict)
         return self._file_path
 
-    def _file_check(self, prov, rname, ext):
-        if prov == 'yandex':
-            for ext_ in ('mp3', 'opus'):
-                file = os.path.join(self.cfg.gt('cache', 'path'), prov + rname + ext_)
-                if os.path.isfile(file):
-                    return file
-            return None
-        file = os.path.join(self.cfg.gt('cache', 'path'), prov + rname + ext)
-        return file if os.path.isfile(file) else None
+    def _found_in_share(self, sha1: str, ext: str) -> bool:
+        try:
+            fetch = self.cfg.tts_share.fetch(self._provider, sha1, ext, self._strict)
+        except RuntimeError as e:
+            self.log('Shared cache error: {}'.format(e), logger.WARN)
+            return False
+        if fetch is None:
+            return False
+        self._file_path = os.path.join(self.cfg.gt('cache', 'path'), '{}_{}.{}'.format(self._provider, sha1, fetch.ext))
+        self._stream_to(fetch, self._file_path, fetch.ext, None, ext)
+        return True
 
     def _tts_gen(self, file, format_, msg: str):
         key = None
@@ -159,19 +503,40 @@ class _TTSWorker(threading.Thread):
             self._synthesis_error(key, e)
             self._file_path = self.cfg.path['tts_error']
             return
-
-        self._stream = utils.FakeFP()
-        write_to = [self._stream]
+        self._stream_to(tts, file, format_, key)
+
+    def _stream_to(self, tts, file, format_, key, orig=None):
+        # orig - запрошенный формат для файла из общего кэша, None - синтезировали сами
+        # Без файла опоздавшим негде взять начало: при переполнении окна уходим из in-flight
+        self._shared.start(bool(file), None if file else functools.partial(self._on_done, self))
+        self._streaming = True
+        write_to = [self._shared]
         if file:
             write_to.append(open(file, 'wb'))
         self._ext = '.{}'.format(format_) if not file else None
         self._unlock()
+        error = False
         try:
             tts.stream_to_fps(write_to)
         except Exception as e:
+            error = True
             self._synthesis_error(key, e)
         for fp in write_to:
             fp.close()
+        self.log('Stream buffer: {}'.format(self._shared.stats), logger.DEBUG)
+        if file:
+            self._cache_update(file, error, orig)
+
+    def _cache_update(self, file: str, error: bool, orig=None):
+        if error:
+            # Не оставляем в кэше обрывки
+            self.cfg.tts_cache.discard(file)
+            return
+        if orig is None:
+            self.cfg.tts_share.upload(file, self.log)
+        deleted = self.cfg.tts_cache.add(file, orig or '', self._strict)
+        if deleted:
+            self.log(F('Удалено: {}', ', '.join(deleted)))
 
     def _synthesis_error(self, key, e):
         if not isinstance(e, RuntimeError):
@@ -424,6 +789,7 @@ class SpeechToText:
                 url=self.cfg.gt(prov, 'server'),
                 yandex_api=self.cfg.yandex_api(prov),
                 grpc=self.cfg.gt(prov, 'grpc'),
+                partial=self._partial_matcher(audio),
             ).text()
         except STT.UnknownValueError:
             command = ''
@@ -440,6 +806,13 @@ class SpeechToText:
         self.log(F('Распознано за {}', utils.pretty_time(w_time)), logger.DEBUG)
         return utils.TextBox(command or '', prov, w_time)
 
+    def _partial_matcher(self, audio):
+        # Досрочное выполнение команд по промежуточным гипотезам, только для потокового распознавания
+        count = self.cfg.gt('listener', 'speculative_partials', 0)
+        if count > 0 and isinstance(audio, StreamRecognition):
+            return PartialMatcher(count, self.own.modules_speculative, self.log)
+        return None
+
     def phrase_from_files(self, files: list):
         if not files:
             return '', 0
@@ -515,6 +888,28 @@ class SpeechToText:
             return True
 
 
+class PartialMatcher:
+    def __init__(self, count: int, speculative, log):
+        self._count = count
+        self._speculative = speculative
+        self._log = log
+        self._last = None
+        self._seen = 0
+
+    def __call__(self, partial: str) -> bool:
+        # Гипотеза должна повториться count раз подряд, после этого спрашиваем у ModuleManager
+        partial = partial.strip().lower()
+        if partial != self._last:
+            self._last, self._seen = partial, 0
+        self._seen += 1
+        if not partial or self._seen < self._count:
+            return False
+        if self._speculative(partial):
+            self._log('Speculative match after {} partials: {}'.format(self._seen, repr(partial)), logger.INFO)
+            return True
+        return False
+
+
 class RecognitionWorker(threading.Thread):
     def __init__(self, voice_recognition, file_or_adata, provider=None):
         super().__init__()
@@ -563,6 +958,9 @@ class Phrases:
     def ask(self) -> str:
         return self._choice('ask')
 
+    def all(self) -> list:
+        return self._phrases['hello'] + self._phrases['deaf'] + self._phrases['ask']
+
     @property
     def chance(self) -> bool:
         return random.SystemRandom().randint(1, 100) <= self._phrases['chance']
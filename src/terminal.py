@@ -189,9 +189,11 @@ class MDTerminal(threading.Thread):
                 continue
             if late:
                 late = time.time() - late
-            msg = F('Получено {}:{}, lvl={} опоздание {} секунд.', cmd, repr(data)[:300], lvl, int(late))
+
+            def msg():
+                return F('Получено {}:{}, lvl={} опоздание {} секунд.', cmd, repr(data)[:300], lvl, int(late))
             if late > self.MAX_LATE:
-                self.log(F('{} Игнорирую.', msg), logger.WARN)
+                self.log(F('{} Игнорирую.', msg()), logger.WARN)
                 continue
             else:
                 self.log(msg, logger.DEBUG)
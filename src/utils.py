@@ -5,7 +5,7 @@ import errno
 import functools
 import json
 import os
-import queue
+import re
 import signal
 import socket
 import ssl
@@ -33,11 +33,15 @@ REQUEST_ERRORS = (
 
 
 class TextBox(str):
-    def __new__(cls, text, provider=None, time_=0):
+    def __new__(cls, text, provider=None, time_=0, key=None, ttl=0, priority=0):
         # noinspection PyArgumentList
         obj = str.__new__(cls, text)
         obj.provider = str(provider) if provider else ''
         obj.time = time_
+        # Для фоновой очереди: вытеснение по ключу, время жизни и приоритет
+        obj.key = str(key) if key else ''
+        obj.ttl = ttl
+        obj.priority = priority
         return obj
 
 
@@ -133,15 +137,102 @@ class SignalHandler(SignalHandlerDummy):
             time.sleep(self._death_time)
 
 
-class FakeFP(queue.Queue):
-    def read(self, _=None):
-        return self.get()
-
-    def write(self, n):
-        self.put_nowait(n)
+class RingBuffer:
+    """
+    Ограниченный кольцевой буфер между писателем и читателем (синтез -> плеер).
+    Писатель ждет свободного места, пустая запись или close - конец потока, дальше запись выкидывается.
+    """
+    SIZE = 256 * 1024
+    READ_SIZE = 4096
+    WRITE_TIMEOUT = 60
+
+    def __init__(self, size: int = 0):
+        self._buff = bytearray(size or self.SIZE)
+        self._cv = threading.Condition()
+        self._start = 0
+        self._len = 0
+        self._closed = False
+        # peak - максимальное заполнение, waits - сколько раз писатель ждал читателя
+        self.stats = {'written': 0, 'read': 0, 'peak': 0, 'waits': 0, 'dropped': 0}
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def write(self, data):
+        if not data:
+            return self.close()
+        data = memoryview(data).cast('B')
+        size = len(self._buff)
+        with self._cv:
+            while data:
+                if self._closed:
+                    self.stats['dropped'] += len(data)
+                    return
+                free = size - self._len
+                if not free:
+                    self.stats['waits'] += 1
+                    if not self._cv.wait(self.WRITE_TIMEOUT):
+                        # Читатель пропал
+                        self._closed = True
+                    continue
+                count = min(free, len(data))
+                end = (self._start + self._len) % size
+                first = min(count, size - end)
+                self._buff[end:end + first] = data[:first]
+                self._buff[:count - first] = data[first:count]
+                data = data[count:]
+                self._len += count
+                self.stats['written'] += count
+                self.stats['peak'] = max(self.stats['peak'], self._len)
+                self._cv.notify_all()
+
+    def readinto(self, buff) -> int:
+        buff = memoryview(buff).cast('B')
+        with self._cv:
+            if not self._wait_data():
+                return 0
+            count = min(self._len, len(buff))
+            first = min(count, len(self._buff) - self._start)
+            buff[:first] = self._buff[self._start:self._start + first]
+            buff[first:count] = self._buff[:count - first]
+            self._consume(count)
+            return count
+
+    def read(self, size=None) -> bytes:
+        with self._cv:
+            if not self._wait_data():
+                return b''
+            count = min(self._len, size or self.READ_SIZE)
+            first = min(count, len(self._buff) - self._start)
+            data = bytes(self._buff[self._start:self._start + first])
+            if count > first:
+                data += self._buff[:count - first]
+            self._consume(count)
+            return data
 
     def close(self):
-        self.write(b'')
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+
+    def _wait_data(self) -> bool:
+        while not self._len and not self._closed:
+            self._cv.wait()
+        return bool(self._len)
+
+    def _consume(self, count: int):
+        self._start = (self._start + count) % len(self._buff)
+        self._len -= count
+        self.stats['read'] += count
+        self._cv.notify_all()
+
+
+# Совместимость
+FakeFP = RingBuffer
 
 
 class Popen:
@@ -253,6 +344,28 @@ def rhvoice_rest_sets(data: dict):
     return sets
 
 
+_SPLIT_RE = (re.compile(r'(?<=[.!?…;])\s+'), re.compile(r'(?<=[,:])\s+'), re.compile(r'\s+'))
+
+
+def split_text(text: str, size: int) -> list:
+    """Режет текст по предложениям, потом по запятым, потом по словам. Мелкие куски склеивает до size."""
+    def parts(txt: str, level: int) -> list:
+        if len(txt) <= size or level >= len(_SPLIT_RE):
+            return [txt]
+        result = []
+        for part in _SPLIT_RE[level].split(txt):
+            result.extend(parts(part, level + 1))
+        return result
+
+    chunks = []
+    for part in parts(text.strip(), 0):
+        if chunks and len(chunks[-1]) + len(part) < size:
+            chunks[-1] = ' '.join((chunks[-1], part))
+        elif part:
+            chunks.append(part)
+    return chunks
+
+
 def check_phrases(phrases):
     if phrases is None:
         return
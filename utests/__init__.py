@@ -4,5 +4,20 @@ from .polly import Polly
 from .training import SNPrettyErrors
 from .xml import YandexXML
 from .url_builder import URLBuilder
+from .tts_cache import TTSCacheIndex, OpusSkip
+from .tts_pool import TTSPool
+from .tts_share import TTSShare
+from .publisher import PubSubQueues
+from .coalescer import Coalesce
+from .duplex_async import DuplexAsync
+from .json_codec import JSONCodec, LegacyParams
+from .api_batch import APIBatch
+from .socket_wrapper import ConnectWrite
+from .stts import TTSStop, ChainedTTS, SharedStream
+from .modules_manager import Speculative
+from .logger import LogWrapper, FileWriterErrors
 
-__all__ = ['YandexXML', 'ConfigUpdater', 'Polly', 'SNPrettyErrors', 'IPStorage', 'URLBuilder']
+__all__ = ['YandexXML', 'ConfigUpdater', 'Polly', 'SNPrettyErrors', 'IPStorage', 'URLBuilder', 'TTSCacheIndex',
+           'TTSPool', 'OpusSkip', 'TTSShare', 'PubSubQueues', 'Coalesce', 'DuplexAsync',
+           'JSONCodec', 'LegacyParams', 'APIBatch', 'ConnectWrite', 'TTSStop', 'ChainedTTS', 'SharedStream',
+           'Speculative', 'LogWrapper', 'FileWriterErrors']
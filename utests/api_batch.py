@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+import unittest
+
+from lib.api.misc import api_commands
+from lib.api.socket_api_handler import APIHandler, BatchPool, SocketAPIHandler
+
+
+class _Cfg(dict):
+    def gt(self, sec, key, default=None):
+        return self.get(sec, {}).get(key, default)
+
+
+class _Owner:
+    @staticmethod
+    def has_subscribers(*_):
+        return False
+
+
+class _APIHandler(APIHandler):
+    @api_commands('sleep', pure_json=True)
+    def _api_sleep(self, _, data: list):
+        time.sleep(data[0])
+        return threading.current_thread().name
+
+    @api_commands('order', pure_json=True, serial=True)
+    def _api_order(self, _, data: list):
+        return threading.current_thread().name
+
+
+def _log(*_, **__):
+    pass
+
+
+class APIBatch(unittest.TestCase):
+    def setUp(self):
+        # Как у сервера: один пул на подключения
+        self.pool = BatchPool()
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def _parse(self, batch: list, timeout=30) -> tuple:
+        cfg = _Cfg(smarthome={'batch_workers': 4, 'batch_timeout': timeout})
+        handler = SocketAPIHandler(cfg, _log, _Owner(), 'Batch', _APIHandler, self.pool)
+        handler.api.set('auth', True)
+        start = time.time()
+        result = handler._parse(json.dumps(batch))
+        return result, time.time() - start
+
+    def test_parallel(self):
+        batch = [{'method': 'sleep', 'params': [0.2], 'id': x} for x in range(3)]
+        batch.insert(2, {'method': 'order', 'params': [], 'id': 'serial'})
+        result, elapsed = self._parse(batch)
+        self.assertEqual([x['id'] for x in result], [0, 1, 'serial', 2])
+        # serial выполняется в треде подключения, после первых двух
+        self.assertEqual(result[2]['result'], threading.current_thread().name)
+        self.assertNotEqual(result[0]['result'], threading.current_thread().name)
+        self.assertLess(elapsed, 0.55)
+
+    def test_timeout(self):
+        batch = [{'method': 'sleep', 'params': [x], 'id': x} for x in (0, 0.5)]
+        batch.append({'method': 'order', 'params': [], 'id': 'late'})
+        result, elapsed = self._parse(batch, timeout=0.1)
+        self.assertIn('result', result[0])
+        self.assertEqual([x['error']['code'] for x in result[1:]], [-32000, -32000])
+        self.assertLess(elapsed, 0.4)
+
+    def test_closed_pool(self):
+        # Сервер остановлен, batch выполняется по порядку в треде подключения
+        self.pool.shutdown()
+        batch = [{'method': 'sleep', 'params': [0], 'id': x} for x in range(3)]
+        result, _ = self._parse(batch)
+        self.assertEqual([x['result'] for x in result], [threading.current_thread().name] * 3)
+
+    def test_terminal_serial(self):
+        # Порядок в терминале: то, что уходит в terminal_call, в batch не параллелится
+        handler = SocketAPIHandler(_Cfg(), _log, _Owner(), 'Batch', _APIHandler, self.pool)
+        terminal = {'tts', 'ask', 'hi', 'voice', 'listener', 'rec', 'send_model', 'sre', 'test.record', 'test.test'}
+        self.assertEqual(terminal - handler.api.SERIAL, set())
@@ -0,0 +1,28 @@
+import time
+import unittest
+
+from lib.coalescer import Coalescer, BATCH, OFF
+
+
+class Coalesce(unittest.TestCase):
+    def test_latest(self):
+        coalescer = Coalescer(0.05)
+        self.assertEqual(coalescer.add('volume', 1), [('volume', [1], False)])
+        self.assertEqual(coalescer.add('volume', 2), [])
+        self.assertEqual(coalescer.add('start_talking', None), [('start_talking', [None], False)])
+        self.assertEqual(coalescer.add('volume', 3), [])
+        self.assertEqual(coalescer.add('stop_talking', None), [])
+        # Не склеивается
+        self.assertEqual(coalescer.add('ask_again', None), [('ask_again', [None], False)])
+        time.sleep(0.06)
+        self.assertEqual(coalescer.flush(), [('volume', [3], False), ('stop_talking', [None], False)])
+        self.assertIsNone(coalescer.timeout())
+
+    def test_batch(self):
+        coalescer = Coalescer(0.05, {'log': BATCH, 'volume': OFF})
+        self.assertEqual(coalescer.add('log', 'a'), [('log', ['a'], True)])
+        self.assertEqual(coalescer.add('log', 'b'), [])
+        self.assertEqual(coalescer.add('log', 'c'), [])
+        self.assertEqual(coalescer.add('volume', 1), [('volume', [1], False)])
+        self.assertEqual(coalescer.configure(0), [('log', ['b', 'c'], True)])
+        self.assertEqual(coalescer.add('log', 'd'), [('log', ['d'], False)])
@@ -0,0 +1,102 @@
+import json
+import os
+import queue
+import socket
+import threading
+import unittest
+
+from lib.duplex_async import DuplexLoop, MAX_LINE, _ws_frame
+from lib.socket_wrapper import Connect
+
+
+class DuplexAsync(unittest.TestCase):
+    def setUp(self):
+        self.loop = DuplexLoop()
+        self.loop.start()
+        self.lines = queue.Queue()
+        self.closed = threading.Event()
+        self.client, server = socket.socketpair()
+        self.client.settimeout(5)
+        self.server = server
+
+    def tearDown(self):
+        self.loop.join(5)
+        self.client.close()
+
+    def _attach(self, ws: bool, auth=False):
+        return self.loop.attach(self.server, ws, ('127.0.0.1', 1), self.lines.put, self.closed.set, auth)
+
+    @staticmethod
+    def _frame(payload: bytes, opcode, fin=True, mask=os.urandom(4), size=None):
+        size = len(payload) if size is None else size
+        masked = bytes(x ^ mask[idx % 4] for idx, x in enumerate(payload))
+        if size < 65536:
+            head = bytes(((0x80 if fin else 0) | opcode, 0x80 | 126)) + size.to_bytes(2, 'big')
+        else:
+            head = bytes(((0x80 if fin else 0) | opcode, 0x80 | 127)) + size.to_bytes(8, 'big')
+        return head + mask + masked
+
+    def test_tcp(self):
+        conn = self._attach(False)
+        self.client.sendall(b'first\r\nsec')
+        self.client.sendall(b'ond\r\n\xff\r\nthird\r\n')
+        self.assertEqual([self.lines.get(timeout=5) for _ in range(3)], ['first', 'second', 'third'])
+        conn.write({'id': 1})
+        self.assertEqual(json.loads(self.client.recv(1024)), {'id': 1})
+        self.client.sendall(b'\r\n')
+        self.assertTrue(self.closed.wait(5))
+        self.assertFalse(conn.alive)
+        with self.assertRaises(RuntimeError):
+            conn.write('bye')
+
+    def test_ws(self):
+        frame = self._frame
+        conn = self._attach(True)
+        data = frame(b'a' * 200, 0x1, False) + frame(b'b', 0x0) + frame(b'ping', 0x9)
+        self.client.sendall(data[:10])
+        self.client.sendall(data[10:])
+        self.assertEqual(self.lines.get(timeout=5), 'a' * 200 + 'b')
+        self.assertEqual(self.client.recv(6), _ws_frame(b'ping', 0xA))
+        conn.write('ok')
+        self.assertEqual(self.client.recv(4), _ws_frame(b'ok'))
+        self.client.sendall(frame(b'', 0x8))
+        self.assertTrue(self.closed.wait(5))
+
+    def test_auth(self):
+        conn = Connect(self.server, ('127.0.0.1', 1), False, True)
+        sock, ws, auth = conn.detach()
+        self.assertEqual((sock, ws, auth), (self.server, False, True))
+        self.assertFalse(conn.auth)
+        async_conn = self._attach(False, auth)
+        self.assertTrue(async_conn.auth)
+        async_conn.close()
+        self.assertTrue(self.closed.wait(5))
+
+    def test_not_auth(self):
+        sock, ws, auth = Connect(self.server, ('127.0.0.1', 1), False).detach()
+        async_conn = self._attach(ws, auth)
+        self.assertFalse(async_conn.auth)
+        async_conn.close()
+        self.assertTrue(self.closed.wait(5))
+
+    def test_tcp_oversize(self):
+        self._attach(False)
+        self.client.sendall(b'x' * (MAX_LINE + 1))
+        self.assertTrue(self.closed.wait(5))
+        self.assertTrue(self.lines.empty())
+
+    def test_ws_oversize_frame(self):
+        # Заголовок обещает больше лимита, тело не нужно
+        self._attach(True)
+        self.client.sendall(self._frame(b'', 0x1, size=MAX_LINE + 1))
+        self.assertTrue(self.closed.wait(5))
+        self.assertTrue(self.lines.empty())
+
+    def test_ws_oversize_message(self):
+        # Каждый кадр в пределах, но сообщение из продолжений - нет
+        self._attach(True)
+        part = MAX_LINE // 2 + 1
+        self.client.sendall(self._frame(b'a' * part, 0x1, False))
+        self.client.sendall(self._frame(b'', 0x0, size=part))
+        self.assertTrue(self.closed.wait(5))
+        self.assertTrue(self.lines.empty())
@@ -0,0 +1,67 @@
+import json
+import unittest
+
+from lib import json_codec
+from lib.api.misc import api_commands
+from lib.api.socket_api_handler import APIHandler, SocketAPIHandler
+
+
+class JSONCodec(unittest.TestCase):
+    def tearDown(self):
+        json_codec.select()
+
+    def test_codecs(self):
+        data = {'id': 1, 1: 'тест', 'big': 2 ** 70, 'list': [None, True, 1.5]}
+        for name in json_codec.CODECS:
+            if not getattr(json_codec, name):
+                continue
+            self.assertEqual(json_codec.select(name), name)
+            # Как стандартный json: ключи в строки, без \\u экранирования, большие числа
+            expected = {'id': 1, '1': 'тест', 'big': 2 ** 70, 'list': [None, True, 1.5]}
+            self.assertEqual(json_codec.loads(json_codec.dumps(data)), expected)
+            self.assertIn('тест', json_codec.dumps_bytes(data).decode())
+            with self.assertRaises(json_codec.DecodeError):
+                json_codec.loads('{"n": ')
+            with self.assertRaises(TypeError):
+                json_codec.dumps({'set': {1}})
+
+    def test_parsed(self):
+        params = {'filename': 'a', 'data': [1, 2]}
+        parsed = json_codec.Parsed(params)
+        self.assertIsNone(parsed._str)
+        self.assertIs(json_codec.loads(parsed), params)
+        # Строка только по требованию и один раз
+        self.assertEqual(json_codec.loads(str(parsed)), params)
+        self.assertIs(str(parsed), str(parsed))
+
+
+class _Cfg(dict):
+    def gt(self, sec, key, default=None):
+        return self.get(sec, {}).get(key, default)
+
+
+class _Owner:
+    @staticmethod
+    def has_subscribers(*_):
+        return False
+
+
+class _APIHandler(APIHandler):
+    @api_commands('legacy.str')
+    def _api_str(self, _, data):
+        return [type(data).__name__, data]
+
+    @api_commands('legacy.parsed', parsed=True)
+    def _api_parsed(self, _, data):
+        return [type(data).__name__, data]
+
+
+class LegacyParams(unittest.TestCase):
+    def test_legacy_params(self):
+        handler = SocketAPIHandler(_Cfg(), lambda *_, **__: None, _Owner(), 'Legacy', _APIHandler)
+        handler.api.set('auth', True)
+        params = {'a': [1, 'б']}
+        for method, type_ in (('legacy.str', 'str'), ('legacy.parsed', 'dict')):
+            result = handler._parse(json.dumps({'method': method, 'params': params, 'id': 1}))['result']
+            self.assertEqual(result[0], type_)
+            self.assertEqual(json.loads(result[1]) if type_ == 'str' else result[1], params)
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+import logger
+
+
+class _Logger:
+    def __init__(self):
+        self.lines = []
+
+    @staticmethod
+    def enabled(lvl: int) -> bool:
+        return lvl >= logger.INFO
+
+    def put(self, _, names, msg, lvl):
+        self.lines.append((names, msg, lvl))
+
+
+class LogWrapper(unittest.TestCase):
+    def setUp(self):
+        self.logger = _Logger()
+        self.log = logger._LogWrapper('Test', self.logger)
+
+    def test_calls(self):
+        built = []
+        self.log('plain')
+        self.log('level', logger.WARN)
+        self.log('Command {!r}', logger.INFO, args=('ping',))
+        # Отфильтрованное не собирается
+        self.log(lambda: built.append(1) or 'lazy')
+        self.log.module('Mod', '{} + {}', logger.ERROR, args=(1, 2))
+        self.assertEqual(self.logger.lines, [
+            (('Test',), 'level', logger.WARN), (('Test',), "Command 'ping'", logger.INFO),
+            (('Test', 'Mod'), '1 + 2', logger.ERROR),
+        ])
+        self.assertEqual(built, [])
+
+    def test_wrong_level(self):
+        with self.assertRaises(TypeError):
+            self.log('x {}', 'value')
+        with self.assertRaises(TypeError):
+            self.log('x {}', 5)
+        with self.assertRaises(TypeError):
+            self.log('x {}', logger.INFO, 'value')
+        self.assertEqual(self.logger.lines, [])
+
+
+class FileWriterErrors(unittest.TestCase):
+    def test_write_error_logged_once(self):
+        logs = []
+        with tempfile.TemporaryDirectory() as path:
+            writer = logger._FileWriter(os.path.join(path, 'missing', 'log.txt'), False, lambda *x: logs.append(x))
+            try:
+                for _ in range(3):
+                    writer._flush(b'line\n')
+            finally:
+                writer.join()
+        self.assertEqual(len(logs), 1)
+        self.assertIn('Log write error', logs[0][0])
+        self.assertEqual(logs[0][1], logger.ERROR)
+
+    def test_compress_error_logged(self):
+        logs = []
+        with tempfile.TemporaryDirectory() as path:
+            logger._compress(os.path.join(path, 'missing'), os.path.join(path, 'log.gz'), lambda *x: logs.append(x))
+        self.assertEqual([lvl for _, lvl in logs], [logger.ERROR])
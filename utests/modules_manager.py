@@ -0,0 +1,40 @@
+import unittest
+
+from modules_manager import ModuleManager, DynamicModule, EQ, ANY
+
+
+def _module(*_):
+    pass
+
+
+def _speculative(*_):
+    pass
+
+
+class Speculative(unittest.TestCase):
+    def setUp(self):
+        self.mm = ModuleManager(None, None, None)
+        self.mm.all = {
+            _module: {'enable': True, 'mode': ANY, ANY: ['погода', ['время', EQ]]},
+            _speculative: {'enable': True, 'mode': ANY, 'speculative': True, ANY: [['свет', EQ]]},
+        }
+
+    def test_eq_match(self):
+        self.assertTrue(self.mm.speculative('Свет'))
+        # EQ, но модуль без флага
+        self.assertFalse(self.mm.speculative('время'))
+
+    def test_no_match(self):
+        self.assertFalse(self.mm.speculative('свет в зале'))
+        self.assertFalse(self.mm.speculative('погода завтра'))
+        self.assertFalse(self.mm.speculative('музыка'))
+        self.assertFalse(self.mm.speculative(''))
+
+    def test_dynamic(self):
+        def callback(*_):
+            pass
+        self.assertTrue(self.mm.insert_module(DynamicModule(callback, ANY, [['музыка', EQ]])))
+        # Динамические модули без флага, блокировка после проверки свободна
+        self.assertFalse(self.mm.speculative('музыка'))
+        self.assertTrue(self.mm.speculative('свет'))
+        self.assertTrue(self.mm.extract_module(callback))
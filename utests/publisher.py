@@ -0,0 +1,141 @@
+import threading
+import time
+import unittest
+
+import logger
+from lib.publisher import PubSub, BLOCK, COALESCE, DROP_OLDEST, callback_name
+
+
+class PubSubQueues(unittest.TestCase):
+    def setUp(self):
+        self.pub = PubSub()
+        self.gate = threading.Event()
+
+    def tearDown(self):
+        self.gate.set()
+        self.pub.join()
+
+    def _wait(self, check, timeout=2):
+        end = time.time() + timeout
+        while not check() and time.time() < end:
+            time.sleep(0.01)
+        return check()
+
+    def test_stuck_subscriber(self):
+        fast, slow = [], []
+
+        def stuck(_, val):
+            slow.append(val)
+            self.gate.wait(5)
+        self.pub.subscribe('event', stuck)
+        self.pub.subscribe('event', lambda _, val: fast.append(val))
+        for idx in range(10):
+            self.pub.call('event', idx)
+        # Зависший подписчик не мешает остальным
+        self.assertTrue(self._wait(lambda: len(fast) == 10))
+        self.assertEqual(fast, list(range(10)))
+        self.gate.set()
+        self.assertTrue(self._wait(lambda: len(slow) == 10))
+        self.assertEqual(slow, list(range(10)))
+
+    def test_coalesce(self):
+        result = []
+
+        def callback(_, val):
+            result.append(val)
+            self.gate.wait(5)
+        self.pub.subscribe(['volume', 'status'], callback, policy=COALESCE)
+        self.pub.call('volume', 0)
+        self.assertTrue(self._wait(lambda: result == [0]))
+        for idx in range(1, 10):
+            self.pub.call('volume', idx)
+            self.pub.call('status', -idx)
+        self.gate.set()
+        self.assertTrue(self._wait(lambda: len(result) == 3))
+        time.sleep(0.1)
+        self.assertEqual(result, [0, 9, -9])
+
+    def test_stats(self):
+        warnings = []
+        self.pub.log = lambda msg, lvl: warnings.append(msg)
+        self.pub.configure(2, 100, 'drop_oldest', slow=50)
+
+        def slow(*_):
+            time.sleep(0.06)
+        self.pub.subscribe('event', slow)
+        for _ in range(3):
+            self.pub.call('event')
+        name = callback_name(slow)
+        self.assertTrue(self._wait(lambda: self.pub.stats()['subscribers'].get(name, {}).get('calls') == 3))
+        stats = self.pub.stats(reset=True)
+        self.assertEqual(stats['events']['default']['event']['calls'], 3)
+        sub = stats['subscribers'][name]
+        self.assertEqual((sub['slow'], sub['errors'], sub['duration']['count']), (3, 0, 3))
+        self.assertGreaterEqual(sub['duration']['buckets']['<=100'], 1)
+        # Предупреждение одно на WARN_INTERVAL
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(self.pub.stats()['subscribers'][name]['calls'], 0)
+
+    def test_drop_log(self):
+        logs = []
+        self.pub.log = lambda msg, lvl: logs.append((msg, lvl))
+        self.pub.configure(2, 2, 'unknown')
+        self.assertEqual(self.pub.policy, DROP_OLDEST)
+        result, fast = [], []
+
+        def stuck(_, val):
+            result.append(val)
+            self.gate.wait(5)
+        self.pub.subscribe('event', stuck)
+        # Быстрый не теряет последнее значение и не пишет в лог
+        self.pub.subscribe('event', lambda _, val: fast.append(val), policy=COALESCE)
+        self.pub.call('event', 0)
+        self.assertTrue(self._wait(lambda: result == [0]))
+        start = time.time()
+        for idx in range(1, 5):
+            self.pub.call('event', idx)
+        # Полная очередь зависшего не задерживает ни публикующего, ни шину
+        self.assertTrue(self._wait(lambda: fast and fast[-1] == 4))
+        self.assertLess(time.time() - start, self.pub.BLOCK_TIMEOUT)
+        name = callback_name(stuck)
+        self.assertTrue(self._wait(lambda: self.pub.stats()['subscribers'].get(name, {}).get('dropped') == 2))
+        self.gate.set()
+        self.assertTrue(self._wait(lambda: result == [0, 3, 4]))
+        # Предупреждение одно на WARN_INTERVAL
+        self.assertEqual([lvl for _, lvl in logs], [logger.WARN])
+
+    def test_block_caller(self):
+        self.pub.BLOCK_TIMEOUT = 0.3
+        self.pub.configure(2, 2, BLOCK)
+        result, fast = [], []
+
+        def stuck(_, val):
+            result.append(val)
+            self.gate.wait(5)
+        self.pub.subscribe('event', stuck)
+        self.pub.subscribe('other', lambda _, val: fast.append(val))
+        self.pub.call('event', 0)
+        self.assertTrue(self._wait(lambda: result == [0]))
+        self.pub.call('event', 1)
+        self.pub.call('event', 2)
+        self.assertTrue(self._wait(lambda: self.pub.stats()['subscribers'][callback_name(stuck)]['queue'] == 2))
+        # Ждет публикующий, а шина продолжает работать
+        start = time.time()
+        self.pub.call('event', 3)
+        self.assertGreaterEqual(time.time() - start, 0.25)
+        self.pub.call('other', 0)
+        self.assertTrue(self._wait(lambda: fast == [0], timeout=0.2))
+        self.gate.set()
+        self.assertTrue(self._wait(lambda: result == [0, 2, 3]))
+
+    def test_error_log(self):
+        logs = []
+        self.pub.log = lambda msg, lvl: logs.append((msg, lvl))
+
+        def broken(*_):
+            raise ValueError('boom')
+        self.pub.subscribe('event', broken)
+        self.pub.call('event')
+        self.assertTrue(self._wait(lambda: logs))
+        self.assertEqual(logs[0][1], logger.ERROR)
+        self.assertIn('boom', logs[0][0])
@@ -0,0 +1,66 @@
+import socket
+import time
+import threading
+import unittest
+
+from lib.socket_wrapper import Connect
+
+
+class ConnectWrite(unittest.TestCase):
+    def test_write_many(self):
+        client, server = socket.socketpair()
+        conn = Connect(server, ('127.0.0.1', 1), None)
+        client.settimeout(5)
+        conn.write_many([{'id': 1}, 'два', b'', b'3'])
+        threads = [threading.Thread(target=conn.write, args=('x' * 1000,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        expected = '{"id":1}\r\nдва\r\n\r\n3\r\n'.encode() + b'x' * 1000 + b'\r\n'
+        data = b''
+        while len(data) < len(expected) + 7 * 1002:
+            data += client.recv(65536)
+        self.assertEqual(data[:len(expected)].replace(b'": ', b'":'), expected)
+        stats = conn.write_stats
+        self.assertEqual((stats['messages'], stats['bytes']), (12, len(data)))
+        self.assertLessEqual(stats['syscalls'], 9)
+        conn.close()
+        client.close()
+
+    def test_piggyback_error(self):
+        gate = threading.Event()
+
+        class _Sock:
+            calls = 0
+
+            def send(self, data):
+                self.calls += 1
+                if self.calls == 1:
+                    gate.wait(5)
+                    return len(data)
+                raise OSError('broken pipe')
+
+        conn = Connect(_Sock(), ('127.0.0.1', 1), None)
+        errors = []
+
+        def write(data):
+            try:
+                conn.write(data)
+            except RuntimeError as e:
+                errors.append((data, str(e)))
+        first = threading.Thread(target=write, args=('first',))
+        first.start()
+        while conn._conn.calls < 1:
+            time.sleep(0.01)
+        # Оба ждут сокет, отправит их одной записью кто-то один
+        threads = [threading.Thread(target=write, args=(name,)) for name in ('second', 'third')]
+        for thread in threads:
+            thread.start()
+        while len(conn._pending) < 2:
+            time.sleep(0.01)
+        gate.set()
+        for thread in [first] + threads:
+            thread.join(5)
+        self.assertEqual(sorted(errors), [('second', 'broken pipe'), ('third', 'broken pipe')])
+        self.assertEqual(conn._conn.calls, 2)
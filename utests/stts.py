@@ -0,0 +1,100 @@
+import io
+import time
+import unittest
+
+from stts import TextToSpeech, _SharedStream
+
+
+class _Cfg(dict):
+    def load_dict(self, name):
+        return self.get(name)
+
+    def save_dict(self, name, data):
+        self[name] = data
+
+
+class TTSStop(unittest.TestCase):
+    def test_stop_saves_usage(self):
+        logs = []
+        cfg = _Cfg({TextToSpeech.USAGE: {'привет': 2, 'мусор': 'x'}})
+        tts = TextToSpeech(cfg, lambda *args: logs.append(args))
+        tts._count('привет')
+        tts._count('пока')
+        tts.stop()
+        self.assertEqual(cfg[TextToSpeech.USAGE], {'привет': 3, 'пока': 1})
+        self.assertTrue(logs)
+
+
+class ChainedTTS(unittest.TestCase):
+    def test_lookahead_not_blocks(self):
+        cfg = _Cfg(providertts='google')
+        cfg.gts = cfg.get
+        tts = TextToSpeech(cfg, lambda *_: None)
+        calls = []
+
+        def submit(msg, **kwargs):
+            calls.append((msg, kwargs['block']))
+            return lambda: (None, io.BytesIO(msg.encode()), '.mp3')
+        tts._split = lambda *_: list('abcde')
+        tts._tts = submit
+        get = tts.tts('long', realtime=False)
+        # Упреждение уходит в пул сразу, никто не ждет ответа провайдера
+        self.assertEqual(calls, [(chunk, False) for chunk in 'abc'])
+        _, stream, _ = get()
+        self.assertEqual(b''.join(iter(stream.read, b'')), b'abcde')
+        tts.stop()
+
+
+class SharedStream(unittest.TestCase):
+    def test_no_readers_not_blocks(self):
+        # Прогрев: результат никто не забрал, синтез не ждет читателя
+        shared = _SharedStream(16)
+        for _ in range(100):
+            shared.write(b'x' * 16)
+        shared.close()
+        fp = shared.subscribe()
+        self.assertEqual(len(fp.read(10000)), 1600)
+        self.assertEqual(fp.read(), b'')
+        self.assertEqual(shared.stats['readers'], 1)
+
+    def test_closed_reader_dropped(self):
+        shared = _SharedStream(16)
+        fp = shared.subscribe()
+        shared.write(b'x' * 16)
+        fp.write(b'')
+        start = time.time()
+        shared.write(b'y' * 16)
+        shared.close()
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(shared.stats['readers'], 1)
+        self.assertEqual(shared.subscribe().read(100), b'x' * 16 + b'y' * 16)
+
+    def test_disk_replay_bounded(self):
+        shared = _SharedStream(16)
+        shared.start(True)
+        fp = shared.subscribe()
+        shared.write(b'x' * 16)
+        self.assertEqual(shared.stats['replay'], 16)
+        self.assertEqual(fp.read(100), b'x' * 16)
+        shared.write(b'y')
+        # Окно сброшено, опоздавший читает файл
+        self.assertIsNone(shared.stats['replay'])
+        self.assertIsNone(shared.subscribe())
+        shared.close()
+        self.assertEqual(fp.read(100), b'y')
+        self.assertEqual(fp.read(), b'')
+
+    def test_memory_replay_detach(self):
+        detached = []
+        shared = _SharedStream(16)
+        shared.start(False, lambda: detached.append(1))
+        shared.expect()
+        for _ in range(4):
+            shared.write(b'x' * 16)
+        # Новых не берем, но двое выданных еще не подписались
+        self.assertEqual(detached, [1])
+        self.assertEqual(shared.stats['replay'], 64)
+        shared.close()
+        self.assertEqual(shared.subscribe().read(100), b'x' * 64)
+        self.assertEqual(shared.subscribe().read(100), b'x' * 64)
+        self.assertIsNone(shared.stats['replay'])
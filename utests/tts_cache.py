@@ -0,0 +1,143 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from lib.tts_cache import OpusTranscoder, TTSCache, MANIFEST
+
+
+def sha1(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class TTSCacheIndex(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = self._dir.name
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, provider: str, text: str, ext='mp3', size=2048) -> str:
+        file_path = os.path.join(self.path, '{}_{}.{}'.format(provider, sha1(text), ext))
+        with open(file_path, 'wb') as fp:
+            fp.write(b'\0' * size)
+        return file_path
+
+    def test_load_and_find(self):
+        self._write('google', 'one')
+        self._write('yandex', 'two', 'opus')
+        broken = self._write('google', 'three', size=10)
+        cache = TTSCache()
+        self.assertEqual(cache.load(self.path), [os.path.basename(broken)])
+        self.assertFalse(os.path.isfile(broken))
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.find(sha1('one'), [('google', 'mp3')]))
+        self.assertIsNone(cache.find(sha1('one'), [('yandex', 'mp3')]))
+        self.assertTrue(cache.find(sha1('two'), [('google', 'mp3'), ('yandex', 'mp3'), ('yandex', 'opus')]))
+
+    def test_manifest(self):
+        self._write('google', 'one')
+        cache = TTSCache()
+        cache.load(self.path)
+        cache.save()
+        self.assertTrue(os.path.isfile(os.path.join(self.path, MANIFEST)))
+        os.remove(cache.find(sha1('one'), [('google', 'mp3')]))
+        self._write('google', 'two')
+        cache = TTSCache()
+        cache.load(self.path)
+        self.assertEqual(len(cache), 1)
+        self.assertIsNone(cache.find(sha1('one'), [('google', 'mp3')]))
+        self.assertTrue(cache.find(sha1('two'), [('google', 'mp3')]))
+
+    def test_path_normalized(self):
+        cache = TTSCache()
+        cache.load(self.path + os.sep + os.path.join('sub', os.pardir))
+        self.assertEqual(cache.path, os.path.abspath(self.path))
+        file_path = self._write('google', 'привет')
+        self.assertEqual(cache.add(file_path), [])
+        self.assertEqual(cache.find(sha1('привет'), [('google', 'mp3')]), file_path)
+        # Файл записан через путь из настроек как есть
+        other = self._write('yandex', 'пока')
+        self.assertEqual(cache.add(os.path.join(self.path + os.sep, os.path.basename(other))), [])
+        self.assertEqual(len(cache), 2)
+
+    def test_lru_eviction(self):
+        cache = TTSCache()
+        cache.load(self.path)
+        cache.max_size = 2048 * 3
+        first = self._write('google', 'first')
+        self.assertEqual(cache.add(first), [])
+        for text in ('second', 'third'):
+            cache.add(self._write('google', text))
+        # first теперь самый свежий
+        cache.find(sha1('first'), [('google', 'mp3')])
+        deleted = cache.add(self._write('google', 'fourth'))
+        # Чистим с запасом, до LOW_WATER
+        self.assertEqual(deleted, ['google_{}.mp3'.format(sha1(text)) for text in ('second', 'third')])
+        self.assertEqual(cache.size, 2048 * 2)
+        self.assertTrue(cache.find(sha1('first'), [('google', 'mp3')]))
+        self.assertIsNone(cache.find(sha1('second'), [('google', 'mp3')]))
+        self.assertEqual(cache.add(self._write('google', 'fifth')), [])
+
+    def test_transcoded(self):
+        mp3 = self._write('google', 'one')
+        cache = TTSCache()
+        cache.load(self.path)
+        self.assertEqual(cache.pending('opus'), [os.path.basename(mp3)])
+        opus = self._write('google', 'one', 'opus', size=1500)
+        self.assertTrue(cache.replace(os.path.basename(mp3), opus))
+        self.assertFalse(cache.replace(os.path.basename(mp3), opus))
+        self.assertEqual(cache.size, 1500)
+        self.assertEqual(cache.pending('opus'), [])
+        # Ищем по исходному формату, но не когда нужен именно mp3
+        self.assertEqual(cache.find(sha1('one'), [('google', 'mp3')]), opus)
+        self.assertIsNone(cache.find(sha1('one'), [('google', 'mp3')], exact=True))
+        os.remove(mp3)
+        cache.save()
+        cache = TTSCache()
+        cache.load(self.path)
+        self.assertEqual(cache.find(sha1('one'), [('google', 'mp3')]), opus)
+        # Свежий mp3 главнее перекодированного
+        cache.add(self._write('google', 'one'))
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.find(sha1('one'), [('google', 'mp3')]).endswith('.mp3'))
+        cache.discard(opus)
+        self.assertTrue(cache.find(sha1('one'), [('google', 'mp3')], exact=True))
+
+    def test_keep_format(self):
+        cache = TTSCache()
+        cache.load(self.path)
+        chunk, phrase = self._write('google', 'chunk'), self._write('google', 'phrase')
+        cache.add(chunk, keep=True)
+        cache.add(phrase)
+        self.assertEqual(cache.pending('opus'), [os.path.basename(phrase)])
+        # Понадобился именно mp3 - тоже не перекодируем
+        cache.find(sha1('phrase'), [('google', 'mp3')], exact=True)
+        self.assertEqual(cache.pending('opus'), [])
+        opus = self._write('google', 'phrase', 'opus', size=1500)
+        self.assertFalse(cache.replace(os.path.basename(phrase), opus))
+        cache.save()
+        cache = TTSCache()
+        cache.load(self.path)
+        self.assertEqual(cache.pending('opus'), [])
+        self.assertEqual(cache.find(sha1('chunk'), [('google', 'mp3')], exact=True), chunk)
+
+
+class OpusSkip(unittest.TestCase):
+    def test_skip_pruned(self):
+        class _Cache:
+            path = None
+            files = ['a.mp3', 'b.mp3']
+
+            def pending(self, _):
+                # Один проход без перекодирования
+                transcoder._work = False
+                transcoder._event.set()
+                return self.files
+
+        transcoder = OpusTranscoder(_Cache(), lambda *_: None)
+        transcoder._skip.update(('a.mp3', 'gone.mp3'))
+        transcoder._work = True
+        transcoder.run()
+        self.assertEqual(transcoder._skip, {'a.mp3'})
@@ -0,0 +1,42 @@
+import threading
+import unittest
+
+from lib import tts_pool
+
+
+class Job:
+    def __init__(self, provider, done: list, gate: threading.Event = None):
+        self.provider = provider
+        self._done = done
+        self._gate = gate
+        self.started = threading.Event()
+
+    def run(self):
+        self.started.set()
+        if self._gate:
+            self._gate.wait(5)
+        self._done.append(self)
+
+
+class TTSPool(unittest.TestCase):
+    def test_priority_and_provider_limit(self):
+        done, gate = [], threading.Event()
+        pool = tts_pool.TTSPool(workers=1, provider_limit=1, queue_limit=2)
+        blocker = Job('google', done, gate)
+        pool.submit(blocker, tts_pool.SAY)
+        self.assertTrue(blocker.started.wait(5))
+        low = Job('google', done)
+        pool.submit(low, tts_pool.PRE_SYNTHESIS)
+        high = Job('google', done)
+        pool.submit(high, tts_pool.LOW_SAY)
+        try:
+            self.assertTrue(pool.overloaded)
+            with self.assertRaises(tts_pool.TTSPoolOverloaded):
+                pool.submit(Job('google', done), tts_pool.PRE_SYNTHESIS)
+            # Озвучку не отбрасываем
+            say = Job('yandex', done)
+            pool.submit(say, tts_pool.SAY)
+        finally:
+            gate.set()
+            pool.join()
+        self.assertEqual(done, [blocker, say, high, low])
@@ -0,0 +1,50 @@
+import hashlib
+import io
+import os
+import socket
+import tempfile
+import unittest
+
+from lib.tts_cache import TTSCache
+from lib.tts_share import ShareClient, ShareServer
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TTSShare(unittest.TestCase):
+    def setUp(self):
+        self._dirs = [tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()]
+        self.cache = TTSCache()
+        self.cache.load(self._dirs[0].name)
+        self.server = ShareServer(self.cache, free_port(), lambda ip: True, lambda *_: None)
+        self.server.start()
+        self.client = ShareClient()
+        self.client.url = 'http://127.0.0.1:{}'.format(self.server.port)
+
+    def tearDown(self):
+        self.server.join()
+        for dir_ in self._dirs:
+            dir_.cleanup()
+
+    def test_fetch_and_upload(self):
+        sha1 = hashlib.sha1(b'text').hexdigest()
+        self.assertIsNone(self.client.fetch('google', sha1, 'mp3'))
+        file_path = os.path.join(self._dirs[1].name, 'google_{}.mp3'.format(sha1))
+        with open(file_path, 'wb') as fp:
+            fp.write(os.urandom(4096))
+        self.client._upload(file_path, None)
+        self.assertEqual(len(self.cache), 1)
+
+        fetch = self.client.fetch('google', sha1, 'mp3')
+        self.assertEqual(fetch.ext, 'mp3')
+        result = io.BytesIO()
+        fetch.stream_to_fps([result])
+        with open(file_path, 'rb') as fp:
+            self.assertEqual(result.getvalue(), fp.read())
+        self.assertIsNone(self.client.fetch('yandex', sha1, 'mp3'))
+        self.assertEqual(self.client.stats, {'hits': 1, 'misses': 2, 'errors': 0, 'uploads': 1})
+        self.assertEqual(self.server.stats, {'hits': 1, 'misses': 2, 'uploads': 1, 'rejected': 0})